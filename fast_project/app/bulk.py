@@ -0,0 +1,158 @@
+from collections import defaultdict
+
+from sqlalchemy import bindparam, select, update
+from sqlalchemy.orm import Session
+
+from . import crud, ingest, models, rollups, schemas
+
+# Bulk upsert for POST /netflix/titles/bulk.
+# The whole batch is handled with set-based statements instead of a lookup and an update per title:
+# the existing titles and their four lists are loaded with a few IN queries, the new values are
+# compared in memory, changed titles go out as one executemany UPDATE plus one bulk INSERT/DELETE
+# per junction (crud.reconcile_netflix_title_junctions) and new titles through the ingest loader.
+# One transaction for the batch, the stats rollups are adjusted inside it.
+
+MAX_ITEMS = 10000
+
+CREATED = "created"
+UPDATED = "updated"
+UNCHANGED = "unchanged"
+ERROR = "error"
+
+# compared as is, the junction lists are compared as sets (their order isn't stored)
+SCALAR_FIELDS = ["title_type", "title", "date_added", "release_year", "rating", "duration", "seasons", "description"]
+
+titles_table = models.NetflixTitle.__table__
+
+def title_row(netflix_title: schemas.NetflixTitleCreate):
+    # same keys as a parsed ingest row, raises ValueError for a bad date_added
+    return {
+        "show_id": netflix_title.show_id,
+        "title_type": netflix_title.title_type,
+        "title": netflix_title.title,
+        "directors": crud.unique_names(netflix_title.directors),
+        "cast": crud.unique_names(netflix_title.cast),
+        "countries": crud.unique_names(netflix_title.countries),
+        "date_added": crud.parse_date_added(netflix_title.date_added),
+        "release_year": netflix_title.release_year,
+        "rating": netflix_title.rating,
+        "duration": netflix_title.duration,
+        "seasons": netflix_title.seasons,
+        "categories": crud.unique_names(netflix_title.categories),
+        "description": netflix_title.description,
+    }
+
+def load_titles(db: Session, show_ids: list):
+    # returns (show_id -> state of the existing title, parsed row keys plus id,
+    #          junction row key -> title id -> set of dimension ids)
+    title = models.NetflixTitle
+    query = (
+        select(
+            title.id, title.show_id, models.NetflixTitleType.name.label("title_type"), title.title, title.date_added,
+            title.release_year, models.NetflixRating.name.label("rating"), title.duration, title.seasons, title.description,
+        )
+        .outerjoin(models.NetflixTitleType, title.title_type_id == models.NetflixTitleType.id)
+        .outerjoin(models.NetflixRating, title.rating_id == models.NetflixRating.id)
+    )
+    existing = {}
+    for batch in crud.batched(show_ids, crud.IN_CLAUSE_BATCH_SIZE):
+        for row in db.execute(query.where(title.show_id.in_(batch))).mappings():
+            existing[row["show_id"]] = dict(row, **{ key: [] for _, _, _, key in ingest.JUNCTIONS })
+    by_id = { state["id"]: state for state in existing.values() }
+
+    junction_ids = {}
+    for junction_model, foreign_key, dimension_model, key in ingest.JUNCTIONS:
+        junction_ids[key] = defaultdict(set)
+        query = (
+            select(junction_model.title_id, getattr(junction_model, foreign_key), dimension_model.name)
+            .join(dimension_model, getattr(junction_model, foreign_key) == dimension_model.id)
+        )
+        for batch in crud.batched(by_id, crud.IN_CLAUSE_BATCH_SIZE):
+            for title_id, dimension_id, name in db.execute(query.where(junction_model.title_id.in_(batch))):
+                by_id[title_id][key].append(name)
+                junction_ids[key][title_id].add(dimension_id)
+    return existing, junction_ids
+
+def is_unchanged(state: dict, row: dict):
+    return (
+        all(state[field] == row[field] for field in SCALAR_FIELDS)
+        and all(set(state[key]) == set(row[key]) for _, _, _, key in ingest.JUNCTIONS)
+    )
+
+def update_titles(db: Session, existing: dict, junction_ids: dict, rows: list):
+    title_type_ids = crud.resolve_netflix_dimension_ids(db, models.NetflixTitleType, {row["title_type"] for row in rows})
+    rating_ids = crud.resolve_netflix_dimension_ids(db, models.NetflixRating, {row["rating"] for row in rows})
+    dimension_ids = {
+        models.NetflixName: crud.resolve_netflix_dimension_ids(db, models.NetflixName, {name for row in rows for name in row["directors"] + row["cast"]}),
+        models.NetflixCountry: crud.resolve_netflix_dimension_ids(db, models.NetflixCountry, {name for row in rows for name in row["countries"]}),
+        models.NetflixCategory: crud.resolve_netflix_dimension_ids(db, models.NetflixCategory, {name for row in rows for name in row["categories"]}),
+    }
+
+    # the SET columns come from the parameter keys, updated_at is set by its onupdate
+    db.execute(update(titles_table).where(titles_table.c.id == bindparam("title_id")), [
+        {
+            "title_id": existing[row["show_id"]]["id"],
+            "title_type_id": title_type_ids.get(row["title_type"]),
+            "title": row["title"],
+            "date_added": row["date_added"],
+            "release_year": row["release_year"],
+            "rating_id": rating_ids.get(row["rating"]),
+            "duration": row["duration"],
+            "seasons": row["seasons"],
+            "description": row["description"],
+        }
+        for row in rows
+    ])
+
+    for junction_model, foreign_key, dimension_model, key in ingest.JUNCTIONS:
+        ids = dimension_ids[dimension_model]
+        desired = { existing[row["show_id"]]["id"]: { ids[name] for name in row[key] } for row in rows }
+        crud.reconcile_netflix_title_junctions(db, junction_model, foreign_key, junction_ids[key], desired)
+
+    rollups.apply_title_changes(db, [ existing[row["show_id"]] for row in rows ], rows)
+
+def upsert_netflix_titles(db: Session, netflix_titles: list):
+    # returns {created, updated, unchanged, errors, items} with one {show_id, status, detail} item per payload, in order
+    items = []
+    rows = {}
+    seen = set()
+    for netflix_title in netflix_titles:
+        item = {"show_id": netflix_title.show_id, "status": None, "detail": None}
+        items.append(item)
+        if netflix_title.show_id in seen:
+            item.update(status=ERROR, detail="show_id repeated in this batch")
+            continue
+        seen.add(netflix_title.show_id)
+        try:
+            rows[netflix_title.show_id] = title_row(netflix_title)
+        except ValueError as e:
+            item.update(status=ERROR, detail="Invalid date_added: %s" % e)
+
+    try:
+        existing, junction_ids = load_titles(db, list(rows))
+        new_rows = [ row for show_id, row in rows.items() if show_id not in existing ]
+        changed_rows = [ row for show_id, row in rows.items() if show_id in existing and not is_unchanged(existing[show_id], row) ]
+        if changed_rows:
+            update_titles(db, existing, junction_ids, changed_rows)
+        if new_rows:
+            ingest.ingest_chunk(db, new_rows)
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+
+    created = { row["show_id"] for row in new_rows }
+    updated = { row["show_id"] for row in changed_rows }
+    for item in items:
+        if item["status"] is None:
+            item["status"] = CREATED if item["show_id"] in created else UPDATED if item["show_id"] in updated else UNCHANGED
+    counts = defaultdict(int)
+    for item in items:
+        counts[item["status"]] += 1
+    return {
+        "created": counts[CREATED],
+        "updated": counts[UPDATED],
+        "unchanged": counts[UNCHANGED],
+        "errors": counts[ERROR],
+        "items": items,
+    }
@@ -0,0 +1,323 @@
+import hashlib
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session, object_session
+
+from . import models
+
+# In-process caches.  Everything here is per worker process - nothing is shared between uvicorn workers.
+
+class LRUCache:
+    # thread safe, bounded mapping with least recently used eviction and hit/miss counters
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value = self._data[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def update(self, items: dict):
+        for key, value in items.items():
+            self.set(key, value)
+
+    def pop(self, key, default=None):
+        with self._lock:
+            return self._data.pop(key, default)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+        }
+
+class TTLCache(LRUCache):
+    # LRUCache whose entries also expire ttl_seconds after being set (or sooner, see set)
+
+    def __init__(self, maxsize: int, ttl_seconds: float, clock=time.monotonic):
+        super().__init__(maxsize)
+        self.ttl_seconds = ttl_seconds
+        self.clock = clock
+        self.expirations = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and entry[1] <= self.clock():
+                del self._data[key]
+                self.expirations += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def set(self, key, value, ttl_seconds: float = None):
+        # ttl_seconds can only shorten the cache's ttl
+        ttl_seconds = self.ttl_seconds if ttl_seconds is None else min(ttl_seconds, self.ttl_seconds)
+        if ttl_seconds <= 0:
+            return
+        super().set(key, (value, self.clock() + ttl_seconds))
+
+    def pop(self, key, default=None):
+        entry = super().pop(key)
+        return default if entry is None else entry[0]
+
+    def stats(self):
+        stats = super().stats()
+        stats["ttl_seconds"] = self.ttl_seconds
+        stats["expirations"] = self.expirations
+        return stats
+
+
+# Dimension cache: (table name, name) -> id for the name/lookup tables
+# (netflix_names, netflix_countries, netflix_categories, netflix_ratings, netflix_title_types).
+# Those rows are never updated or deleted, so a committed name -> id pair stays valid.
+dimension_cache = LRUCache(maxsize=int(os.environ.get('DIMENSION_CACHE_SIZE', 50000)))
+
+# ids learned inside a transaction are parked on the session and only published to the shared
+# cache once that transaction commits, so a rolled back insert never leaks an id that doesn't exist
+PENDING_DIMENSION_IDS = "pending_dimension_ids"
+
+def dimension_key(model, name: str):
+    return (model.__tablename__, name)
+
+def get_dimension_id(db: Session, model, name: str):
+    key = dimension_key(model, name)
+    pending = db.info.get(PENDING_DIMENSION_IDS)
+    if pending and key in pending:
+        return pending[key]
+    return dimension_cache.get(key)
+
+def remember_dimension_id(db: Session, model, name: str, dimension_id: int):
+    db.info.setdefault(PENDING_DIMENSION_IDS, {})[dimension_key(model, name)] = dimension_id
+
+def warm_dimension_cache(db: Session, dimension_models):
+    # used at startup for the small enumerations (ratings, title types)
+    for model in dimension_models:
+        for name, dimension_id in db.query(model.name, model.id):
+            dimension_cache.set(dimension_key(model, name), dimension_id)
+
+@event.listens_for(Session, "after_commit")
+def publish_pending_dimension_ids(session):
+    pending = session.info.pop(PENDING_DIMENSION_IDS, None)
+    if pending:
+        dimension_cache.update(pending)
+
+@event.listens_for(Session, "after_transaction_end")
+def discard_pending_dimension_ids(session, transaction):
+    # rollback or close without commit - after_commit has already published anything committed
+    if transaction.parent is None:
+        session.info.pop(PENDING_DIMENSION_IDS, None)
+
+
+# Principal caches for authentication (see get_current_user in main.py)
+# token_cache: sha256 of a bearer token -> username, never kept past the token's own expiry
+# user_cache: username -> schemas.UserResponse snapshot
+# Users changed or deleted through the ORM are dropped from user_cache when the transaction commits,
+# so deactivating a user takes effect on the next request.  Other worker processes (and updates
+# that bypass the ORM) are bounded by PRINCIPAL_CACHE_TTL_SECONDS.
+PRINCIPAL_CACHE_SIZE = int(os.environ.get('PRINCIPAL_CACHE_SIZE', 10000))
+PRINCIPAL_CACHE_TTL_SECONDS = float(os.environ.get('PRINCIPAL_CACHE_TTL_SECONDS', 60))
+token_cache = TTLCache(maxsize=PRINCIPAL_CACHE_SIZE, ttl_seconds=PRINCIPAL_CACHE_TTL_SECONDS)
+user_cache = TTLCache(maxsize=PRINCIPAL_CACHE_SIZE, ttl_seconds=PRINCIPAL_CACHE_TTL_SECONDS)
+
+CHANGED_USERNAMES = "changed_usernames"
+
+def token_key(token: str):
+    # keep a digest rather than the bearer token itself
+    return hashlib.sha256(token.encode()).hexdigest()
+
+@event.listens_for(models.User, "after_update")
+@event.listens_for(models.User, "after_delete")
+def remember_changed_user(mapper, connection, target):
+    session = object_session(target)
+    if session is None:
+        return
+    # the old username too, when it was renamed
+    history = inspect(target).attrs.username.history
+    usernames = session.info.setdefault(CHANGED_USERNAMES, set())
+    usernames.update(username for username in [target.username, *history.deleted] if username is not None)
+
+@event.listens_for(Session, "after_commit")
+def forget_changed_users(session):
+    for username in session.info.pop(CHANGED_USERNAMES, None) or []:
+        user_cache.pop(username)
+
+@event.listens_for(Session, "after_transaction_end")
+def discard_changed_users(session, transaction):
+    # rolled back, the cached users are still right
+    if transaction.parent is None:
+        session.info.pop(CHANGED_USERNAMES, None)
+
+
+
+# Response cache: serialized JSON bodies for the title detail and list endpoints, with an ETag so
+# clients can revalidate with If-None-Match.  Bounded by total body bytes (LRU eviction) and a TTL.
+# The write endpoints invalidate it; other worker processes only see a write once their TTL expires.
+
+CachedResponse = namedtuple("CachedResponse", ["body", "etag", "headers", "expires_at"])
+
+def make_etag(body: bytes):
+    return '"%s"' % hashlib.blake2b(body, digest_size=16).hexdigest()
+
+def etag_matches(if_none_match: str, etag: str):
+    if not if_none_match:
+        return False
+    candidates = [ candidate.strip() for candidate in if_none_match.split(",") ]
+    # weak comparison, W/"x" matches "x"
+    return "*" in candidates or etag in [ candidate[2:] if candidate.startswith("W/") else candidate for candidate in candidates ]
+
+class ResponseCache:
+
+    def __init__(self, max_bytes: int, ttl_seconds: float, clock=time.monotonic):
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.clock = clock
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+        # bumped by every invalidation, see set()
+        self.generation = 0
+
+    @staticmethod
+    def entry_size(key, cached: CachedResponse):
+        # close enough for sizing: the body plus the key and headers
+        return len(cached.body) + sys.getsizeof(key) + sum(len(name) + len(value) for name, value in cached.headers.items())
+
+    def _remove(self, key):
+        cached = self._data.pop(key)
+        self.bytes -= self.entry_size(key, cached)
+
+    def get(self, key):
+        with self._lock:
+            cached = self._data.get(key)
+            if cached is not None and cached.expires_at <= self.clock():
+                self._remove(key)
+                self.expirations += 1
+                cached = None
+            if cached is None:
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return cached
+
+    def set(self, key, body: bytes, headers: dict = None, generation: int = None, store: bool = True, ttl_seconds: float = None):
+        # pass the generation read before querying the database: if a write invalidated the cache
+        # while the response was being built, it may be stale and isn't stored
+        # store=False only builds the entry (for its etag)
+        # ttl_seconds shortens the entry's lifetime, e.g. to the replication lag window for a body read from a replica
+        ttl_seconds = self.ttl_seconds if ttl_seconds is None else min(ttl_seconds, self.ttl_seconds)
+        cached = CachedResponse(body, make_etag(body), headers or {}, self.clock() + ttl_seconds)
+        size = self.entry_size(key, cached)
+        if not store or size > self.max_bytes or ttl_seconds <= 0:
+            # too big to keep (or caching is off), still hand back the etag
+            return cached
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                return cached
+            if key in self._data:
+                self._remove(key)
+            self._data[key] = cached
+            self.bytes += size
+            while self.bytes > self.max_bytes:
+                self._remove(next(iter(self._data)))
+                self.evictions += 1
+        return cached
+
+    def invalidate(self, predicate):
+        # drop every entry whose key matches predicate(key)
+        with self._lock:
+            self.generation += 1
+            for key in [ key for key in self._data if predicate(key) ]:
+                self._remove(key)
+                self.invalidations += 1
+
+    def clear(self):
+        self.invalidate(lambda key: True)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._data),
+            "bytes": self.bytes,
+            "max_bytes": self.max_bytes,
+            "ttl_seconds": self.ttl_seconds,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "invalidations": self.invalidations,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+        }
+
+# RESPONSE_CACHE_MAX_BYTES=0 turns response caching off
+response_cache = ResponseCache(
+    max_bytes=int(os.environ.get('RESPONSE_CACHE_MAX_BYTES', 32 * 1024 * 1024)),
+    ttl_seconds=float(os.environ.get('RESPONSE_CACHE_TTL_SECONDS', 60)),
+)
+
+TITLE_KEY = "title"
+TITLE_LIST_KEY = "titles"
+
+def netflix_title_key(show_id: str, **params):
+    # show_id stays second, invalidate_netflix_titles matches on it
+    params = tuple(sorted((name, value) for name, value in params.items() if value is not None))
+    return (TITLE_KEY, show_id, params) if params else (TITLE_KEY, show_id)
+
+def netflix_title_list_key(**params):
+    # params with None dropped and sorted so equivalent requests share an entry
+    return (TITLE_LIST_KEY, tuple(sorted((name, value) for name, value in params.items() if value is not None)))
+
+def invalidate_netflix_titles(show_ids=None):
+    # a write can change any list page, but only the detail entries of the titles it touched
+    # show_ids=None drops every detail entry too (bulk loads)
+    show_ids = None if show_ids is None else set(show_ids)
+    response_cache.invalidate(
+        lambda key: key[0] == TITLE_LIST_KEY or (key[0] == TITLE_KEY and (show_ids is None or key[1] in show_ids))
+    )
@@ -1,19 +1,18 @@
 import hashlib
+from collections import defaultdict
 from datetime import datetime
 
-from sqlalchemy import select, or_
-from sqlalchemy.orm import Session
+from sqlalchemy import delete, select, insert, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session, joinedload, make_transient_to_detached, selectinload
+from sqlalchemy.orm.attributes import set_committed_value
 
-from passlib.context import CryptContext
-
-from . import models, schemas
+from . import cache, fulltext, hashing, metrics, models, pagination, rollups, schemas
 
 # import models, schemas
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
-
 def get_password_hash(password):
-    return pwd_context.hash(password)
+    return hashing.hash_password(password)
 
 def get_user(db: Session, user_id: int):
     return db.query(models.User).filter(models.User.id == user_id).first()
@@ -40,343 +39,499 @@ def create_user(db: Session, user: schemas.UserCreate):
     db.refresh(db_user)
     return db_user
 
-def get_netflix_title_by_show_id(db: Session, show_id: str):
-    return db.query(models.NetflixTitle).filter(models.NetflixTitle.show_id == show_id).first()
+# Everything NetflixTitleResponse serializes, loaded up front: title type and rating are joined into
+# the main query and each collection is one batched IN query for the whole page, so a page costs
+# the same handful of statements whatever the limit (instead of lazy loads per row)
+netflix_title_load_options = (
+    joinedload(models.NetflixTitle._title_type),
+    joinedload(models.NetflixTitle._rating),
+    selectinload(models.NetflixTitle.directors),
+    selectinload(models.NetflixTitle.cast),
+    selectinload(models.NetflixTitle.countries),
+    selectinload(models.NetflixTitle.categories),
+)
 
-def get_netflix_titles(db: Session, skip: int = 0, limit: int = 100, search: str = None, netflix_title_filter = None):
-    #query = db.query(models.NetflixTitle).offset(skip).limit(limit).all()
-    query = select(models.NetflixTitle).offset(skip).limit(limit)
+def get_netflix_title_by_show_id(db: Session, show_id: str):
+    return db.query(models.NetflixTitle).options(*netflix_title_load_options).filter(models.NetflixTitle.show_id == show_id).first()
+
+def get_netflix_title_sort_keys(netflix_title_filter):
+    return pagination.get_sort_keys(models.NetflixTitle, pagination.get_ordering_values(netflix_title_filter))
+
+def netflix_title_page_query(query, sort_keys, skip: int = 0, limit: int = 100, search: str = None, netflix_title_filter = None, cursor: str = None,
+                             title_weight: float = fulltext.DEFAULT_TITLE_WEIGHT, description_weight: float = fulltext.DEFAULT_DESCRIPTION_WEIGHT, bind = None):
+    # filter, search, order and page query (a select of NetflixTitle or of its columns)
+    # with a cursor (see next_netflix_title_cursor) the page seeks past the cursor row and skip is ignored
+    query = query.limit(limit)
+    if cursor:
+        query = query.where(pagination.seek_clause(sort_keys, pagination.decode_cursor(cursor, sort_keys)))
+    else:
+        query = query.offset(skip)
     query = netflix_title_filter.filter(query)
+    relevance = None
     if search is not None:
-        search = "%%%s%%" % search
-        # Reference: https://stackoverflow.com/questions/7942547/using-or-in-sqlalchemy
-        #search_columns = [models.NetflixTitle.title, models.NetflixTitle.description]
-        #for search_col in search_columns:
-        #    query = query.filter(search_col.ilike(search))
-        #    query = query.filter(search_col.ilike(search))
-        search_filters = [
-            models.NetflixTitle.title.ilike(search),
-            models.NetflixTitle.description.ilike(search),
-        ]
-        query = query.filter(or_(*search_filters))
-    query = netflix_title_filter.sort(query)
+        query, relevance = fulltext.get_search_backend(bind).apply(query, search, title_weight, description_weight,
+                                                                   ranked=is_relevance_ordered(search, netflix_title_filter, cursor))
+    if relevance is not None:
+        # best matches first when the caller didn't ask for an order
+        return query.order_by(relevance.desc(), models.NetflixTitle.id)
+    # same ordering in offset and cursor mode (id as tie breaker) so either mode can hand over to the other
+    return query.order_by(*pagination.order_by_clauses(sort_keys))
+
+def get_netflix_titles(db: Session, skip: int = 0, limit: int = 100, search: str = None, netflix_title_filter = None, cursor: str = None,
+                       title_weight: float = fulltext.DEFAULT_TITLE_WEIGHT, description_weight: float = fulltext.DEFAULT_DESCRIPTION_WEIGHT):
+    sort_keys = get_netflix_title_sort_keys(netflix_title_filter)
+    annotate_netflix_title_query(search, netflix_title_filter, skip=None if cursor else skip, limit=limit, cursor=cursor)
+    #query = db.query(models.NetflixTitle).offset(skip).limit(limit).all()
+    query = select(models.NetflixTitle).options(*netflix_title_load_options)
+    query = netflix_title_page_query(query, sort_keys, skip=skip, limit=limit, search=search, netflix_title_filter=netflix_title_filter, cursor=cursor,
+                                     title_weight=title_weight, description_weight=description_weight, bind=db.get_bind())
     query = db.execute(query).scalars().all()
 
     return query
 
-def find_or_create_netflix_name(db: Session, name: str):
-    db_netflix_name = db.query(models.NetflixName).filter(models.NetflixName.name == name).first()
-    if not(db_netflix_name):
-        db_netflix_name = models.NetflixName(
+# format=compact and fields=... (see main.read_netflix_titles): titles read as row tuples - one query for the
+# requested columns plus one per requested list for the page's ids - with no ORM instances or pydantic models
+# in between, which is where most of a full page's CPU goes.  Title type and rating are only joined, and the
+# junctions only queried, when asked for, so e.g. fields=show_id,title,release_year is a single query.
+NETFLIX_TITLE_COLUMNS = [
+    models.NetflixTitle.id,
+    models.NetflixTitle.show_id,
+    models.NetflixTitleType.name.label("title_type"),
+    models.NetflixTitle.title,
+    models.NetflixTitle.date_added,
+    models.NetflixTitle.release_year,
+    models.NetflixRating.name.label("rating"),
+    models.NetflixTitle.duration,
+    models.NetflixTitle.seasons,
+    models.NetflixTitle.description,
+    models.NetflixTitle.created_at,
+    models.NetflixTitle.updated_at,
+]
+NETFLIX_TITLE_LIST_FIELDS = ["directors", "cast", "countries", "categories"]
+# every field of NetflixTitleResponse / NetflixTitleCompactResponse, in response order
+NETFLIX_TITLE_FIELDS = [ column.key for column in NETFLIX_TITLE_COLUMNS ] + NETFLIX_TITLE_LIST_FIELDS
+
+def parse_netflix_title_fields(fields: str = None):
+    # "show_id,title" -> the fields in NETFLIX_TITLE_FIELDS order, None -> all of them
+    if fields is None:
+        return NETFLIX_TITLE_FIELDS
+    requested = { field.strip() for field in fields.split(",") if field.strip() }
+    unknown = requested.difference(NETFLIX_TITLE_FIELDS)
+    if unknown or not requested:
+        raise ValueError("fields must be a comma separated list of %s" % ", ".join(NETFLIX_TITLE_FIELDS))
+    return [ field for field in NETFLIX_TITLE_FIELDS if field in requested ]
+
+def netflix_title_columns_query(fields: list, extra_columns: list = ()):
+    # select of the scalar fields plus extra_columns (each column once), joining only the dimensions needed
+    columns = [ column for column in NETFLIX_TITLE_COLUMNS if column.key in fields ]
+    selected = { column.key for column in columns }
+    for column in extra_columns:
+        if column.key not in selected:
+            columns.append(column)
+            selected.add(column.key)
+    query = select(*columns).select_from(models.NetflixTitle)
+    if "title_type" in fields:
+        query = query.outerjoin(models.NetflixTitleType, models.NetflixTitle.title_type_id == models.NetflixTitleType.id)
+    if "rating" in fields:
+        query = query.outerjoin(models.NetflixRating, models.NetflixTitle.rating_id == models.NetflixRating.id)
+    return query
+
+def get_netflix_title_names(db: Session, title_ids: list, keys: list = NETFLIX_TITLE_LIST_FIELDS, with_ids: bool = False):
+    # relationship name (directors, cast, countries, categories) -> title id -> names, in primary key order
+    # with_ids gives {"name", "id"} items like NetflixNameResponse instead of plain names
+    names = { key: defaultdict(list) for key in keys }
+    if not title_ids:
+        return names
+    for junction_model, foreign_key, dimension_model, key in NETFLIX_TITLE_JUNCTIONS:
+        if key not in names:
+            continue
+        foreign_key_column = getattr(junction_model, foreign_key)
+        for batch in batched(title_ids, IN_CLAUSE_BATCH_SIZE):
+            query = (
+                select(junction_model.title_id, dimension_model.name, dimension_model.id)
+                .join(dimension_model, foreign_key_column == dimension_model.id)
+                .where(junction_model.title_id.in_(batch))
+                .order_by(junction_model.title_id, foreign_key_column)
+            )
+            for title_id, name, dimension_id in db.execute(query):
+                names[key][title_id].append({"name": name, "id": dimension_id} if with_ids else name)
+    return names
+
+def get_netflix_title_rows(db: Session, fields: list = NETFLIX_TITLE_FIELDS, with_ids: bool = False, skip: int = 0, limit: int = 100, search: str = None,
+                           netflix_title_filter = None, cursor: str = None,
+                           title_weight: float = fulltext.DEFAULT_TITLE_WEIGHT, description_weight: float = fulltext.DEFAULT_DESCRIPTION_WEIGHT):
+    # (rows, names): the page as rows of the requested columns plus the sort keys (for next_netflix_title_cursor,
+    # id is always one), and get_netflix_title_names of the requested lists for the page
+    sort_keys = get_netflix_title_sort_keys(netflix_title_filter)
+    annotate_netflix_title_query(search, netflix_title_filter, skip=None if cursor else skip, limit=limit, cursor=cursor)
+    query = netflix_title_columns_query(fields, [ column for column, _ in sort_keys ])
+    query = netflix_title_page_query(query, sort_keys, skip=skip, limit=limit, search=search, netflix_title_filter=netflix_title_filter, cursor=cursor,
+                                     title_weight=title_weight, description_weight=description_weight, bind=db.get_bind())
+    rows = db.execute(query).all()
+    lists = [ field for field in fields if field in NETFLIX_TITLE_LIST_FIELDS ]
+    return rows, get_netflix_title_names(db, [ row.id for row in rows ], lists, with_ids) if lists else {}
+
+def get_netflix_title_row_by_show_id(db: Session, show_id: str, fields: list = NETFLIX_TITLE_FIELDS, with_ids: bool = False):
+    # (row or None, names) for one title, like get_netflix_title_rows
+    query = netflix_title_columns_query(fields, [models.NetflixTitle.id]).where(models.NetflixTitle.show_id == show_id)
+    row = db.execute(query).first()
+    lists = [ field for field in fields if field in NETFLIX_TITLE_LIST_FIELDS ]
+    if row is None or not lists:
+        return row, {}
+    return row, get_netflix_title_names(db, [row.id], lists, with_ids)
+
+def netflix_title_fields_dict(row, fields: list, names: dict):
+    # the response dict of the requested fields for a row of get_netflix_title_rows
+    return { field: names[field].get(row.id, []) if field in names else getattr(row, field) for field in fields }
+
+def annotate_netflix_title_query(search: str = None, netflix_title_filter = None, **values):
+    # what the statements of this request were built from, logged with them when they are slow (see slow_queries.py)
+    if netflix_title_filter is not None:
+        values["filter"] = netflix_title_filter.dict(exclude_none=True)
+    if search is not None:
+        values["search"] = search
+    metrics.annotate(**{ name: value for name, value in values.items() if value is not None })
+
+def has_netflix_title_filter(netflix_title_filter):
+    return bool({ name: value for name, value in netflix_title_filter.dict(exclude_none=True).items() if name != "order_by" })
+
+def is_unfiltered(search: str = None, netflix_title_filter = None):
+    return search is None and (netflix_title_filter is None or not has_netflix_title_filter(netflix_title_filter))
+
+def netflix_title_ids(db: Session, search: str = None, netflix_title_filter = None):
+    # subquery of the ids of the titles matching the filter and search
+    annotate_netflix_title_query(search, netflix_title_filter)
+    query = select(models.NetflixTitle.id)
+    if netflix_title_filter is not None:
+        query = netflix_title_filter.filter(query)
+    if search is not None:
+        query, _ = fulltext.get_search_backend(db.get_bind()).apply(query, search, ranked=False)
+    return query
+
+def get_netflix_stats(db: Session, search: str = None, netflix_title_filter = None):
+    # unfiltered summaries come straight from the rollups, filtered ones are aggregated over the matching titles
+    if is_unfiltered(search, netflix_title_filter):
+        return rollups.get_rollup_stats(db)
+    return rollups.get_live_stats(db, netflix_title_ids(db, search, netflix_title_filter))
+
+def get_netflix_facets(db: Session, facets: list, search: str = None, netflix_title_filter = None):
+    # counts per key for each of the facets (rollups.DIMENSIONS) over the titles matching the filter and search
+    if is_unfiltered(search, netflix_title_filter):
+        return rollups.get_rollup_facets(db, facets)
+    return rollups.get_live_facets(db, facets, netflix_title_ids(db, search, netflix_title_filter))
+
+def is_relevance_ordered(search: str, netflix_title_filter, cursor: str = None):
+    return search is not None and not cursor and not pagination.get_ordering_values(netflix_title_filter)
+
+def next_netflix_title_cursor(netflix_titles: list, limit: int, netflix_title_filter = None, search: str = None):
+    # opaque cursor for the page after netflix_titles, None when this was the last page
+    # relevance ranked pages have no sort key to seek on, page those with skip or pass an order_by
+    if not netflix_titles or len(netflix_titles) < limit:
+        return None
+    if is_relevance_ordered(search, netflix_title_filter):
+        return None
+    return pagination.encode_cursor(netflix_titles[-1], get_netflix_title_sort_keys(netflix_title_filter))
+
+# SQLite caps bound parameters per statement (999 on older builds), keep IN lists below that
+IN_CLAUSE_BATCH_SIZE = 500
+
+def batched(items, size: int):
+    items = list(items)
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+def resolve_netflix_dimension_ids(db: Session, model, names):
+    # set-based find or create for the name dimension tables (names, countries, categories, ratings, title types)
+    # cached names are skipped, then one select for the known names and one multi-row insert for the missing ones
+    # no commit - caller owns the transaction
+    ids = {}
+    uncached = set()
+    for name in {name for name in names if name is not None}:
+        dimension_id = cache.get_dimension_id(db, model, name)
+        if dimension_id is None:
+            uncached.add(name)
+        else:
+            ids[name] = dimension_id
+    found = {}
+    for batch in batched(uncached, IN_CLAUSE_BATCH_SIZE):
+        found.update(db.execute(select(model.name, model.id).where(model.name.in_(batch))).all())
+    missing = uncached - found.keys()
+    if missing:
+        db.execute(insert(model), [{"name": name} for name in missing])
+        for batch in batched(missing, IN_CLAUSE_BATCH_SIZE):
+            found.update(db.execute(select(model.name, model.id).where(model.name.in_(batch))).all())
+    for name, dimension_id in found.items():
+        cache.remember_dimension_id(db, model, name, dimension_id)
+    ids.update(found)
+    return ids
+
+# junction model, junction foreign key, dimension model and the NetflixTitle relationship for each many to many
+NETFLIX_TITLE_JUNCTIONS = [
+    (models.NetflixTitleDirectorJunction, "director_id", models.NetflixName, "directors"),
+    (models.NetflixTitleCastJunction, "cast_id", models.NetflixName, "cast"),
+    (models.NetflixTitleCountryJunction, "country_id", models.NetflixCountry, "countries"),
+    (models.NetflixTitleCategoryJunction, "category_id", models.NetflixCategory, "categories"),
+]
+
+def reconcile_netflix_title_junctions(db: Session, junction_model, foreign_key: str, current: dict, desired: dict):
+    # current and desired map title id -> set of dimension ids for one junction table
+    # one pass over the diff, then at most one multi-row DELETE and one multi-row INSERT
+    # returns (inserted, deleted) - no commit, caller owns the transaction
+    foreign_key_column = getattr(junction_model, foreign_key)
+    added = []
+    removed = []
+    for title_id, dimension_ids in desired.items():
+        existing_ids = current.get(title_id, set())
+        added += [ {"title_id": title_id, foreign_key: dimension_id} for dimension_id in dimension_ids - existing_ids ]
+        removed += [ (title_id, dimension_id) for dimension_id in existing_ids - dimension_ids ]
+    # two parameters per pair
+    for batch in batched(removed, IN_CLAUSE_BATCH_SIZE // 2):
+        db.execute(delete(junction_model).where(tuple_(junction_model.title_id, foreign_key_column).in_(batch)))
+    if added:
+        db.execute(insert(junction_model), added)
+    return len(added), len(removed)
+
+def attach_netflix_dimension(db: Session, model, dimension_id: int, name: str):
+    # persistent instance for a known id without a round trip
+    db_dimension = model(id=dimension_id, name=name)
+    make_transient_to_detached(db_dimension)
+    return db.merge(db_dimension, load=False)
+
+def find_or_create_netflix_dimension(db: Session, model, name: str):
+    dimension_id = cache.get_dimension_id(db, model, name)
+    if dimension_id is not None:
+        return attach_netflix_dimension(db, model, dimension_id, name)
+
+    db_dimension = db.query(model).filter(model.name == name).first()
+    if not(db_dimension):
+        db_dimension = model(
             name = name,
         )
-        db.add(db_netflix_name)
-        db.commit()
-        db.refresh(db_netflix_name)
-    return db_netflix_name
+        db.add(db_dimension)
+        # flush rather than commit: assigns the id and makes the row visible to the rest of
+        # this transaction, the calling write path commits once
+        db.flush()
+    cache.remember_dimension_id(db, model, name, db_dimension.id)
+    return db_dimension
+
+def find_or_create_netflix_name(db: Session, name: str):
+    return find_or_create_netflix_dimension(db, models.NetflixName, name)
 
 def find_or_create_netflix_category(db: Session, name: str):
-    db_netflix_category = db.query(models.NetflixCategory).filter(models.NetflixCategory.name == name).first()
-    if not(db_netflix_category):
-        db_netflix_category = models.NetflixCategory(
-            name = name,
-        )
-        db.add(db_netflix_category)
-        db.commit()
-        db.refresh(db_netflix_category)
-    return db_netflix_category
+    return find_or_create_netflix_dimension(db, models.NetflixCategory, name)
 
 def find_or_create_netflix_country(db: Session, name: str):
-    db_netflix_country = db.query(models.NetflixCountry).filter(models.NetflixCountry.name == name).first()
-    if not(db_netflix_country):
-        db_netflix_country = models.NetflixCountry(
-            name = name,
-        )
-        db.add(db_netflix_country)
-        db.commit()
-        db.refresh(db_netflix_country)
-    return db_netflix_country
+    return find_or_create_netflix_dimension(db, models.NetflixCountry, name)
 
 def find_or_create_netflix_title_type(db: Session, name: str):
-    db_netflix_title_type = db.query(models.NetflixTitleType).filter(models.NetflixTitleType.name == name).first()
-    if not(db_netflix_title_type):
-        db_netflix_title_type = models.NetflixTitleType(
-            name = name,
-        )
-        db.add(db_netflix_title_type)
-        db.commit()
-        db.refresh(db_netflix_title_type)
-    return db_netflix_title_type
+    return find_or_create_netflix_dimension(db, models.NetflixTitleType, name)
 
 def find_or_create_netflix_rating(db: Session, name: str):
-    db_netflix_rating = db.query(models.NetflixRating).filter(models.NetflixRating.name == name).first()
-    if not(db_netflix_rating):
-        db_netflix_rating = models.NetflixRating(
-            name = name,
-        )
-        db.add(db_netflix_rating)
-        db.commit()
-        db.refresh(db_netflix_rating)
-    return db_netflix_rating
-
-def find_or_create_netflix_title_director_junction(db: Session, title_id: int, director_id: int):
-    db_title_director_junction = db.query(models.NetflixTitleDirectorJunction).filter(models.NetflixTitleDirectorJunction.title_id == title_id).filter(models.NetflixTitleDirectorJunction.director_id == director_id).first()
-    if not(db_title_director_junction):
-        db_title_director_junction = models.NetflixTitleDirectorJunction(
-            title_id=title_id,
-            director_id=director_id
-        )
-        db.add(db_title_director_junction)
-        db.commit()
-        db.refresh(db_title_director_junction)
-    return db_title_director_junction
-
-def delete_netflix_title_director_junction(db: Session, title_id: int, director_id: int):
-    #junction = db.query(models.NetflixTitleDirectorJunction).filter(models.NetflixTitleDirectorJunction.title_id == title_id).filter(models.NetflixTitleDirectorJunction.director_id == director_id).first()
-    result = db.query(models.NetflixTitleDirectorJunction).filter(models.NetflixTitleDirectorJunction.title_id == title_id).filter(models.NetflixTitleDirectorJunction.director_id == director_id).delete()
-    db.commit()
-    return result
-
-def find_or_create_netflix_title_cast_junction(db: Session, title_id: int, cast_id: int):
-    db_title_cast_junction = db.query(models.NetflixTitleCastJunction).filter(models.NetflixTitleCastJunction.title_id == title_id).filter(models.NetflixTitleCastJunction.cast_id == cast_id).first()
-    if not(db_title_cast_junction):
-        db_title_cast_junction = models.NetflixTitleCastJunction(
-            title_id=title_id,
-            cast_id=cast_id
-        )
-        db.add(db_title_cast_junction)
-        db.commit()
-        db.refresh(db_title_cast_junction)
-    return db_title_cast_junction
+    return find_or_create_netflix_dimension(db, models.NetflixRating, name)
+
+def warm_netflix_dimension_cache(db: Session):
+    # ratings and title types are a handful of rows, load them all up front
+    cache.warm_dimension_cache(db, [models.NetflixRating, models.NetflixTitleType])
+
+def unique_names(names):
+    # drop repeated names (keeping order) so a title is never linked to the same row twice
+    return list(dict.fromkeys(name for name in names if name is not None))
+
+def parse_date_added(date_added: str):
+    #example date_added: March 15, 2017
+    return datetime.strptime(date_added, '%B %d, %Y').date() if date_added is not None else None
+
+def resolve_netflix_title_lists(db: Session, lists: dict):
+    # lists: relationship name (directors, cast, countries, categories) -> names
+    # returns relationship name -> attached dimension instances, with one set-based lookup per dimension table
+    names = defaultdict(set)
+    for _, _, dimension_model, key in NETFLIX_TITLE_JUNCTIONS:
+        if key in lists:
+            names[dimension_model].update(unique_names(lists[key]))
+    ids = { dimension_model: resolve_netflix_dimension_ids(db, dimension_model, dimension_names) for dimension_model, dimension_names in names.items() }
+    return {
+        key: [ attach_netflix_dimension(db, dimension_model, ids[dimension_model][name], name) for name in unique_names(lists[key]) ]
+        for _, _, dimension_model, key in NETFLIX_TITLE_JUNCTIONS
+        if key in lists
+    }
+
+def set_netflix_title_lists(db: Session, db_netflix_title: models.NetflixTitle, lists: dict, append: bool = False):
+    # replaces (or with append=True extends) the given relationships of a persistent title
+    # the junction rows are diffed as id sets and written with at most one DELETE and one INSERT
+    # per relationship (reconcile_netflix_title_junctions); the loaded collections are then set to
+    # the new members directly, so nothing has to be reloaded for the response
+    resolved = resolve_netflix_title_lists(db, lists)
+    for junction_model, foreign_key, _, key in NETFLIX_TITLE_JUNCTIONS:
+        if key not in resolved:
+            continue
+        current = getattr(db_netflix_title, key)
+        desired = resolved[key]
+        if append:
+            current_ids = { db_item.id for db_item in current }
+            desired = current + [ db_item for db_item in desired if db_item.id not in current_ids ]
+        reconcile_netflix_title_junctions(db, junction_model, foreign_key,
+                                          { db_netflix_title.id: { db_item.id for db_item in current } },
+                                          { db_netflix_title.id: { db_item.id for db_item in desired } })
+        set_committed_value(db_netflix_title, key, desired)
+
+# Write paths below are one unit of work: dimension rows are resolved set-based and inserted (not
+# committed) when missing, junction rows go out as batched inserts/deletes, and everything is
+# committed (or rolled back) once at the end.
+# The stats rollups are adjusted inside the same transaction (see rollups.py).
+
+def netflix_title_lists(netflix_title):
+    return {
+        "directors": netflix_title.directors,
+        "cast": netflix_title.cast,
+        "countries": netflix_title.countries,
+        "categories": netflix_title.categories,
+    }
 
-def delete_netflix_title_cast_junction(db: Session, title_id: int, cast_id: int):
-    result = db.query(models.NetflixTitleCastJunction).filter(models.NetflixTitleCastJunction.title_id == title_id).filter(models.NetflixTitleCastJunction.cast_id == cast_id).delete()
-    db.commit()
-    return result
-
-def find_or_create_netflix_title_country_junction(db: Session, title_id: int, country_id: int):
-    db_title_country_junction = db.query(models.NetflixTitleCountryJunction).filter(models.NetflixTitleCountryJunction.title_id == title_id).filter(models.NetflixTitleCountryJunction.country_id == country_id).first()
-    if not(db_title_country_junction):
-        db_title_country_junction = models.NetflixTitleCountryJunction(
-            title_id=title_id,
-            country_id=country_id
+def create_netflix_title(db: Session, netflix_title: schemas.NetflixTitleCreate):
+    try:
+        # a new title has no junction rows to diff, the unit of work inserts them with the title
+        db_netflix_title = models.NetflixTitle(
+            show_id=netflix_title.show_id,
+            title=netflix_title.title,
+            _title_type=find_or_create_netflix_title_type(db, netflix_title.title_type),
+            date_added=parse_date_added(netflix_title.date_added),
+            release_year=netflix_title.release_year,
+            _rating=find_or_create_netflix_rating(db, netflix_title.rating) if netflix_title.rating is not None else None,
+            duration=netflix_title.duration,
+            seasons=netflix_title.seasons,
+            description=netflix_title.description,
+            **resolve_netflix_title_lists(db, netflix_title_lists(netflix_title)),
         )
-        db.add(db_title_country_junction)
+        db.add(db_netflix_title)
+        rollups.apply_title_changes(db, [], [rollups.title_state(db_netflix_title)])
         db.commit()
-        db.refresh(db_title_country_junction)
-    return db_title_country_junction
+    except Exception:
+        db.rollback()
+        raise
 
-def delete_netflix_title_country_junction(db: Session, title_id: int, country_id: int):
-    result = db.query(models.NetflixTitleCountryJunction).filter(models.NetflixTitleCountryJunction.title_id == title_id).filter(models.NetflixTitleCountryJunction.country_id == country_id).delete()
-    db.commit()
-    return result
-
-def find_or_create_netflix_title_category_junction(db: Session, title_id: int, category_id: int):
-    db_title_category_junction = db.query(models.NetflixTitleCategoryJunction).filter(models.NetflixTitleCategoryJunction.title_id == title_id).filter(models.NetflixTitleCategoryJunction.category_id == category_id).first()
-    if not(db_title_category_junction):
-        db_title_category_junction = models.NetflixTitleCategoryJunction(
-            title_id=title_id,
-            category_id=category_id
-        )
-        db.add(db_title_category_junction)
-        db.commit()
-        db.refresh(db_title_category_junction)
-    return db_title_category_junction
+    #return title
+    return db_netflix_title
 
-def delete_netflix_title_category_junction(db: Session, title_id: int, category_id: int):
-    result = db.query(models.NetflixTitleCategoryJunction).filter(models.NetflixTitleCategoryJunction.title_id == title_id).filter(models.NetflixTitleCategoryJunction.category_id == category_id).delete()
-    db.commit()
-    return result
 
-def create_netflix_title(db: Session, netflix_title: schemas.NetflixTitleCreate):
-    # TODO: marking this function for optimization and DRY-ness
-    # create or get database directors, cast and categories for junction tables
-    db_directors = [ find_or_create_netflix_name(db, director) for director in netflix_title.directors ]
-    db_cast = [ find_or_create_netflix_name(db, cast_member) for cast_member in netflix_title.cast ]
-    db_countries = [ find_or_create_netflix_country(db, country) for country in netflix_title.countries ]
-    db_categories = [ find_or_create_netflix_category(db, category) for category in netflix_title.categories ]
-    db_title_type = find_or_create_netflix_title_type(db, netflix_title.title_type)
-    db_rating = find_or_create_netflix_rating(db, netflix_title.rating)
-    # create title
-    db_netflix_title = models.NetflixTitle(
-        show_id=netflix_title.show_id,
-        title=netflix_title.title,
-        title_type_id=db_title_type.id,
-        #title=netflix_title.title,
-        #country=netflix_title.country,
-        #example date_added: March 15, 2017
-        date_added=datetime.strptime(netflix_title.date_added, '%B %d, %Y') if (netflix_title.date_added) is not None else None,
-        release_year=netflix_title.release_year,
-        #rating=netflix_title.rating,
-        rating_id=db_rating.id,
-        duration=netflix_title.duration,
-        seasons=netflix_title.seasons,
-        description=netflix_title.description
-    )
-    db.add(db_netflix_title)
-    db.commit()
-    db.refresh(db_netflix_title)
-    
-    # create director associations in junction table
-    for db_director in db_directors:
-        db_title_director_junction = models.NetflixTitleDirectorJunction(
-            title_id=db_netflix_title.id,
-            director_id=db_director.id
-        )
-        db.add(db_title_director_junction)
-        db.commit()
-        db.refresh(db_title_director_junction)
+def update_netflix_title(db: Session, db_netflix_title: models.NetflixTitle, netflix_title: schemas.NetflixTitleCreate):
+    try:
+        previous_state = rollups.title_state(db_netflix_title)
+        # update title
+        db_netflix_title.title=netflix_title.title
+        db_netflix_title._title_type=find_or_create_netflix_title_type(db, netflix_title.title_type)
+        db_netflix_title.date_added=parse_date_added(netflix_title.date_added)
+        db_netflix_title.release_year=netflix_title.release_year
+        db_netflix_title._rating=find_or_create_netflix_rating(db, netflix_title.rating) if netflix_title.rating is not None else None
+        db_netflix_title.duration=netflix_title.duration
+        db_netflix_title.seasons=netflix_title.seasons
+        db_netflix_title.description=netflix_title.description
 
-    # create cast associations in junction table
-    for db_cast_member in db_cast:
-        db_title_cast_junction = models.NetflixTitleCastJunction(
-            title_id=db_netflix_title.id,
-            cast_id=db_cast_member.id
-        )
-        db.add(db_title_cast_junction)
+        # only added and removed junction rows are written
+        set_netflix_title_lists(db, db_netflix_title, netflix_title_lists(netflix_title))
+        rollups.apply_title_changes(db, [previous_state], [rollups.title_state(db_netflix_title)])
         db.commit()
-        db.refresh(db_title_cast_junction)
+    except Exception:
+        db.rollback()
+        raise
 
-    # create country associations in junction table
-    for db_country in db_countries:
-        db_title_country_junction = models.NetflixTitleCountryJunction(
-            title_id=db_netflix_title.id,
-            country_id=db_country.id
-        )
-        db.add(db_title_country_junction)
-        db.commit()
-        db.refresh(db_title_country_junction)
+    #return title
+    return db_netflix_title
 
-    # create category associations in junction table
-    for db_category in db_categories:
-        db_title_category_junction = models.NetflixTitleCategoryJunction(
-            title_id=db_netflix_title.id,
-            category_id=db_category.id
-        )
-        db.add(db_title_category_junction)
+def partial_update_netflix_title(db: Session, db_netflix_title: models.NetflixTitle, netflix_title: schemas.NetflixTitleCreate):
+    #update fields one at a time: lists will be added to - non-destructive update
+    try:
+        previous_state = rollups.title_state(db_netflix_title)
+        # update title
+        if getattr(netflix_title, 'title'):
+            db_netflix_title.title=netflix_title.title
+        # update title type
+        if getattr(netflix_title, 'title_type'):
+            db_netflix_title._title_type=find_or_create_netflix_title_type(db, netflix_title.title_type)
+        # update date_added
+        if getattr(netflix_title, 'date_added'):
+            db_netflix_title.date_added=parse_date_added(netflix_title.date_added)
+        # update release_year
+        if getattr(netflix_title, 'release_year'):
+            db_netflix_title.release_year=netflix_title.release_year
+        # update rating
+        if getattr(netflix_title, 'rating'):
+            db_netflix_title._rating=find_or_create_netflix_rating(db, netflix_title.rating)
+        # update duration
+        if getattr(netflix_title, 'duration'):
+            db_netflix_title.duration=netflix_title.duration
+        # update seasons
+        if getattr(netflix_title, 'seasons'):
+            db_netflix_title.seasons=netflix_title.seasons
+        # update description
+        if getattr(netflix_title, 'description'):
+            db_netflix_title.description=netflix_title.description
+
+        # update directors, cast, countries and categories - append if needed
+        set_netflix_title_lists(db, db_netflix_title, { key: names for key, names in netflix_title_lists(netflix_title).items() if names }, append=True)
+
+        rollups.apply_title_changes(db, [previous_state], [rollups.title_state(db_netflix_title)])
         db.commit()
-        db.refresh(db_title_category_junction)
+    except Exception:
+        db.rollback()
+        raise
 
     #return title
     return db_netflix_title
 
+# Async versions for the async endpoints (AsyncSession from database.AsyncSessionLocal).
+# Simple lookups are plain awaited selects.  The title functions reuse the sync code above through
+# AsyncSession.run_sync: it runs in SQLAlchemy's greenlet and every query is awaited on the async
+# driver, so the event loop is never blocked on the database.
+# Results must be fully loaded before they leave run_sync - a lazy load later would need blocking IO
+# (netflix_title_load_options and expire_on_commit=False take care of that).
 
-def update_netflix_title(db: Session, db_netflix_title: models.NetflixTitle, netflix_title: schemas.NetflixTitleCreate):
-    # find title type and rating
-    db_title_type = find_or_create_netflix_title_type(db, netflix_title.title_type)
-    db_rating = find_or_create_netflix_rating(db, netflix_title.rating)
-
-    # update title
-    db_netflix_title.title=netflix_title.title
-    db_netflix_title.title_type_id=db_title_type.id
-    #db_netflix_title.date_added=datetime.strptime(netflix_title.date_added, '%B %d, %Y').date() if (netflix_title.date_added) is not None else None,
-    db_netflix_title.date_added=datetime.strptime(netflix_title.date_added, '%B %d, %Y').date()
-    db_netflix_title.release_year=netflix_title.release_year
-    db_netflix_title.rating_id=db_rating.id
-    db_netflix_title.duration=netflix_title.duration
-    db_netflix_title.seasons=netflix_title.seasons
-    db_netflix_title.description=netflix_title.description  
-    db.commit()
-    db.refresh(db_netflix_title)
-    
-    # if director not in directors or exists and not already associated:
-    #  then create (if needed) and associate
-    for director in netflix_title.directors:
-        # find or create director entry
-        db_director = find_or_create_netflix_name(db, director)
-        # see if already associated and associate if needed
-        find_or_create_netflix_title_director_junction(db, title_id=db_netflix_title.id, director_id=db_director.id)
-    # if existing director not in new list (don't think order matters)
-    #   then delete association
-    for existing_director in db_netflix_title.directors:
-        if existing_director.name not in netflix_title.directors:
-            #delete association
-            delete_netflix_title_director_junction(db, title_id=db_netflix_title.id, director_id=existing_director.id)
-
-    # same thing with cast, country and categories
-    for cast in netflix_title.cast:
-        db_cast_member = find_or_create_netflix_name(db, cast)
-        find_or_create_netflix_title_cast_junction(db, title_id=db_netflix_title.id, cast_id=db_cast_member.id)
-    for existing_cast_member in db_netflix_title.cast:
-        if existing_cast_member.name not in netflix_title.cast:
-            delete_netflix_title_cast_junction(db, title_id=db_netflix_title.id, cast_id=existing_cast_member.id)
-
-    for country in netflix_title.countries:
-        db_country = find_or_create_netflix_country(db, country)
-        find_or_create_netflix_title_country_junction(db, title_id=db_netflix_title.id, country_id=db_country.id)
-    for existing_country in db_netflix_title.countries:
-        if existing_country.name not in netflix_title.countries:
-            delete_netflix_title_country_junction(db, title_id=db_netflix_title.id, country_id=existing_country.id)
-
-    for category in netflix_title.categories:
-        db_category = find_or_create_netflix_category(db, category)
-        find_or_create_netflix_title_category_junction(db, title_id=db_netflix_title.id, category_id=db_category.id)
-    for existing_category in db_netflix_title.categories:
-        if existing_category.name not in netflix_title.categories:
-            delete_netflix_title_category_junction(db, title_id=db_netflix_title.id, category_id=existing_category.id)
+async def get_user_by_email_async(db: AsyncSession, email: str):
+    return (await db.execute(select(models.User).where(models.User.email == email))).scalars().first()
 
-    #return title
-    return db_netflix_title
+async def get_user_by_username_async(db: AsyncSession, username: str):
+    return (await db.execute(select(models.User).where(models.User.username == username))).scalars().first()
 
-def partial_update_netflix_title(db: Session, db_netflix_title: models.NetflixTitle, netflix_title: schemas.NetflixTitleCreate):
-    #update fields one at a time: lists will be added to - non-destructive update
+async def create_user_async(db: AsyncSession, user: schemas.UserCreate):
+    # bcrypt is deliberately slow, hash on the bounded hashing pool rather than on the event loop
+    hashed_password = await hashing.hash_password_async(user.password)
+    db_user = models.User(
+        username=user.username,
+        email=user.email,
+        password=hashed_password)
+    db.add(db_user)
+    await db.commit()
+    await db.refresh(db_user)
+    return db_user
 
-    # update title
-    if getattr(netflix_title, 'title'):
-        db_netflix_title.title=netflix_title.title
-    # update title type
-    if getattr(netflix_title, 'title_type'):
-        db_title_type = find_or_create_netflix_title_type(db, netflix_title.title_type)
-        db_netflix_title.title_type_id=db_title_type.id
-    # update date_added
-    if getattr(netflix_title, 'date_added'):
-        db_netflix_title.date_added=datetime.strptime(netflix_title.date_added, '%B %d, %Y').date()
-    # update release_year
-    if getattr(netflix_title, 'release_year'):
-        db_netflix_title.release_year=netflix_title.release_year
-    # update rating
-    if getattr(netflix_title, 'rating'):
-        db_rating = find_or_create_netflix_rating(db, netflix_title.rating)
-        db_netflix_title.rating_id=db_rating.id
-    # update duration
-    if getattr(netflix_title, 'duration'):
-        db_netflix_title.duration=netflix_title.duration
-    # update seasons
-    if getattr(netflix_title, 'seasons'):
-        db_netflix_title.seasons=netflix_title.seasons
-    # update description
-    if getattr(netflix_title, 'description'):
-        db_netflix_title.description=netflix_title.description  
-    
-    db.commit()
-    db.refresh(db_netflix_title)
-    
-    # update directors - append if needed
-    if getattr(netflix_title, 'directors'):
-        for director in netflix_title.directors:
-            db_director = find_or_create_netflix_name(db, director)
-            find_or_create_netflix_title_director_junction(db, title_id=db_netflix_title.id, director_id=db_director.id)
-
-    # udpate cast - append if needed
-    if getattr(netflix_title, 'cast'):
-        for cast in netflix_title.cast:
-            db_cast_member = find_or_create_netflix_name(db, cast)
-            find_or_create_netflix_title_cast_junction(db, title_id=db_netflix_title.id, cast_id=db_cast_member.id)
-
-    # update countries - append if needed
-    if getattr(netflix_title, 'countries'):
-        for country in netflix_title.countries:
-            db_country = find_or_create_netflix_country(db, country)
-            find_or_create_netflix_title_country_junction(db, title_id=db_netflix_title.id, country_id=db_country.id)
-
-    # update categories - append if needed
-    if getattr(netflix_title, 'categories'):
-        for category in netflix_title.categories:
-            db_category = find_or_create_netflix_category(db, category)
-            find_or_create_netflix_title_category_junction(db, title_id=db_netflix_title.id, category_id=db_category.id)
+async def get_netflix_title_by_show_id_async(db: AsyncSession, show_id: str):
+    return await db.run_sync(get_netflix_title_by_show_id, show_id)
 
-    #return title
-    return db_netflix_title
+async def get_netflix_titles_async(db: AsyncSession, **kwargs):
+    return await db.run_sync(get_netflix_titles, **kwargs)
+
+async def get_netflix_title_rows_async(db: AsyncSession, **kwargs):
+    return await db.run_sync(get_netflix_title_rows, **kwargs)
+
+async def get_netflix_title_row_by_show_id_async(db: AsyncSession, **kwargs):
+    return await db.run_sync(get_netflix_title_row_by_show_id, **kwargs)
+
+async def get_netflix_stats_async(db: AsyncSession, search: str = None, netflix_title_filter = None):
+    return await db.run_sync(get_netflix_stats, search=search, netflix_title_filter=netflix_title_filter)
+
+async def get_netflix_facets_async(db: AsyncSession, facets: list, search: str = None, netflix_title_filter = None):
+    return await db.run_sync(get_netflix_facets, facets, search=search, netflix_title_filter=netflix_title_filter)
+
+async def create_netflix_title_async(db: AsyncSession, netflix_title: schemas.NetflixTitleCreate):
+    return await db.run_sync(create_netflix_title, netflix_title)
+
+async def update_netflix_title_async(db: AsyncSession, db_netflix_title: models.NetflixTitle, netflix_title: schemas.NetflixTitleCreate):
+    return await db.run_sync(update_netflix_title, db_netflix_title, netflix_title)
+
+async def partial_update_netflix_title_async(db: AsyncSession, db_netflix_title: models.NetflixTitle, netflix_title: schemas.NetflixTitleCreate):
+    return await db.run_sync(partial_update_netflix_title, db_netflix_title, netflix_title)
+
+async def warm_netflix_dimension_cache_async(db: AsyncSession):
+    await db.run_sync(warm_netflix_dimension_cache)
 
 # def get_items(db: Session, skip: int = 0, limit: int = 100):
 #     return db.query(models.Item).offset(skip).limit(limit).all()
@@ -0,0 +1,175 @@
+import argparse
+import csv
+import io
+import json
+import sys
+import zlib
+from collections import defaultdict
+
+from sqlalchemy import select
+
+from . import ingest, models
+
+# Streaming catalog export in the Kaggle column layout (see ingest.KAGGLE_COLUMNS), as ndjson or csv.
+# Titles are read in keyset batches (id > last id, ordered by id) each on its own short lived
+# connection, and the four many to many lists are aggregated per batch with one query per junction
+# over that batch's id range.  Only one batch is ever held in memory, so memory stays flat no matter
+# how big the catalog is, and no transaction stays open for the length of the download.
+# The output reads back with ingest.parse_kaggle_row, so an export can be loaded with python -m app.ingest.
+
+FORMATS = ["ndjson", "csv"]
+DEFAULT_BATCH_SIZE = 1000
+MAX_BATCH_SIZE = 10000
+
+titles_table = models.NetflixTitle.__table__
+title_types_table = models.NetflixTitleType.__table__
+ratings_table = models.NetflixRating.__table__
+
+# kaggle column for each parsed row key in ingest.JUNCTIONS
+LIST_COLUMNS = {"directors": "director", "cast": "cast", "countries": "country", "categories": "listed_in"}
+
+def format_date_added(value):
+    # the kaggle form, March 15, 2017
+    return "" if value is None else "%s %d, %d" % (value.strftime("%B"), value.day, value.year)
+
+def format_duration(duration, seasons):
+    if duration is not None:
+        return "%d min" % duration
+    if seasons is not None:
+        return "%d Season%s" % (seasons, "" if seasons == 1 else "s")
+    return ""
+
+def title_batches(engine, batch_size: int = DEFAULT_BATCH_SIZE):
+    # yields lists of title rows with title_type and rating names, in id order
+    query = (
+        select(
+            titles_table.c.id,
+            titles_table.c.show_id,
+            title_types_table.c.name.label("title_type"),
+            titles_table.c.title,
+            titles_table.c.date_added,
+            titles_table.c.release_year,
+            ratings_table.c.name.label("rating"),
+            titles_table.c.duration,
+            titles_table.c.seasons,
+            titles_table.c.description,
+        )
+        .select_from(titles_table)
+        .outerjoin(title_types_table, titles_table.c.title_type_id == title_types_table.c.id)
+        .outerjoin(ratings_table, titles_table.c.rating_id == ratings_table.c.id)
+        .order_by(titles_table.c.id)
+        .limit(batch_size)
+    )
+    last_id = None
+    while True:
+        batch_query = query if last_id is None else query.where(titles_table.c.id > last_id)
+        with engine.connect() as connection:
+            rows = connection.execute(batch_query).all()
+            if not rows:
+                return
+            lists = batch_lists(connection, rows[0][0], rows[-1][0])
+        yield rows, lists
+        last_id = rows[-1][0]
+
+def batch_lists(connection, first_id: int, last_id: int):
+    # parsed row key -> title id -> names, in primary key order
+    lists = {}
+    for junction_model, foreign_key, dimension_model, key in ingest.JUNCTIONS:
+        junction_table = junction_model.__table__
+        dimension_table = dimension_model.__table__
+        names = defaultdict(list)
+        query = (
+            select(junction_table.c.title_id, dimension_table.c.name)
+            .join(dimension_table, junction_table.c[foreign_key] == dimension_table.c.id)
+            .where(junction_table.c.title_id.between(first_id, last_id))
+            .order_by(junction_table.c.title_id, junction_table.c[foreign_key])
+        )
+        for title_id, name in connection.execute(query):
+            names[title_id].append(name)
+        lists[key] = names
+    return lists
+
+def kaggle_rows(engine, batch_size: int = DEFAULT_BATCH_SIZE):
+    # yields one list of kaggle rows (column -> string) per batch
+    for rows, lists in title_batches(engine, batch_size):
+        batch = []
+        for title_id, show_id, title_type, title, date_added, release_year, rating, duration, seasons, description in rows:
+            kaggle_row = {
+                "show_id": show_id,
+                "type": title_type or "",
+                "title": title or "",
+                "date_added": format_date_added(date_added),
+                "release_year": "" if release_year is None else str(release_year),
+                "rating": rating or "",
+                "duration": format_duration(duration, seasons),
+                "description": description or "",
+            }
+            for key, column in LIST_COLUMNS.items():
+                kaggle_row[column] = ", ".join(lists[key].get(title_id, []))
+            batch.append({ column: kaggle_row[column] for column in ingest.KAGGLE_COLUMNS })
+        yield batch
+
+def ndjson_chunks(batches):
+    for batch in batches:
+        yield "".join(json.dumps(row, ensure_ascii=False) + "\n" for row in batch).encode("utf-8")
+
+def csv_chunks(batches):
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=ingest.KAGGLE_COLUMNS)
+    writer.writeheader()
+    for batch in batches:
+        writer.writerows(batch)
+        yield buffer.getvalue().encode("utf-8")
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode("utf-8")
+
+def gzip_chunks(chunks):
+    # wbits=31 writes a gzip header and trailer
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+def export_chunks(engine, format: str = "ndjson", gzip: bool = False, batch_size: int = DEFAULT_BATCH_SIZE):
+    # bytes, one chunk per batch
+    if format not in FORMATS:
+        raise ValueError("Unknown export format %s, expected one of %s" % (format, ", ".join(FORMATS)))
+    batches = kaggle_rows(engine, batch_size=batch_size)
+    chunks = ndjson_chunks(batches) if format == "ndjson" else csv_chunks(batches)
+    return gzip_chunks(chunks) if gzip else chunks
+
+def media_type(format: str, gzip: bool = False):
+    if gzip:
+        return "application/gzip"
+    return "application/x-ndjson" if format == "ndjson" else "text/csv; charset=utf-8"
+
+def filename(format: str, gzip: bool = False):
+    return "netflix_titles.%s%s" % (format, ".gz" if gzip else "")
+
+# Usage (from fast_project with DB_CONNECTION_OPTION etc. set):
+#   python -m app.export netflix_titles.csv --format csv
+#   python -m app.export - --format ndjson --gzip > netflix_titles.ndjson.gz
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export the Netflix titles in the Kaggle column layout.")
+    parser.add_argument("out_path", help="file to write, - for stdout")
+    parser.add_argument("--format", choices=FORMATS, default="ndjson")
+    parser.add_argument("--gzip", action="store_true")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+    args = parser.parse_args(argv)
+
+    from .database import engine
+
+    out = sys.stdout.buffer if args.out_path == "-" else io.open(args.out_path, "wb")
+    try:
+        for chunk in export_chunks(engine, format=args.format, gzip=args.gzip, batch_size=args.batch_size):
+            out.write(chunk)
+    finally:
+        if out is not sys.stdout.buffer:
+            out.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+from sqlalchemy import select
+
+from . import models
+
+# SQL for the NetflixTitleFilter fields (see main.py).
+# fastapi-filter can only compare mapped columns, so title_type and rating (python properties) and
+# the many to many lists need their own clauses.  Every filter becomes a predicate on netflix_titles
+# that an index can answer:
+#   release_year, date_added, duration, seasons: the column itself (=, __in, __gte, __lte)
+#   title_type, rating: the foreign key IN (ids for the names), the names come from the unique name index
+#   country, category, director, cast: id IN (title ids from the junction), a semi join through the
+#   junction's reverse (other id, title_id) index
+# Filters are ANDed, the values of an __in filter are ORed.
+
+title = models.NetflixTitle
+
+OPERATORS = {
+    "eq": lambda column, value: column == value,
+    "in": lambda column, value: column.in_(value),
+    "gte": lambda column, value: column >= value,
+    "lte": lambda column, value: column <= value,
+}
+
+COLUMNS = {
+    "release_year": title.release_year,
+    "date_added": title.date_added,
+    "duration": title.duration,
+    "seasons": title.seasons,
+}
+
+# filter name -> (foreign key on netflix_titles, dimension model)
+DIMENSIONS = {
+    "title_type": (title.title_type_id, models.NetflixTitleType),
+    "rating": (title.rating_id, models.NetflixRating),
+}
+
+# filter name -> (junction model, junction foreign key, dimension model)
+RELATIONSHIPS = {
+    "director": (models.NetflixTitleDirectorJunction, "director_id", models.NetflixName),
+    "cast": (models.NetflixTitleCastJunction, "cast_id", models.NetflixName),
+    "country": (models.NetflixTitleCountryJunction, "country_id", models.NetflixCountry),
+    "category": (models.NetflixTitleCategoryJunction, "category_id", models.NetflixCategory),
+}
+
+def split_field(field_name: str):
+    # "release_year__gte" -> ("release_year", "gte"), "rating" -> ("rating", "eq")
+    name, _, operator = field_name.partition("__")
+    return name, operator or "eq"
+
+def dimension_ids(dimension_model, names: list):
+    return select(dimension_model.id).where(dimension_model.name.in_(names))
+
+def netflix_title_clause(field_name: str, value):
+    name, operator = split_field(field_name)
+    if name in COLUMNS and operator in OPERATORS:
+        return OPERATORS[operator](COLUMNS[name], value)
+    if operator not in ("eq", "in"):
+        raise ValueError("%s can't be filtered with __%s" % (name, operator))
+    names = value if operator == "in" else [value]
+    if name in DIMENSIONS:
+        foreign_key, dimension_model = DIMENSIONS[name]
+        return foreign_key.in_(dimension_ids(dimension_model, names))
+    if name in RELATIONSHIPS:
+        junction_model, foreign_key, dimension_model = RELATIONSHIPS[name]
+        return title.id.in_(
+            select(junction_model.title_id).where(getattr(junction_model, foreign_key).in_(dimension_ids(dimension_model, names)))
+        )
+    raise ValueError("%s is not a netflix title filter" % field_name)
+
+def apply_netflix_title_filters(query, fields):
+    # fields: (field name, value) pairs, e.g. Filter.filtering_fields
+    for field_name, value in fields:
+        query = query.where(netflix_title_clause(field_name, value))
+    return query
@@ -0,0 +1,156 @@
+import os
+import re
+
+from sqlalchemy import cast, column, func, literal_column, or_, table, text
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.dialects import postgresql
+
+from . import models
+
+# Full text search for netflix titles (title + description).
+#
+# ILIKE '%term%' can't use an index so every search scans the whole table.  The backends here
+# keep an index next to netflix_titles instead:
+#   - SQLite: an external content FTS5 table kept in sync by triggers
+#     Reference: https://www.sqlite.org/fts5.html#external_content_tables
+#   - Postgres: a generated tsvector column (title weighted A, description B) with a GIN index
+#     Reference: https://www.postgresql.org/docs/current/textsearch-tables.html
+# Both are maintained by the database itself so the create/update/patch paths and the bulk
+# loader stay in sync without extra work.  SEARCH_BACKEND=ilike forces the old behaviour.
+
+# default relevance weights, same as Postgres' ts_rank defaults for A (title) and B (description)
+DEFAULT_TITLE_WEIGHT = 1.0
+DEFAULT_DESCRIPTION_WEIGHT = 0.4
+
+def search_words(term: str):
+    return re.findall(r"\w+", term or "")
+
+
+class IlikeSearchBackend:
+    name = "ilike"
+
+    def ensure_schema(self, connection):
+        pass
+
+    def apply(self, query, term: str, title_weight: float = DEFAULT_TITLE_WEIGHT, description_weight: float = DEFAULT_DESCRIPTION_WEIGHT, ranked: bool = True):
+        # returns (filtered query, relevance expression or None) - higher relevance is better
+        # ranked=False when the caller orders some other way, scoring every match isn't free
+        search = "%%%s%%" % term
+        # Reference: https://stackoverflow.com/questions/7942547/using-or-in-sqlalchemy
+        search_filters = [
+            models.NetflixTitle.title.ilike(search),
+            models.NetflixTitle.description.ilike(search),
+        ]
+        return query.filter(or_(*search_filters)), None
+
+
+class SqliteFtsSearchBackend(IlikeSearchBackend):
+    name = "sqlite_fts5"
+
+    FTS_TABLE = "netflix_titles_fts"
+
+    DDL = [
+        "CREATE VIRTUAL TABLE IF NOT EXISTS netflix_titles_fts USING fts5("
+        "title, description, content='netflix_titles', content_rowid='id', tokenize='unicode61 remove_diacritics 2')",
+        "CREATE TRIGGER IF NOT EXISTS netflix_titles_fts_ai AFTER INSERT ON netflix_titles BEGIN "
+        "INSERT INTO netflix_titles_fts(rowid, title, description) VALUES (new.id, new.title, new.description); "
+        "END",
+        "CREATE TRIGGER IF NOT EXISTS netflix_titles_fts_ad AFTER DELETE ON netflix_titles BEGIN "
+        "INSERT INTO netflix_titles_fts(netflix_titles_fts, rowid, title, description) VALUES ('delete', old.id, old.title, old.description); "
+        "END",
+        "CREATE TRIGGER IF NOT EXISTS netflix_titles_fts_au AFTER UPDATE OF title, description ON netflix_titles BEGIN "
+        "INSERT INTO netflix_titles_fts(netflix_titles_fts, rowid, title, description) VALUES ('delete', old.id, old.title, old.description); "
+        "INSERT INTO netflix_titles_fts(rowid, title, description) VALUES (new.id, new.title, new.description); "
+        "END",
+    ]
+
+    def ensure_schema(self, connection):
+        exists = connection.execute(text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"), {"name": self.FTS_TABLE}).first()
+        for statement in self.DDL:
+            connection.exec_driver_sql(statement)
+        if not exists:
+            # index the rows that were there before the fts table
+            connection.exec_driver_sql("INSERT INTO netflix_titles_fts(netflix_titles_fts) VALUES ('rebuild')")
+
+    def apply(self, query, term: str, title_weight: float = DEFAULT_TITLE_WEIGHT, description_weight: float = DEFAULT_DESCRIPTION_WEIGHT, ranked: bool = True):
+        words = search_words(term)
+        if not words:
+            return super().apply(query, term)
+        # every word must match, as a prefix so partial words still find titles like ILIKE did
+        match = " ".join('"%s"*' % word for word in words)
+        # joined directly (not through an IN subquery) so SQLite can drive the scan from the index and stop at the limit
+        fts_table = table(self.FTS_TABLE, column("rowid"))
+        query = query.join(fts_table, fts_table.c.rowid == models.NetflixTitle.id).filter(literal_column(self.FTS_TABLE).op("MATCH")(match))
+        if not ranked:
+            return query, None
+        # bm25 is lower for better matches
+        return query, -func.bm25(literal_column(self.FTS_TABLE), title_weight, description_weight)
+
+
+class PostgresSearchBackend(IlikeSearchBackend):
+    name = "postgres_tsvector"
+
+    DDL = [
+        "ALTER TABLE netflix_titles ADD COLUMN IF NOT EXISTS search_vector tsvector GENERATED ALWAYS AS ("
+        "setweight(to_tsvector('english', coalesce(title, '')), 'A') || "
+        "setweight(to_tsvector('english', coalesce(description, '')), 'B')) STORED",
+        "CREATE INDEX IF NOT EXISTS ix_netflix_titles_search_vector ON netflix_titles USING GIN (search_vector)",
+    ]
+
+    def ensure_schema(self, connection):
+        for statement in self.DDL:
+            connection.exec_driver_sql(statement)
+
+    def apply(self, query, term: str, title_weight: float = DEFAULT_TITLE_WEIGHT, description_weight: float = DEFAULT_DESCRIPTION_WEIGHT, ranked: bool = True):
+        if not search_words(term):
+            return super().apply(query, term)
+        search_vector = literal_column("netflix_titles.search_vector")
+        ts_query = func.websearch_to_tsquery("english", term)
+        query = query.filter(search_vector.op("@@")(ts_query))
+        if not ranked:
+            return query, None
+        # weights are {D, C, B, A}, only A (title) and B (description) are used
+        weights = cast(postgresql.array([0.0, 0.0, description_weight, title_weight]), postgresql.ARRAY(postgresql.REAL))
+        return query, func.ts_rank(weights, search_vector, ts_query)
+
+
+SEARCH_BACKENDS = {
+    "sqlite": SqliteFtsSearchBackend,
+    "postgresql": PostgresSearchBackend,
+}
+
+_backends = {}
+
+def search_backend_class(bind):
+    # the backend asked for by SEARCH_BACKEND and the dialect, SEARCH_BACKEND=ilike turns indexed search off
+    if os.environ.get("SEARCH_BACKEND", "auto") == "ilike":
+        return IlikeSearchBackend
+    return SEARCH_BACKENDS.get(bind.dialect.name, IlikeSearchBackend)
+
+def get_search_backend(bind):
+    # one backend per dialect
+    dialect_name = bind.dialect.name
+    if dialect_name not in _backends:
+        _backends[dialect_name] = search_backend_class(bind)()
+    return _backends[dialect_name]
+
+def ensure_search_schema(engine):
+    # creates (and backfills) the index of the backend asked for, returns the backend in use
+    backend = _backends[engine.dialect.name] = search_backend_class(engine)()
+    try:
+        with engine.begin() as connection:
+            backend.ensure_schema(connection)
+    except OperationalError:
+        if not isinstance(backend, SqliteFtsSearchBackend):
+            raise
+        # sqlite compiled without fts5
+        _backends[engine.dialect.name] = IlikeSearchBackend()
+    return _backends[engine.dialect.name]
+
+def use_search_backend(bind, name: str):
+    # the backend ensure_search_schema settled on when the schema was set up (see schema.py)
+    if os.environ.get("SEARCH_BACKEND", "auto") == "ilike":
+        name = IlikeSearchBackend.name
+    backend_classes = [IlikeSearchBackend] + list(SEARCH_BACKENDS.values())
+    backend_class = next((backend_class for backend_class in backend_classes if backend_class.name == name), IlikeSearchBackend)
+    _backends[bind.dialect.name] = backend_class()
@@ -0,0 +1,85 @@
+import asyncio
+import os
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+from passlib.context import CryptContext
+
+from .timing import StageTimer
+
+# Password hashing off the event loop.
+# bcrypt hashes and verifies cost a few hundred ms of cpu each on purpose.  The async callers hand them
+# to a small dedicated thread pool (bcrypt releases the GIL, so the loop keeps serving requests) and
+# at most HASH_MAX_PENDING of them may be queued or running at once - past that HashingBusy is raised
+# straight away (a 503) instead of letting a burst of logins build an ever longer queue.
+# Reference: https://passlib.readthedocs.io/en/stable/lib/passlib.hash.bcrypt.html
+
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+
+# half the cores by default, leaving the rest for the event loop and the database driver
+HASH_WORKERS = int(os.environ.get('HASH_WORKERS', max(1, (os.cpu_count() or 2) // 2)))
+HASH_MAX_PENDING = int(os.environ.get('HASH_MAX_PENDING', HASH_WORKERS * 8))
+
+class HashingBusy(Exception):
+    pass
+
+# stage name -> StageTimer, e.g. "verify.queue" (waiting for a worker) and "verify.cpu" (bcrypt itself)
+timings = defaultdict(StageTimer)
+
+def record(stage: str, seconds: float):
+    timings[stage].add(seconds)
+
+executor = ThreadPoolExecutor(max_workers=HASH_WORKERS, thread_name_prefix="hashing")
+_pending = 0
+_rejected = 0
+_lock = threading.Lock()
+
+def _release(future):
+    global _pending
+    with _lock:
+        _pending -= 1
+
+async def run_bounded(operation: str, fn, *args):
+    # counts as pending until the worker is done, even if the awaiting request went away
+    global _pending, _rejected
+    with _lock:
+        if _pending >= HASH_MAX_PENDING:
+            _rejected += 1
+            raise HashingBusy("Too many password hashing requests, retry shortly")
+        _pending += 1
+    submitted = time.perf_counter()
+
+    def work():
+        started = time.perf_counter()
+        record(operation + ".queue", started - submitted)
+        try:
+            return fn(*args)
+        finally:
+            record(operation + ".cpu", time.perf_counter() - started)
+
+    future = executor.submit(work)
+    future.add_done_callback(_release)
+    return await asyncio.wrap_future(future)
+
+def hash_password(password: str):
+    return pwd_context.hash(password)
+
+def verify_password(plain_password: str, hashed_password: str):
+    return pwd_context.verify(plain_password, hashed_password)
+
+async def hash_password_async(password: str):
+    return await run_bounded("hash", hash_password, password)
+
+async def verify_password_async(plain_password: str, hashed_password: str):
+    return await run_bounded("verify", verify_password, plain_password, hashed_password)
+
+def stats():
+    return {
+        "workers": HASH_WORKERS,
+        "max_pending": HASH_MAX_PENDING,
+        "pending": _pending,
+        "rejected": _rejected,
+        "stages": { stage: timer.stats() for stage, timer in sorted(timings.items()) },
+    }
@@ -0,0 +1,206 @@
+import argparse
+import csv
+import io
+import sys
+import time
+from datetime import datetime
+
+from sqlalchemy import select, insert
+from sqlalchemy.orm import Session
+
+from . import crud, models, rollups
+
+# Bulk loader for the Kaggle Netflix data set (https://www.kaggle.com/shivamb/netflix-shows/data)
+# The csv is streamed and loaded a chunk at a time so memory stays flat no matter the file size.
+# Each chunk resolves its dimension names with set-based queries, inserts titles and junction
+# rows with multi-row statements, adds the chunk to the stats rollups and is committed as one transaction.
+
+#show_id,type,title,director,cast,country,date_added,release_year,rating,duration,listed_in,description
+KAGGLE_COLUMNS = [
+    "show_id",
+    "type",
+    "title",
+    "director",
+    "cast",
+    "country",
+    "date_added",
+    "release_year",
+    "rating",
+    "duration",
+    "listed_in",
+    "description",
+]
+
+DEFAULT_CHUNK_SIZE = 1000
+
+# junction model, junction foreign key, dimension model and parsed row key for each many to many
+# (the parsed row keys are the NetflixTitle relationship names)
+JUNCTIONS = crud.NETFLIX_TITLE_JUNCTIONS
+
+def split_list(value: str):
+    # kaggle list columns are comma separated: "Kate Siegel, Zach Gilford"
+    if not value:
+        return []
+    # dict.fromkeys drops duplicates but keeps the order
+    return list(dict.fromkeys(item.strip() for item in value.split(",") if item.strip()))
+
+def parse_date_added(value: str):
+    #example date_added: March 15, 2017 (some rows have a leading space)
+    if not value or not value.strip():
+        return None
+    try:
+        return datetime.strptime(value.strip(), '%B %d, %Y').date()
+    except ValueError:
+        return None
+
+def parse_duration(value: str):
+    # "90 min" is a movie duration, "2 Seasons" / "1 Season" is a tv show season count
+    duration, seasons = None, None
+    if value:
+        amount, _, unit = value.strip().partition(" ")
+        if amount.isdigit():
+            if unit.lower().startswith("season"):
+                seasons = int(amount)
+            else:
+                duration = int(amount)
+    return duration, seasons
+
+def parse_kaggle_row(row: dict):
+    duration, seasons = parse_duration(row.get("duration"))
+    release_year = (row.get("release_year") or "").strip()
+    return {
+        "show_id": row["show_id"].strip(),
+        "title_type": (row.get("type") or "").strip() or None,
+        "title": row.get("title"),
+        "directors": split_list(row.get("director")),
+        "cast": split_list(row.get("cast")),
+        "countries": split_list(row.get("country")),
+        "date_added": parse_date_added(row.get("date_added")),
+        "release_year": int(release_year) if release_year.isdigit() else None,
+        "rating": (row.get("rating") or "").strip() or None,
+        "duration": duration,
+        "seasons": seasons,
+        "categories": split_list(row.get("listed_in")),
+        "description": row.get("description"),
+    }
+
+def read_kaggle_csv(csv_file, chunk_size: int = DEFAULT_CHUNK_SIZE):
+    # yields lists of parsed rows, never holding more than one chunk in memory
+    chunk = []
+    for row in csv.DictReader(csv_file):
+        if not row.get("show_id"):
+            continue
+        chunk.append(parse_kaggle_row(row))
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def ingest_chunk(db: Session, rows: list):
+    # returns (inserted, skipped) - rows with a show_id already in the database (or repeated in the chunk) are skipped
+    total = len(rows)
+    unique_rows = {}
+    for row in rows:
+        unique_rows.setdefault(row["show_id"], row)
+    rows = list(unique_rows.values())
+    show_ids = [row["show_id"] for row in rows]
+    existing = set()
+    for batch in crud.batched(show_ids, crud.IN_CLAUSE_BATCH_SIZE):
+        existing.update(db.execute(select(models.NetflixTitle.show_id).where(models.NetflixTitle.show_id.in_(batch))).scalars())
+    new_rows = [row for row in rows if row["show_id"] not in existing]
+    if not new_rows:
+        return 0, total
+
+    title_type_ids = crud.resolve_netflix_dimension_ids(db, models.NetflixTitleType, {row["title_type"] for row in new_rows})
+    rating_ids = crud.resolve_netflix_dimension_ids(db, models.NetflixRating, {row["rating"] for row in new_rows})
+    name_ids = crud.resolve_netflix_dimension_ids(db, models.NetflixName, {name for row in new_rows for name in row["directors"] + row["cast"]})
+    country_ids = crud.resolve_netflix_dimension_ids(db, models.NetflixCountry, {name for row in new_rows for name in row["countries"]})
+    category_ids = crud.resolve_netflix_dimension_ids(db, models.NetflixCategory, {name for row in new_rows for name in row["categories"]})
+    dimension_ids = {
+        models.NetflixName: name_ids,
+        models.NetflixCountry: country_ids,
+        models.NetflixCategory: category_ids,
+    }
+
+    db.execute(insert(models.NetflixTitle), [
+        {
+            "show_id": row["show_id"],
+            "title_type_id": title_type_ids.get(row["title_type"]),
+            "title": row["title"],
+            "date_added": row["date_added"],
+            "release_year": row["release_year"],
+            "rating_id": rating_ids.get(row["rating"]),
+            "duration": row["duration"],
+            "seasons": row["seasons"],
+            "description": row["description"],
+        }
+        for row in new_rows
+    ])
+    title_ids = {}
+    for batch in crud.batched([row["show_id"] for row in new_rows], crud.IN_CLAUSE_BATCH_SIZE):
+        title_ids.update(db.execute(select(models.NetflixTitle.show_id, models.NetflixTitle.id).where(models.NetflixTitle.show_id.in_(batch))).all())
+
+    for junction_model, foreign_key, dimension_model, key in JUNCTIONS:
+        ids = dimension_ids[dimension_model]
+        junction_rows = [
+            {"title_id": title_ids[row["show_id"]], foreign_key: ids[name]}
+            for row in new_rows
+            for name in row[key]
+        ]
+        if junction_rows:
+            db.execute(insert(junction_model), junction_rows)
+
+    # parsed rows carry the same fields as rollups.title_state
+    rollups.apply_title_changes(db, [], new_rows)
+
+    return len(new_rows), total - len(new_rows)
+
+def ingest_netflix_csv(db: Session, csv_file, chunk_size: int = DEFAULT_CHUNK_SIZE, on_chunk=None):
+    # on_chunk(stats) is called after each committed chunk, e.g. for progress output
+    stats = {"rows": 0, "inserted": 0, "skipped": 0, "chunks": 0, "seconds": 0.0, "rows_per_second": 0.0}
+    start = time.perf_counter()
+    for chunk in read_kaggle_csv(csv_file, chunk_size=chunk_size):
+        try:
+            inserted, skipped = ingest_chunk(db, chunk)
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        stats["rows"] += len(chunk)
+        stats["inserted"] += inserted
+        stats["skipped"] += skipped
+        stats["chunks"] += 1
+        stats["seconds"] = time.perf_counter() - start
+        stats["rows_per_second"] = stats["rows"] / stats["seconds"] if stats["seconds"] else 0.0
+        if on_chunk is not None:
+            on_chunk(stats)
+    stats["seconds"] = time.perf_counter() - start
+    stats["rows_per_second"] = stats["rows"] / stats["seconds"] if stats["seconds"] else 0.0
+    return stats
+
+def print_progress(stats: dict):
+    print("chunk %(chunks)d: %(rows)d rows (%(inserted)d inserted, %(skipped)d skipped) %(rows_per_second).0f rows/sec" % stats, file=sys.stderr)
+
+# Usage (from fast_project with DB_CONNECTION_OPTION etc. set):
+#   python -m app.ingest netflix_titles.csv --chunk-size 1000
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Bulk load the Kaggle Netflix titles csv.")
+    parser.add_argument("csv_path", help="path to netflix_titles.csv")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE)
+    args = parser.parse_args(argv)
+
+    from . import schema
+    from .database import SessionLocal, engine
+    schema.ensure_schema(engine)
+
+    db = SessionLocal()
+    try:
+        with io.open(args.csv_path, encoding="utf-8-sig", newline="") as csv_file:
+            stats = ingest_netflix_csv(db, csv_file, chunk_size=args.chunk_size, on_chunk=print_progress)
+    finally:
+        db.close()
+    print("loaded %(rows)d rows (%(inserted)d inserted, %(skipped)d skipped) in %(seconds).2fs - %(rows_per_second).0f rows/sec" % stats)
+
+if __name__ == "__main__":
+    main()
@@ -1,15 +1,30 @@
+import time
+
+# for the startup report (see start_up), taken before the rest of the imports
+IMPORT_STARTED = time.perf_counter()
+
+import io
+import json
+import logging
 import os
-from datetime import datetime, timedelta
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta
+from typing import Union
 
-from fastapi import Depends, FastAPI, HTTPException, status
+from fastapi import Depends, FastAPI, Header, HTTPException, Query, Request, Response, UploadFile, status
+from fastapi.responses import StreamingResponse
+from fastapi.encoders import jsonable_encoder
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
+from fastapi.security.utils import get_authorization_scheme_param
 from jose import JWTError, jwt
+import orjson
 from pydantic import DurationError, BaseModel
-from passlib.context import CryptContext
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 
-from . import crud, models, schemas
-from .database import SessionLocal, engine
+from . import bulk, cache, crud, database, export, filters, fulltext, hashing, ingest, metrics, models, pagination, replicas, rollups, schema, schemas, slow_queries
+from .database import AsyncSessionLocal, SessionLocal
 
 # import crud, models, schemas
 # from database import SessionLocal, engine
@@ -17,9 +32,11 @@ from .database import SessionLocal, engine
 from fastapi_filter import FilterDepends, with_prefix
 from fastapi_filter.contrib.sqlalchemy import Filter
 
-models.Base.metadata.create_all(bind=engine)
+logger = logging.getLogger("uvicorn.error")
 
 # Dependency
+# get_async_db is what the async endpoints use, get_db is left for plain def endpoints
+# (which FastAPI runs in its threadpool, so blocking calls there don't hold up the event loop)
 def get_db():
     db = SessionLocal()
     try:
@@ -27,6 +44,10 @@ def get_db():
     finally:
         db.close()
 
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
 # Reference: https://fastapi.tiangolo.com/tutorial/security/oauth2-jwt/
 # to get a string like this run:
 # openssl rand -hex 32
@@ -66,20 +87,63 @@ ACCESS_TOKEN_EXPIRE_MINUTES = int(os.environ.get('JWT_ACCESS_TOKEN_EXPIRE_MINUTE
 #     hashed_password: str
 
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
-
 #Reference: https://fastapi.tiangolo.com/tutorial/security/first-steps/ and next section user/pass
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
 app = FastAPI()
 
-def verify_password(plain_password, hashed_password):
-    return pwd_context.verify(plain_password, hashed_password)
+# Read/write splitting (see replicas.py): the GET endpoints read through get_async_read_db, the client
+# is the bearer token.  A write pins its client to the primary for DB_READ_STICKY_SECONDS, counted from
+# both the start and the end of the request so a long write can't outlast the window.
+async def get_async_read_db(token: str = Depends(oauth2_scheme)):
+    async with database.AsyncReadSession(cache.token_key(token)) as db:
+        yield db
 
+@app.middleware("http")
+async def pin_writers_to_primary(request: Request, call_next):
+    _, token = get_authorization_scheme_param(request.headers.get("Authorization"))
+    if request.method in replicas.READ_METHODS or not token:
+        return await call_next(request)
+    database.replica_set.pin(cache.token_key(token))
+    try:
+        return await call_next(request)
+    finally:
+        database.replica_set.pin(cache.token_key(token))
+
+# Per route SQL statements/time, ORM rows, serialize/auth time and response size for /metrics
+# (and Server-Timing with SERVER_TIMING=1), see metrics.py.  Added after the other middleware so it is the outermost.
+app.add_middleware(metrics.MetricsMiddleware)
 
-def get_password_hash(password):
-    return pwd_context.hash(password)
+# Startup report: seconds spent in each phase of getting ready to serve (import of this module,
+# schema check, cache warm up, rollup backfill), logged once and served by /startup/stats
+startup_timings = {}
 
+@contextmanager
+def startup_phase(name: str):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        startup_timings[name] = time.perf_counter() - started
+
+@app.on_event("startup")
+async def start_up():
+    with startup_phase("engines"):
+        # built here rather than when the app is imported (see database.get_engines)
+        engine, _, _ = database.get_engines()
+    with startup_phase("schema"):
+        # a single select unless the schema is missing or out of date (see schema.py)
+        schema.ensure_schema(engine)
+    async with AsyncSessionLocal() as db:
+        with startup_phase("dimension_cache"):
+            await crud.warm_netflix_dimension_cache_async(db)
+        with startup_phase("rollups"):
+            await db.run_sync(rollups.ensure_rollups)
+    logger.info("startup: %s", ", ".join("%s %.1fms" % (phase, seconds * 1000) for phase, seconds in startup_timings.items()))
+
+@app.on_event("shutdown")
+async def close_connections():
+    await database.dispose_engines()
 
 # def get_user(db, username: str):
 #     if username in db:
@@ -87,11 +151,17 @@ def get_password_hash(password):
 #         return schemas.UserFullDb(**user_dict)
 
 #def authenticate_user(fake_db, username: str, password: str):
-def authenticate_user(username: str, password: str, db: Session = Depends(get_db)):
-    db_user = crud.get_user_by_username(db, username=username)
+# bcrypt runs on the bounded hashing pool (see hashing.py), raises hashing.HashingBusy when it is full
+async def authenticate_user(username: str, password: str, db: AsyncSession):
+    started = time.perf_counter()
+    db_user = await crud.get_user_by_username_async(db, username=username)
+    hashing.record("login.lookup", time.perf_counter() - started)
     if not db_user:
         return False
-    if not verify_password(password, db_user.password):
+    started = time.perf_counter()
+    verified = await hashing.verify_password_async(password, db_user.password)
+    hashing.record("login.verify", time.perf_counter() - started)
+    if not verified:
         return False
     return db_user
 
@@ -103,25 +173,42 @@ def create_access_token(data: dict, expires_delta: timedelta):
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
-async def get_current_user(db: Session = Depends(get_db), token: str = Depends(oauth2_scheme)):
+# Every protected endpoint resolves the caller through get_current_active_user.  Decoded tokens and
+# users are cached (cache.token_cache / cache.user_cache), so a warm request skips both the jwt decode
+# and the user query.
+async def get_current_user(db: AsyncSession = Depends(get_async_db), token: str = Depends(oauth2_scheme)):
+    with metrics.stage("auth"):
+        return await get_user_for_token(db, token)
+
+async def get_user_for_token(db: AsyncSession, token: str):
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
-    try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        username: str = payload.get("sub")
-        if username is None:
+    token_key = cache.token_key(token)
+    username = cache.token_cache.get(token_key)
+    if username is None:
+        try:
+            payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+            username: str = payload.get("sub")
+            if username is None:
+                raise credentials_exception
+            token_data = schemas.TokenData(username=username)
+        except JWTError:
             raise credentials_exception
-        token_data = schemas.TokenData(username=username)
-    except JWTError:
-        raise credentials_exception
+        username = token_data.username
+        expires = payload.get("exp")
+        cache.token_cache.set(token_key, username, ttl_seconds=expires - time.time() if expires is not None else None)
     #user = get_user(fake_users_db, username=token_data.username)
-    db_user = crud.get_user_by_username(db, username=token_data.username)
-    if db_user is None:
-        raise credentials_exception
-    return db_user
+    user = cache.user_cache.get(username)
+    if user is None:
+        db_user = await crud.get_user_by_username_async(db, username=username)
+        if db_user is None:
+            raise credentials_exception
+        user = schemas.UserResponse.from_orm(db_user)
+        cache.user_cache.set(username, user)
+    return user
 
 async def get_current_active_user(current_user: schemas.UserResponse = Depends(get_current_user)):
     if not(current_user.is_active):
@@ -129,18 +216,23 @@ async def get_current_active_user(current_user: schemas.UserResponse = Depends(g
     return current_user
 
 @app.post("/token", response_model=schemas.Token)
-async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
-    user = authenticate_user(username=form_data.username, password=form_data.password, db=db)
+async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(), db: AsyncSession = Depends(get_async_db)):
+    try:
+        user = await authenticate_user(username=form_data.username, password=form_data.password, db=db)
+    except hashing.HashingBusy as e:
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail=str(e), headers={"Retry-After": "1"})
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect username or password",
             headers={"WWW-Authenticate": "Bearer"},
         )
+    started = time.perf_counter()
     access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     access_token = create_access_token(
         data={"sub": user.username}, expires_delta=access_token_expires
     )
+    hashing.record("login.token", time.perf_counter() - started)
     return {"access_token": access_token, "token_type": "bearer"}
 
 @app.get("/users/me/", response_model=schemas.UserResponse)
@@ -165,27 +257,50 @@ class NetflixTitleFilter(Filter):
     title_type: str | None
     #title_type: NetflixTitleTypeFilter = FilterDepends(with_prefix("_title_type", NetflixTitleTypeFilter))
     title_type__in: list[str] | None
-    #date_added: #fastapi-filter may not support dates yet
+    date_added__gte: date | None
+    date_added__lte: date | None
     release_year: int | None
-    #release_year__lt
+    release_year__in: list[int] | None
+    release_year__gte: int | None
+    release_year__lte: int | None
     rating: str | None
     rating__in: list[str] | None
     duration: int | None
+    duration__gte: int | None
+    duration__lte: int | None
     seasons: int | None
+    seasons__gte: int | None
+    seasons__lte: int | None
+    # titles with any of the names
+    country: str | None
+    country__in: list[str] | None
+    category: str | None
+    category__in: list[str] | None
+    director: str | None
+    director__in: list[str] | None
+    cast: str | None
+    cast__in: list[str] | None
     order_by: list[str] | None
     
     class Constants(Filter.Constants):
-        model = models.NetflixTitle    
+        model = models.NetflixTitle
+
+    def filter(self, query):
+        # title_type, rating and the lists aren't columns on NetflixTitle, see filters.py
+        return filters.apply_netflix_title_filters(query, self.filtering_fields)
 
 
 # End points 
 @app.post("/users/", response_model=schemas.UserResponse)
-def create_user(user: schemas.UserCreate, db: Session = Depends(get_db), token: str = Depends(oauth2_scheme)):
+async def create_user(user: schemas.UserCreate, db: AsyncSession = Depends(get_async_db), current_user: schemas.UserResponse = Depends(get_current_active_user)):
 #def create_user(user: schemas.UserCreate, db: Session = Depends(get_db)):
-    db_user = crud.get_user_by_email(db, email=user.email)
+    db_user = await crud.get_user_by_email_async(db, email=user.email)
     if db_user:
         raise HTTPException(status_code=400, detail="Email already registered")
-    return crud.create_user(db=db, user=user)
+    try:
+        return await crud.create_user_async(db=db, user=user)
+    except hashing.HashingBusy as e:
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail=str(e), headers={"Retry-After": "1"})
 
 # @app.get("/users/", response_model=list[schemas.UserResponse])
 # def read_users(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
@@ -199,40 +314,254 @@ def create_user(user: schemas.UserCreate, db: Session = Depends(get_db), token:
 #         raise HTTPException(status_code=404, detail="User not found")
 #     return db_user
 
-@app.get("/netflix/titles/", response_model=list[schemas.NetflixTitleResponse])
+def json_body(content):
+    return json.dumps(jsonable_encoder(content), separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+
+def fast_json_body(content):
+    # plain dicts/lists/dates only (no pydantic), several times faster than jsonable_encoder + json.dumps
+    return orjson.dumps(content)
+
+async def cached_json_response(key, build, if_none_match: str = None, db: AsyncSession = None):
+    # read-through cache.response_cache: await build() returns (body, headers) and only runs on a miss
+    # answers 304 when the client already has the current body (If-None-Match)
+    # db is the session build() reads from (see database.AsyncReadSession): a client that just wrote skips
+    # the cache, and what a replica returns right after a write is only kept until the replica has caught up
+    client, replica = (db.info.get("client"), db.info.get("replica")) if db is not None else (None, None)
+    cached = None if database.replica_set.is_pinned(client) else cache.response_cache.get(key)
+    cache_status = "HIT"
+    if cached is None:
+        generation = cache.response_cache.generation
+        body, headers = await build()
+        stale_seconds = database.replica_set.stale_seconds(replica)
+        cached = cache.response_cache.set(key, body, headers, generation=generation, ttl_seconds=stale_seconds or None)
+        cache_status = "MISS"
+    headers = dict(cached.headers)
+    headers["ETag"] = cached.etag
+    headers["X-Cache"] = cache_status
+    if cache.etag_matches(if_none_match, cached.etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    return Response(content=cached.body, media_type="application/json", headers=headers)
+
+def netflix_title_filter_params(netflix_title_filter: NetflixTitleFilter):
+    # the filter as a hashable, order independent value for cache keys
+    params = []
+    for name, value in netflix_title_filter.dict(exclude_none=True).items():
+        if name == "order_by":
+            value = tuple(pagination.get_ordering_values(netflix_title_filter))
+        elif isinstance(value, list):
+            value = tuple(value)
+        params.append((name, value))
+    return tuple(sorted(params))
+
+NETFLIX_TITLE_FORMATS = ["full", "compact"]
+
+SEARCH_DESCRIPTION = ("Words to find in the title or description.  Every word has to match a whole word (SQLite: the start of "
+                      "a word, \"ring\" finds \"Rings\"; Postgres: the same word stem), text inside a word isn't matched "
+                      "(\"ring\" doesn't find \"Spring\").  With SEARCH_BACKEND=ilike the term is matched anywhere instead.")
+
+@app.get("/netflix/titles/", response_model=Union[list[schemas.NetflixTitleResponse], schemas.NetflixTitlePage,
+                                                  list[schemas.NetflixTitleCompactResponse], schemas.NetflixTitleCompactPage,
+                                                  list[schemas.NetflixTitleFieldsResponse], schemas.NetflixTitleFieldsPage,
+                                                  list[schemas.NetflixTitleCompactFieldsResponse], schemas.NetflixTitleCompactFieldsPage])
 #def read_netflix_titles(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
-def read_netflix_titles(netflix_title_filter: NetflixTitleFilter = FilterDepends(NetflixTitleFilter), skip: int = 0, limit: int = 100, search: str = None, db: Session = Depends(get_db), token: str = Depends(oauth2_scheme)):
-    netflix_titles = crud.get_netflix_titles(db, skip=skip, limit=limit, search=search, netflix_title_filter=netflix_title_filter)
-    return netflix_titles
-
-@app.get("/netflix/titles/{show_id}", response_model=schemas.NetflixTitleResponse)
-def read_netflix_title(show_id: str, db: Session = Depends(get_db), token: str = Depends(oauth2_scheme)):
+# Pagination: skip/limit, or pass the X-Next-Cursor header of the previous page as cursor (skip is then ignored).
+# Cursor pages seek on the order_by columns plus id so deep pages cost the same as the first one.
+# Search uses the full text index (see fulltext.py); without an order_by results come best match first,
+# title_weight/description_weight tune how much a match in each field counts.
+# Search matches words, not substrings (SEARCH_DESCRIPTION): before the index "ring" also found "Spring".
+# facets=rating,title_type,... (any of rollups.DIMENSIONS) wraps the page as {"items": [...], "facets": {"rating": [{"key", "count"}]}}
+# with the counts over every title matching the filter and search, not just this page (one grouped query, or the rollups when unfiltered).
+# format=compact gives title type, rating, directors, cast, countries and categories as plain names (NetflixTitleCompactResponse),
+# built from row tuples without ORM objects or pydantic, several times cheaper per page (benchmarks/serialize_benchmark.py).
+# fields=show_id,title,... (any of crud.NETFLIX_TITLE_FIELDS) returns only those fields and only selects/loads what they need,
+# in either format (NetflixTitleFieldsResponse / NetflixTitleCompactFieldsResponse); without lists, title_type or rating that is a single query.
+# Responses are cached in process (see cache.response_cache) and carry an ETag for If-None-Match.
+async def read_netflix_titles(netflix_title_filter: NetflixTitleFilter = FilterDepends(NetflixTitleFilter), skip: int = 0, limit: int = 100, search: str = Query(None, description=SEARCH_DESCRIPTION), cursor: str = None, facets: str = None, format: str = "full", fields: str = None,
+                              title_weight: float = fulltext.DEFAULT_TITLE_WEIGHT, description_weight: float = fulltext.DEFAULT_DESCRIPTION_WEIGHT, if_none_match: str = Header(None),
+                              db: AsyncSession = Depends(get_async_read_db), current_user: schemas.UserResponse = Depends(get_current_active_user)):
+    facet_names = None
+    if facets is not None:
+        facet_names = list(dict.fromkeys(name.strip() for name in facets.split(",") if name.strip()))
+        unknown = [ name for name in facet_names if name not in rollups.DIMENSIONS ]
+        if unknown or not facet_names:
+            raise HTTPException(status_code=400, detail="facets must be a comma separated list of %s" % ", ".join(rollups.DIMENSIONS))
+    if format not in NETFLIX_TITLE_FORMATS:
+        raise HTTPException(status_code=400, detail="format must be one of %s" % ", ".join(NETFLIX_TITLE_FORMATS))
+    try:
+        field_names = crud.parse_netflix_title_fields(fields)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    from_rows = format == "compact" or fields is not None
+    page_options = dict(skip=skip, limit=limit, search=search, netflix_title_filter=netflix_title_filter, cursor=cursor,
+                        title_weight=title_weight, description_weight=description_weight)
+
+    async def build():
+        try:
+            if from_rows:
+                netflix_titles, names = await crud.get_netflix_title_rows_async(db, fields=field_names, with_ids=format == "full", **page_options)
+            else:
+                netflix_titles = await crud.get_netflix_titles_async(db, **page_options)
+            facet_counts = None
+            if facet_names:
+                facet_counts = await crud.get_netflix_facets_async(db, facet_names, search=search, netflix_title_filter=netflix_title_filter)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        headers = {}
+        next_cursor = crud.next_netflix_title_cursor(netflix_titles, limit, netflix_title_filter, search=search)
+        if next_cursor:
+            headers["X-Next-Cursor"] = next_cursor
+        with metrics.stage("serialize"):
+            if from_rows:
+                items = [ crud.netflix_title_fields_dict(row, field_names, names) for row in netflix_titles ]
+                return fast_json_body(items if facet_counts is None else {"items": items, "facets": facet_counts}), headers
+            items = [ schemas.NetflixTitleResponse.from_orm(netflix_title) for netflix_title in netflix_titles ]
+            if facet_counts is None:
+                return json_body(items), headers
+            return json_body(schemas.NetflixTitlePage(items=items, facets=facet_counts)), headers
+
+    key = cache.netflix_title_list_key(filter=netflix_title_filter_params(netflix_title_filter), skip=None if cursor else skip, limit=limit, search=search,
+                                       cursor=cursor, title_weight=title_weight, description_weight=description_weight,
+                                       facets=tuple(facet_names) if facet_names else None, format=format,
+                                       fields=tuple(field_names) if fields is not None else None)
+    return await cached_json_response(key, build, if_none_match, db=db)
+
+# Counts and duration/seasons min/max/avg grouped by release year, rating, title type, country and category.
+# Accepts the same filters and search as /netflix/titles/ (which are aggregated live, unfiltered stats are pre-aggregated)
+@app.get("/netflix/stats", response_model=schemas.NetflixStatsResponse)
+async def read_netflix_stats(netflix_title_filter: NetflixTitleFilter = FilterDepends(NetflixTitleFilter), search: str = Query(None, description=SEARCH_DESCRIPTION), db: AsyncSession = Depends(get_async_read_db), current_user: schemas.UserResponse = Depends(get_current_active_user)):
+    return await crud.get_netflix_stats_async(db, search=search, netflix_title_filter=netflix_title_filter)
+
+# The whole catalog in the Kaggle column layout as ndjson or csv, optionally gzipped (same as `python -m app.export`)
+# Streamed a batch at a time, the generator runs in the threadpool with its own short lived connections
+@app.get("/netflix/titles/export")
+async def export_netflix_titles(format: str = "ndjson", gzip: bool = False, batch_size: int = export.DEFAULT_BATCH_SIZE, token: str = Depends(oauth2_scheme),
+                                current_user: schemas.UserResponse = Depends(get_current_active_user)):
+    if format not in export.FORMATS:
+        raise HTTPException(status_code=400, detail="format must be one of %s" % ", ".join(export.FORMATS))
+    if not 1 <= batch_size <= export.MAX_BATCH_SIZE:
+        raise HTTPException(status_code=400, detail="batch_size must be between 1 and %d" % export.MAX_BATCH_SIZE)
+    return StreamingResponse(
+        export.export_chunks(database.read_engine(cache.token_key(token)), format=format, gzip=gzip, batch_size=batch_size),
+        media_type=export.media_type(format, gzip),
+        headers={"Content-Disposition": 'attachment; filename="%s"' % export.filename(format, gzip)},
+    )
 
-    netflix_title = crud.get_netflix_title_by_show_id(db, show_id=show_id)
-    if netflix_title is None:
-        raise HTTPException(status_code=404, detail="Netflix title not found")
-    return netflix_title
+# fields=... as for /netflix/titles/, the body is then a NetflixTitleFieldsResponse
+@app.get("/netflix/titles/{show_id}", response_model=Union[schemas.NetflixTitleResponse, schemas.NetflixTitleFieldsResponse])
+async def read_netflix_title(show_id: str, fields: str = None, if_none_match: str = Header(None), db: AsyncSession = Depends(get_async_read_db), current_user: schemas.UserResponse = Depends(get_current_active_user)):
+    try:
+        field_names = crud.parse_netflix_title_fields(fields)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    async def build():
+        if fields is not None:
+            row, names = await crud.get_netflix_title_row_by_show_id_async(db, show_id=show_id, fields=field_names, with_ids=True)
+            if row is None:
+                raise HTTPException(status_code=404, detail="Netflix title not found")
+            with metrics.stage("serialize"):
+                return fast_json_body(crud.netflix_title_fields_dict(row, field_names, names)), {}
+        netflix_title = await crud.get_netflix_title_by_show_id_async(db, show_id=show_id)
+        if netflix_title is None:
+            raise HTTPException(status_code=404, detail="Netflix title not found")
+        with metrics.stage("serialize"):
+            return json_body(schemas.NetflixTitleResponse.from_orm(netflix_title)), {}
+
+    key = cache.netflix_title_key(show_id, fields=tuple(field_names) if fields is not None else None)
+    return await cached_json_response(key, build, if_none_match, db=db)
 
 @app.post("/netflix/titles/", response_model=schemas.NetflixTitleResponse)
-def create_netflix_title(netflix_title: schemas.NetflixTitleCreate, db: Session = Depends(get_db), token: str = Depends(oauth2_scheme)):
-    db_netflix_title = crud.get_netflix_title_by_show_id(db, show_id=netflix_title.show_id)
+async def create_netflix_title(netflix_title: schemas.NetflixTitleCreate, db: AsyncSession = Depends(get_async_db), current_user: schemas.UserResponse = Depends(get_current_active_user)):
+    db_netflix_title = await crud.get_netflix_title_by_show_id_async(db, show_id=netflix_title.show_id)
     if db_netflix_title:
         raise HTTPException(status_code=400, detail="Show ID already in use")
-    return crud.create_netflix_title(db=db, netflix_title=netflix_title)
+    db_netflix_title = await crud.create_netflix_title_async(db=db, netflix_title=netflix_title)
+    cache.invalidate_netflix_titles([db_netflix_title.show_id])
+    return db_netflix_title
+
+# Create or replace many titles in one request, each payload is the same as POST /netflix/titles/
+# Per item status: created, updated, unchanged (already identical) or error (the rest of the batch still applies)
+# Plain def for the same reason as the upload below, diffing thousands of titles is cpu work
+@app.post("/netflix/titles/bulk", response_model=schemas.NetflixBulkResult)
+def bulk_upsert_netflix_titles(netflix_titles: list[schemas.NetflixTitleCreate], db: Session = Depends(get_db), current_user: schemas.UserResponse = Depends(get_current_active_user)):
+    if len(netflix_titles) > bulk.MAX_ITEMS:
+        raise HTTPException(status_code=413, detail="At most %d titles per request" % bulk.MAX_ITEMS)
+    try:
+        result = bulk.upsert_netflix_titles(db, netflix_titles)
+    except IntegrityError:
+        # a concurrent request created one of the new show_ids first, nothing was applied
+        raise HTTPException(status_code=409, detail="Conflicting concurrent write, retry the batch")
+    cache.invalidate_netflix_titles([ item["show_id"] for item in result["items"] if item["status"] in (bulk.CREATED, bulk.UPDATED) ])
+    return result
+
+# Bulk load a Kaggle format csv (same loader as `python -m app.ingest`)
+# Plain def on purpose: csv parsing is cpu bound, so this runs in the threadpool with a sync session
+@app.post("/netflix/titles/upload", response_model=schemas.NetflixIngestResult)
+def upload_netflix_titles(file: UploadFile, chunk_size: int = ingest.DEFAULT_CHUNK_SIZE, db: Session = Depends(get_db), current_user: schemas.UserResponse = Depends(get_current_active_user)):
+    if chunk_size < 1:
+        raise HTTPException(status_code=400, detail="chunk_size must be positive")
+    # UploadFile is spooled to disk for large files so this streams rather than reading it all in
+    csv_file = io.TextIOWrapper(file.file, encoding="utf-8-sig", newline="")
+    try:
+        return ingest.ingest_netflix_csv(db, csv_file, chunk_size=chunk_size)
+    except (KeyError, ValueError) as e:
+        raise HTTPException(status_code=400, detail="Invalid netflix titles csv: %s" % e)
+    finally:
+        # earlier chunks may have committed even if a later one failed
+        cache.invalidate_netflix_titles()
 
 @app.put("/netflix/titles/{show_id}", response_model=schemas.NetflixTitleResponse)
-def put_netflix_title(show_id: str, netflix_title: schemas.NetflixTitlePut, db: Session = Depends(get_db), token: str = Depends(oauth2_scheme)):
-    db_netflix_title = crud.get_netflix_title_by_show_id(db, show_id=show_id)
+async def put_netflix_title(show_id: str, netflix_title: schemas.NetflixTitlePut, db: AsyncSession = Depends(get_async_db), current_user: schemas.UserResponse = Depends(get_current_active_user)):
+    db_netflix_title = await crud.get_netflix_title_by_show_id_async(db, show_id=show_id)
     if not(db_netflix_title):
         raise HTTPException(status_code=400, detail="Netflix title not found")
-    return crud.update_netflix_title(db=db, db_netflix_title=db_netflix_title, netflix_title=netflix_title)
+    db_netflix_title = await crud.update_netflix_title_async(db=db, db_netflix_title=db_netflix_title, netflix_title=netflix_title)
+    cache.invalidate_netflix_titles([show_id])
+    return db_netflix_title
 
 @app.patch("/netflix/titles/{show_id}", response_model=schemas.NetflixTitleResponse)
-def patch_netflix_title(show_id: str, netflix_title: schemas.NetflixTitlePatch, db: Session = Depends(get_db), token: str = Depends(oauth2_scheme)):
-    db_netflix_title = crud.get_netflix_title_by_show_id(db, show_id=show_id)
+async def patch_netflix_title(show_id: str, netflix_title: schemas.NetflixTitlePatch, db: AsyncSession = Depends(get_async_db), current_user: schemas.UserResponse = Depends(get_current_active_user)):
+    db_netflix_title = await crud.get_netflix_title_by_show_id_async(db, show_id=show_id)
     if not(db_netflix_title):
         raise HTTPException(status_code=400, detail="Netflix title not found")
-    return crud.partial_update_netflix_title(db=db, db_netflix_title=db_netflix_title, netflix_title=netflix_title)
+    db_netflix_title = await crud.partial_update_netflix_title_async(db=db, db_netflix_title=db_netflix_title, netflix_title=netflix_title)
+    cache.invalidate_netflix_titles([show_id])
+    return db_netflix_title
+
+@app.get("/cache/stats")
+async def read_cache_stats(current_user: schemas.UserResponse = Depends(get_current_active_user)):
+    return {
+        "dimensions": cache.dimension_cache.stats(),
+        "responses": cache.response_cache.stats(),
+        "tokens": cache.token_cache.stats(),
+        "users": cache.user_cache.stats(),
+    }
+
+# Password hashing pool and per stage login latency (lookup, verify queue/cpu, token)
+@app.get("/auth/stats")
+async def read_auth_stats(current_user: schemas.UserResponse = Depends(get_current_active_user)):
+    return hashing.stats()
+
+@app.get("/startup/stats")
+async def read_startup_stats(current_user: schemas.UserResponse = Depends(get_current_active_user)):
+    return { phase: seconds * 1000 for phase, seconds in startup_timings.items() }
+
+# Prometheus scrape target for the per route histograms in metrics.py - no token, scrapers can't log in
+@app.get("/metrics")
+async def read_metrics():
+    return Response(content=metrics.exposition(), media_type=metrics.CONTENT_TYPE)
+
+# Connection pools: checked out/in, overflow, checkout wait, connect latency and timeouts
+# plus how reads were routed between the primary and the replicas
+@app.get("/db/stats")
+async def read_db_stats(current_user: schemas.UserResponse = Depends(get_current_active_user)):
+    return dict(database.pool_stats(), routing=database.replica_set.stats())
+
+# Statement shapes that took at least SLOW_QUERY_MS, most total time first, with the plan captured
+# the first time each was slow and the route/filter of the latest one (see slow_queries.py)
+@app.get("/db/slow-queries")
+async def read_slow_queries(current_user: schemas.UserResponse = Depends(get_current_active_user)):
+    return slow_queries.stats()
 
 # @app.post("/users/{user_id}/items/", response_model=schemas.Item)
 # def create_item_for_user(
@@ -245,3 +574,5 @@ def patch_netflix_title(show_id: str, netflix_title: schemas.NetflixTitlePatch,
 # def read_items(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
 #     items = crud.get_items(db, skip=skip, limit=limit)
 #     return items
+
+startup_timings["import"] = time.perf_counter() - IMPORT_STARTED
@@ -0,0 +1,229 @@
+import contextvars
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# Per request instrumentation, exported in the Prometheus text format on /metrics.
+# MetricsMiddleware (outermost, see main.py) puts a RequestMetrics in a context variable for the
+# request; the engine events in database.py add each statement and its time to it, the ORM load
+# event counts the instances hydrated, and the endpoints time their own stages (serialize, auth)
+# with stage().  When the response is finished the request is observed into the histograms below,
+# labelled with the route template (/netflix/titles/{show_id}, not the path).
+# SERVER_TIMING=1 also sends the split as a Server-Timing header, e.g.
+#   Server-Timing: db;dur=12.1;desc="7 statements", orm;desc="412 rows", serialize;dur=9.8, auth;dur=0.1, app;dur=31.0
+# (taken when the headers go out, so for a streamed response only what happened before the first chunk).
+
+SERVER_TIMING = os.environ.get('SERVER_TIMING', 'false').lower() in ('1', 'true', 'yes')
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+class RequestMetrics:
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.statements = 0
+        self.sql_seconds = 0.0
+        self.rows = 0
+        self.stages = {}
+        self.response_bytes = 0
+        self.status = None
+        self.scope = None
+        # what the request's queries were built from (filter, search), for the slow query log
+        self.annotations = {}
+
+current = contextvars.ContextVar("request_metrics", default=None)
+
+def record_statement(seconds: float):
+    request_metrics = current.get()
+    if request_metrics is not None:
+        request_metrics.statements += 1
+        request_metrics.sql_seconds += seconds
+
+def record_rows(count: int = 1):
+    request_metrics = current.get()
+    if request_metrics is not None:
+        request_metrics.rows += count
+
+def annotate(**values):
+    request_metrics = current.get()
+    if request_metrics is not None:
+        request_metrics.annotations.update(values)
+
+def current_annotations():
+    request_metrics = current.get()
+    return dict(request_metrics.annotations) if request_metrics is not None else {}
+
+def current_route():
+    # "GET /netflix/titles/" for the request being handled, None outside of a request (e.g. the CLIs)
+    request_metrics = current.get()
+    if request_metrics is None or request_metrics.scope is None:
+        return None
+    return "%s %s" % (request_metrics.scope["method"], route_template(request_metrics.scope))
+
+@contextmanager
+def stage(name: str):
+    # time a block of the current request, e.g. with metrics.stage("serialize"):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        request_metrics = current.get()
+        if request_metrics is not None:
+            request_metrics.stages[name] = request_metrics.stages.get(name, 0.0) + time.perf_counter() - started
+
+def escape_label(value: str):
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+def format_labels(label_names: tuple, labels: tuple, extra: str = None):
+    pairs = [ '%s="%s"' % (name, escape_label(value)) for name, value in zip(label_names, labels) ]
+    if extra:
+        pairs.append(extra)
+    return "{%s}" % ",".join(pairs) if pairs else ""
+
+class Counter:
+
+    def __init__(self, name: str, help: str, label_names: tuple):
+        self.name = name
+        self.help = help
+        self.label_names = label_names
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, labels: tuple, amount: float = 1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def exposition(self):
+        lines = ["# HELP %s %s" % (self.name, self.help), "# TYPE %s counter" % self.name]
+        with self._lock:
+            for labels, value in sorted(self._values.items()):
+                lines.append("%s%s %s" % (self.name, format_labels(self.label_names, labels), repr(float(value))))
+        return lines
+
+class Histogram:
+
+    def __init__(self, name: str, help: str, buckets: list, label_names: tuple):
+        self.name = name
+        self.help = help
+        self.buckets = sorted(buckets)
+        self.label_names = label_names
+        # labels -> [count per bucket (not cumulative, the last one is +Inf), sum]
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, labels: tuple, value: float):
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            index = len(self.buckets)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    index = i
+                    break
+            series[0][index] += 1
+            series[1] += value
+
+    def exposition(self):
+        lines = ["# HELP %s %s" % (self.name, self.help), "# TYPE %s histogram" % self.name]
+        with self._lock:
+            for labels, (counts, total) in sorted(self._series.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets + ["+Inf"], counts):
+                    cumulative += count
+                    le = 'le="%s"' % (bound if bound == "+Inf" else repr(float(bound)))
+                    lines.append("%s_bucket%s %d" % (self.name, format_labels(self.label_names, labels, le), cumulative))
+                lines.append("%s_sum%s %s" % (self.name, format_labels(self.label_names, labels), repr(float(total))))
+                lines.append("%s_count%s %d" % (self.name, format_labels(self.label_names, labels), cumulative))
+        return lines
+
+SECONDS_BUCKETS = [0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10]
+COUNT_BUCKETS = [0, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 5000, 10000]
+BYTES_BUCKETS = [100, 1000, 10000, 100000, 1000000, 10000000, 100000000]
+
+ROUTE_LABELS = ("method", "route")
+
+requests_total = Counter("http_requests_total", "Requests by route and status.", ("method", "route", "status"))
+request_seconds = Histogram("http_request_duration_seconds", "Time until the response was finished.", SECONDS_BUCKETS, ROUTE_LABELS)
+statements = Histogram("db_statements_per_request", "SQL statements executed per request.", COUNT_BUCKETS, ROUTE_LABELS)
+sql_seconds = Histogram("db_seconds_per_request", "Time spent executing SQL per request.", SECONDS_BUCKETS, ROUTE_LABELS)
+rows_hydrated = Histogram("orm_rows_hydrated_per_request", "ORM instances loaded per request.", COUNT_BUCKETS, ROUTE_LABELS)
+serialize_seconds = Histogram("serialize_seconds_per_request", "Time spent building response bodies per request.", SECONDS_BUCKETS, ROUTE_LABELS)
+auth_seconds = Histogram("auth_seconds_per_request", "Time spent authenticating per request.", SECONDS_BUCKETS, ROUTE_LABELS)
+response_bytes = Histogram("http_response_bytes", "Response body size.", BYTES_BUCKETS, ROUTE_LABELS)
+
+METRICS = [requests_total, request_seconds, statements, sql_seconds, rows_hydrated, serialize_seconds, auth_seconds, response_bytes]
+
+def observe(method: str, route: str, request_metrics: RequestMetrics):
+    labels = (method, route)
+    requests_total.inc((method, route, str(request_metrics.status)))
+    request_seconds.observe(labels, time.perf_counter() - request_metrics.started)
+    statements.observe(labels, request_metrics.statements)
+    sql_seconds.observe(labels, request_metrics.sql_seconds)
+    rows_hydrated.observe(labels, request_metrics.rows)
+    serialize_seconds.observe(labels, request_metrics.stages.get("serialize", 0.0))
+    auth_seconds.observe(labels, request_metrics.stages.get("auth", 0.0))
+    response_bytes.observe(labels, request_metrics.response_bytes)
+
+def exposition():
+    return "\n".join(line for metric in METRICS for line in metric.exposition()) + "\n"
+
+def server_timing(request_metrics: RequestMetrics):
+    parts = [
+        'db;dur=%.1f;desc="%d statements"' % (request_metrics.sql_seconds * 1000, request_metrics.statements),
+        'orm;desc="%d rows"' % request_metrics.rows,
+    ]
+    for name, seconds in request_metrics.stages.items():
+        parts.append("%s;dur=%.1f" % (name, seconds * 1000))
+    parts.append("app;dur=%.1f" % ((time.perf_counter() - request_metrics.started) * 1000))
+    return ", ".join(parts)
+
+route_paths = {}
+
+def route_template(scope):
+    # the path of the route that handled scope, "unmatched" for 404s so stray paths don't become label values
+    endpoint = scope.get("endpoint")
+    if endpoint is None:
+        return "unmatched"
+    if endpoint not in route_paths:
+        route_paths[endpoint] = next((route.path for route in scope["app"].routes if getattr(route, "endpoint", None) is endpoint), "unmatched")
+    return route_paths[endpoint]
+
+class MetricsMiddleware:
+    # plain ASGI rather than @app.middleware("http"), so streamed bodies are counted as they go out
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        request_metrics = RequestMetrics()
+        request_metrics.scope = scope
+        token = current.set(request_metrics)
+        finished = False
+
+        async def send_with_metrics(message):
+            nonlocal finished
+            if message["type"] == "http.response.start":
+                request_metrics.status = message["status"]
+                if SERVER_TIMING:
+                    message["headers"] = list(message.get("headers", [])) + [(b"server-timing", server_timing(request_metrics).encode("latin-1"))]
+            elif message["type"] == "http.response.body":
+                request_metrics.response_bytes += len(message.get("body", b""))
+                if not message.get("more_body", False):
+                    finished = True
+                    observe(scope["method"], route_template(scope), request_metrics)
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_metrics)
+        except Exception:
+            # the 500 is sent further out (ServerErrorMiddleware)
+            if not finished:
+                request_metrics.status = 500
+                observe(scope["method"], route_template(scope), request_metrics)
+            raise
+        finally:
+            current.reset(token)
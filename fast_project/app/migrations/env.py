@@ -0,0 +1,23 @@
+from alembic import context
+
+from app import models
+
+# Online migrations only.  schema.run_migrations passes its connection in config.attributes,
+# the alembic command line connects with app.database.engine (same env vars as the app).
+
+config = context.config
+target_metadata = models.Base.metadata
+
+def run_migrations(connection):
+    # render_as_batch: SQLite can't ALTER most things, autogenerate then writes batch (copy and move) operations
+    context.configure(connection=connection, target_metadata=target_metadata, render_as_batch=True)
+    with context.begin_transaction():
+        context.run_migrations()
+
+connection = config.attributes.get("connection")
+if connection is not None:
+    run_migrations(connection)
+else:
+    from app.database import engine
+    with engine.connect() as connection:
+        run_migrations(connection)
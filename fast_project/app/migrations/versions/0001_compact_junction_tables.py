@@ -0,0 +1,77 @@
+"""compact junction tables
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-18
+
+The four title junction tables lose their surrogate id and created_at/updated_at columns and are
+keyed on (title_id, other id), WITHOUT ROWID on SQLite, with a reverse (other id, title_id) index.  Duplicate pairs, which
+nothing prevented before, are collapsed to one row.
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = '0001'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+# table, foreign key column, table the foreign key points to
+JUNCTIONS = [
+    ("netflix_title_director_junction", "director_id", "netflix_names"),
+    ("netflix_title_cast_junction", "cast_id", "netflix_names"),
+    ("netflix_title_country_junction", "country_id", "netflix_countries"),
+    ("netflix_title_category_junction", "category_id", "netflix_categories"),
+]
+
+def has_surrogate_id(table_name):
+    return "id" in [ column["name"] for column in sa.inspect(op.get_bind()).get_columns(table_name) ]
+
+def replace_table(table_name, new_name, columns, copy_columns, where="", **table_options):
+    # build new_name, copy the rows over, then swap it in under table_name
+    op.create_table(new_name, *columns, **table_options)
+    op.execute("INSERT INTO %s (%s) SELECT DISTINCT %s FROM %s %s" % (new_name, copy_columns, copy_columns, table_name, where))
+    op.drop_table(table_name)
+    op.rename_table(new_name, table_name)
+    if op.get_bind().dialect.name == "postgresql":
+        # postgres keeps the primary key index name of the table as created
+        op.execute("ALTER INDEX %s_pkey RENAME TO %s_pkey" % (new_name, table_name))
+
+
+def upgrade():
+    for table_name, foreign_key, target_table in JUNCTIONS:
+        if not has_surrogate_id(table_name):
+            # already compact, create_all made it from the current models
+            continue
+        replace_table(
+            table_name, table_name + "_compact",
+            [
+                sa.Column("title_id", sa.Integer, sa.ForeignKey("netflix_titles.id"), primary_key=True),
+                sa.Column(foreign_key, sa.Integer, sa.ForeignKey(target_table + ".id"), primary_key=True),
+            ],
+            "title_id, %s" % foreign_key,
+            where="WHERE title_id IS NOT NULL AND %s IS NOT NULL" % foreign_key,
+            sqlite_with_rowid=False,
+        )
+        op.create_index("ix_%s_%s_title_id" % (table_name, foreign_key), table_name, [foreign_key, "title_id"])
+
+
+def downgrade():
+    for table_name, foreign_key, target_table in JUNCTIONS:
+        if has_surrogate_id(table_name):
+            continue
+        replace_table(
+            table_name, table_name + "_legacy",
+            [
+                sa.Column("id", sa.Integer, primary_key=True),
+                sa.Column("title_id", sa.Integer, sa.ForeignKey("netflix_titles.id")),
+                sa.Column(foreign_key, sa.Integer, sa.ForeignKey(target_table + ".id")),
+                sa.Column("created_at", sa.DateTime),
+                sa.Column("updated_at", sa.DateTime),
+            ],
+            "title_id, %s" % foreign_key,
+        )
+        op.create_index("ix_%s_id" % table_name, table_name, ["id"])
+        op.create_index("ix_%s_title_id" % table_name, table_name, ["title_id"])
@@ -0,0 +1,35 @@
+"""netflix title filter indexes
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-18
+
+Indexes for the common title filters (see app/filters.py): title type, rating, release year and date added.
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = '0002'
+down_revision = '0001'
+branch_labels = None
+depends_on = None
+
+COLUMNS = ["title_type_id", "rating_id", "release_year", "date_added"]
+
+def index_name(column):
+    return "ix_netflix_titles_%s" % column
+
+
+def upgrade():
+    # create_all has already made them on a new database
+    existing = { index["name"] for index in sa.inspect(op.get_bind()).get_indexes("netflix_titles") }
+    for column in COLUMNS:
+        if index_name(column) not in existing:
+            op.create_index(index_name(column), "netflix_titles", [column])
+
+
+def downgrade():
+    for column in COLUMNS:
+        op.drop_index(index_name(column), table_name="netflix_titles")
@@ -3,7 +3,7 @@ from logging.handlers import RotatingFileHandler
 #from msilib.schema import Directory
 from uuid import UUID
 import enum
-from sqlalchemy import Boolean, Column, ForeignKey, Integer, String, DateTime, Date, Enum
+from sqlalchemy import Boolean, Column, ForeignKey, Index, Integer, String, DateTime, Date, Enum
 #from sqlalchemy.dialects.postgresql import UUID
 from sqlalchemy.orm import relationship
 from sqlalchemy.ext.hybrid import hybrid_property
@@ -86,15 +86,15 @@ class NetflixTitle(Base):
     #uuid = Column(UUID, unique=True, index=True, as_uuid=True) # see if making this primary key impacts performance
     show_id = Column(String, unique=True, index=True)
     #title_type = Column(Enum(NetflixTypeEnum)) # choices Movie, TV Show
-    title_type_id = Column(Integer, ForeignKey("netflix_title_types.id"))
+    title_type_id = Column(Integer, ForeignKey("netflix_title_types.id"), index=True)
     title = Column(String, index=True)
     #director = Column(String, index=True) # consider another table, consider list field, 
     #cast
     #country = Column(String, index=True)
-    date_added = Column(Date)
-    release_year = Column(Integer)
+    date_added = Column(Date, index=True)
+    release_year = Column(Integer, index=True)
     #rating = Column(Enum(NetflixRatingEnum))
-    rating_id = Column(Integer, ForeignKey("netflix_ratings.id"))
+    rating_id = Column(Integer, ForeignKey("netflix_ratings.id"), index=True)
     duration = Column(Integer)
     seasons = Column(Integer)
     #listed_in    #many to many relationship for genres or categories
@@ -110,13 +110,14 @@ class NetflixTitle(Base):
     _title_type = relationship("NetflixTitleType")   #Reference: https://stackoverflow.com/questions/31439394/sqlalchemy-select-data-associated-with-foreign-key-not-the-foreign-key-itself
     _rating = relationship("NetflixRating")
 
+    # rating and title type can be missing for bulk loaded rows (blank in the kaggle csv)
     @property
     def title_type(self):
-        return self._title_type.name
+        return self._title_type.name if self._title_type else None
 
     @property
     def rating(self):
-        return self._rating.name
+        return self._rating.name if self._rating else None
 
 class NetflixName(Base):
     __tablename__ = "netflix_names"
@@ -135,23 +136,20 @@ class NetflixName(Base):
 
 class NetflixTitleDirectorJunction(Base):
     __tablename__ = "netflix_title_director_junction"
+    # junction tables are just the pair: the primary key (title_id, other id) serves the title -> names
+    # loads and keeps pairs unique, the (other id, title_id) index serves the reverse lookups
+    # (WITHOUT ROWID on SQLite so the rows live in the primary key b-tree instead of next to it)
+    __table_args__ = (Index("ix_netflix_title_director_junction_director_id_title_id", "director_id", "title_id"), {"sqlite_with_rowid": False})
 
-    id = Column(Integer, primary_key=True, index=True)
-    #uuid = Column(UUID, unique=True, index=True, as_uuid=True) # see if making this primary key impacts performance
-    title_id = Column(Integer, ForeignKey("netflix_titles.id"))
-    director_id = Column(Integer, ForeignKey("netflix_names.id"))
-    created_at = Column(DateTime, default=datetime.datetime.utcnow)
-    updated_at = Column(DateTime, default=datetime.datetime.utcnow, onupdate=datetime.datetime.utcnow)
+    title_id = Column(Integer, ForeignKey("netflix_titles.id"), primary_key=True)
+    director_id = Column(Integer, ForeignKey("netflix_names.id"), primary_key=True)
 
 class NetflixTitleCastJunction(Base):
     __tablename__ = "netflix_title_cast_junction"
+    __table_args__ = (Index("ix_netflix_title_cast_junction_cast_id_title_id", "cast_id", "title_id"), {"sqlite_with_rowid": False})
 
-    id = Column(Integer, primary_key=True, index=True)
-    #uuid = Column(UUID, unique=True, index=True, as_uuid=True) # see if making this primary key impacts performance
-    title_id = Column(Integer, ForeignKey("netflix_titles.id"))
-    cast_id = Column(Integer, ForeignKey("netflix_names.id"))
-    created_at = Column(DateTime, default=datetime.datetime.utcnow)
-    updated_at = Column(DateTime, default=datetime.datetime.utcnow, onupdate=datetime.datetime.utcnow)
+    title_id = Column(Integer, ForeignKey("netflix_titles.id"), primary_key=True)
+    cast_id = Column(Integer, ForeignKey("netflix_names.id"), primary_key=True)
 
 class NetflixCountry(Base):
     __tablename__ = "netflix_countries"
@@ -164,13 +162,10 @@ class NetflixCountry(Base):
 
 class NetflixTitleCountryJunction(Base):
     __tablename__ = "netflix_title_country_junction"
+    __table_args__ = (Index("ix_netflix_title_country_junction_country_id_title_id", "country_id", "title_id"), {"sqlite_with_rowid": False})
 
-    id = Column(Integer, primary_key=True, index=True)
-    #uuid = Column(UUID, unique=True, index=True, as_uuid=True) # see if making this primary key impacts performance
-    title_id = Column(Integer, ForeignKey("netflix_titles.id"))
-    country_id = Column(Integer, ForeignKey("netflix_countries.id"))    
-    created_at = Column(DateTime, default=datetime.datetime.utcnow)
-    updated_at = Column(DateTime, default=datetime.datetime.utcnow, onupdate=datetime.datetime.utcnow)
+    title_id = Column(Integer, ForeignKey("netflix_titles.id"), primary_key=True)
+    country_id = Column(Integer, ForeignKey("netflix_countries.id"), primary_key=True)
 
 
 class NetflixCategory(Base):
@@ -184,10 +179,36 @@ class NetflixCategory(Base):
 
 class NetflixTitleCategoryJunction(Base):
     __tablename__ = "netflix_title_category_junction"
+    __table_args__ = (Index("ix_netflix_title_category_junction_category_id_title_id", "category_id", "title_id"), {"sqlite_with_rowid": False})
+
+    title_id = Column(Integer, ForeignKey("netflix_titles.id"), primary_key=True)
+    category_id = Column(Integer, ForeignKey("netflix_categories.id"), primary_key=True)
+
+class NetflixTitleRollup(Base):
+    __tablename__ = "netflix_title_rollups"
+
+    # Pre-aggregated title counts and duration/seasons stats per group, kept up to date by the
+    # write paths (see rollups.py) so summary requests don't GROUP BY over the junction tables.
+    # dimension: all, release_year, rating, title_type, country or category
+    # key: the group value as text ('' for dimension all and for titles without a rating/title type)
+    dimension = Column(String, primary_key=True)
+    key = Column(String, primary_key=True)
+    title_count = Column(Integer, default=0, nullable=False)
+    duration_count = Column(Integer, default=0, nullable=False)
+    duration_sum = Column(Integer, default=0, nullable=False)
+    duration_min = Column(Integer)
+    duration_max = Column(Integer)
+    seasons_count = Column(Integer, default=0, nullable=False)
+    seasons_sum = Column(Integer, default=0, nullable=False)
+    seasons_min = Column(Integer)
+    seasons_max = Column(Integer)
+    updated_at = Column(DateTime, default=datetime.datetime.utcnow, onupdate=datetime.datetime.utcnow)
 
-    id = Column(Integer, primary_key=True, index=True)
-    #uuid = Column(UUID, unique=True, index=True, as_uuid=True) # see if making this primary key impacts performance
-    title_id = Column(Integer, ForeignKey("netflix_titles.id"))
-    category_id = Column(Integer, ForeignKey("netflix_categories.id"))    
-    created_at = Column(DateTime, default=datetime.datetime.utcnow)
+class SchemaVersion(Base):
+    __tablename__ = "schema_version"
+
+    # One row: the schema version last set up by schema.init_schema and the search backend it settled on
+    id = Column(Integer, primary_key=True)
+    version = Column(Integer, nullable=False)
+    search_backend = Column(String, nullable=False)
     updated_at = Column(DateTime, default=datetime.datetime.utcnow, onupdate=datetime.datetime.utcnow)
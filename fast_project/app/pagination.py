@@ -0,0 +1,90 @@
+import base64
+import binascii
+import json
+
+from sqlalchemy import and_, false, or_
+
+# Keyset (cursor) pagination.
+# Pages are found by seeking past the last row of the previous page on the sort key plus id,
+# rather than with OFFSET, so page 500 costs the same as page 1 and concurrent inserts don't
+# make pages skip or repeat rows.
+#
+# Ordering treats NULL as larger than any value (Postgres' default: ASC NULLS LAST, DESC NULLS FIRST)
+# and always ends with the primary key so every row has a unique position.
+# Reference: https://use-the-index-luke.com/no-offset
+
+class InvalidCursor(ValueError):
+    pass
+
+def get_ordering_values(filter_obj):
+    # fastapi-filter hands the endpoint a wrapper where list fields are still the raw "a,-b" string
+    order_by = getattr(filter_obj, "order_by", None)
+    if isinstance(order_by, str):
+        order_by = order_by.split(",")
+    return [value.strip() for value in order_by or [] if value.strip()]
+
+def get_sort_keys(model, ordering_values):
+    # [(column, descending)] for "+field"/"-field" values, id appended as the tie breaker
+    columns = model.__table__.columns
+    sort_keys = []
+    for value in ordering_values:
+        name = value.lstrip("+-")
+        if name not in columns:
+            raise ValueError("%s is not a sortable column" % name)
+        sort_keys.append((columns[name], value.startswith("-")))
+    if not any(column is columns["id"] for column, _ in sort_keys):
+        sort_keys.append((columns["id"], False))
+    return sort_keys
+
+def order_by_clauses(sort_keys):
+    return [
+        column.desc().nulls_first() if descending else column.asc().nulls_last()
+        for column, descending in sort_keys
+    ]
+
+def sort_signature(sort_keys):
+    return ["%s%s" % ("-" if descending else "+", column.name) for column, descending in sort_keys]
+
+def encode_cursor(row, sort_keys):
+    values = []
+    for column, _ in sort_keys:
+        value = getattr(row, column.key)
+        values.append(value.isoformat() if hasattr(value, "isoformat") else value)
+    payload = json.dumps({"o": sort_signature(sort_keys), "k": values}, separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+def decode_cursor(cursor: str, sort_keys):
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        values = payload["k"]
+        order = payload["o"]
+    except (binascii.Error, ValueError, TypeError, KeyError):
+        raise InvalidCursor("Invalid cursor")
+    if order != sort_signature(sort_keys) or len(values) != len(sort_keys):
+        raise InvalidCursor("Cursor does not match order_by")
+    decoded = []
+    for (column, _), value in zip(sort_keys, values):
+        if value is not None and isinstance(value, str) and column.type.python_type is not str:
+            try:
+                value = column.type.python_type.fromisoformat(value)
+            except (AttributeError, ValueError):
+                raise InvalidCursor("Invalid cursor")
+        decoded.append(value)
+    return decoded
+
+def _after(column, descending, value):
+    # strictly after value in this column's direction, NULL being the largest value
+    if descending:
+        return column.isnot(None) if value is None else column < value
+    return false() if value is None else or_(column > value, column.is_(None))
+
+def _same(column, value):
+    return column.is_(None) if value is None else column == value
+
+def seek_clause(sort_keys, values):
+    # (k1 after v1) OR (k1 = v1 AND k2 after v2) OR ... - rows strictly after the cursor row
+    clauses = []
+    for i, (column, descending) in enumerate(sort_keys):
+        ties = [_same(tie_column, tie_value) for (tie_column, _), tie_value in zip(sort_keys[:i], values[:i])]
+        clauses.append(and_(*ties, _after(column, descending, values[i])))
+    return or_(*clauses)
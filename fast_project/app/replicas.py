@@ -0,0 +1,146 @@
+import argparse
+import itertools
+import os
+import threading
+import time
+from collections import OrderedDict
+
+# Read/write splitting.
+# GET endpoints take their session from main.get_async_read_db, which binds it to one of the replica
+# engines (database.replica_set), everything else uses the primary (database.engine / async_engine).
+# Replicas lag the primary, so for DB_READ_STICKY_SECONDS after a client writes:
+#   - that client's reads go to the primary (read your own writes) and skip the shared response cache,
+#     which may hold a page another client just read from a lagging replica, see pin / choose / is_pinned
+#   - pages other clients read from a replica are still cached, but only until the window ends (see
+#     stale_seconds), so a page that missed the write doesn't outlive the replication lag
+# The window has to cover the replication lag.  Without DB_REPLICAS every read goes to the primary.
+#
+# DB_REPLICAS is a comma separated list, its meaning follows DB_CONNECTION_OPTION:
+#   SQLITE: database file paths, e.g. ./replica1.db,./replica2.db (see the copy command below)
+#   PRIVATE_IP: replica hosts, the other POSTGRES_* settings are shared with the primary
+#   CLOUD_SQL_CONNECTOR: replica instance connection names
+# DB_REPLICA_POLICY: round_robin (default) or least_connections (fewest checked out connections)
+
+ROUND_ROBIN = "round_robin"
+LEAST_CONNECTIONS = "least_connections"
+POLICIES = [ROUND_ROBIN, LEAST_CONNECTIONS]
+
+READ_METHODS = {"GET", "HEAD", "OPTIONS"}
+
+# how many clients' write times are remembered, the oldest are forgotten first
+MAX_PINNED_CLIENTS = 100000
+
+def replica_names():
+    return [ name.strip() for name in os.environ.get('DB_REPLICAS', '').split(",") if name.strip() ]
+
+def checked_out(engine):
+    pool = engine.pool if hasattr(engine, "pool") else engine.sync_engine.pool
+    return pool.checkedout()
+
+class Replica:
+
+    def __init__(self, name: str, engine, async_engine):
+        self.name = name
+        self.engine = engine
+        self.async_engine = async_engine
+        self.reads = 0
+
+    def connections(self):
+        return checked_out(self.engine) + checked_out(self.async_engine)
+
+class ReplicaSet:
+
+    def __init__(self, replicas: list, policy: str = ROUND_ROBIN, sticky_seconds: float = 5.0, clock=time.monotonic):
+        if policy not in POLICIES:
+            raise ValueError("Unknown replica policy %s, expected one of %s" % (policy, ", ".join(POLICIES)))
+        self.replicas = replicas
+        self.policy = policy
+        self.sticky_seconds = sticky_seconds
+        self.clock = clock
+        # client -> time of its last write, oldest first
+        self._pinned = OrderedDict()
+        self._next = itertools.count()
+        self._lock = threading.Lock()
+        # time of the latest write by any client
+        self.last_write = None
+        self.primary_reads = 0
+        self.pinned_reads = 0
+
+    def pin(self, client):
+        # call after client wrote to the primary
+        now = self.clock()
+        with self._lock:
+            self.last_write = now
+            if client is None:
+                return
+            self._pinned[client] = now
+            self._pinned.move_to_end(client)
+            # drop the clients whose window has passed (they are at the front) and keep the size bounded
+            while self._pinned and (len(self._pinned) > MAX_PINNED_CLIENTS or now - next(iter(self._pinned.values())) >= self.sticky_seconds):
+                self._pinned.popitem(last=False)
+
+    def is_pinned(self, client):
+        # client wrote less than sticky_seconds ago
+        written = self._pinned.get(client)
+        return written is not None and self.clock() - written < self.sticky_seconds
+
+    def choose(self, client=None):
+        # the replica for a read by client, None for the primary
+        if not self.replicas:
+            self.primary_reads += 1
+            return None
+        if self.is_pinned(client):
+            self.pinned_reads += 1
+            return None
+        start = next(self._next) % len(self.replicas)
+        if self.policy == LEAST_CONNECTIONS:
+            # min keeps the first of equals, starting the scan round robin spreads the ties
+            replica = min(self.replicas[start:] + self.replicas[:start], key=Replica.connections)
+        else:
+            replica = self.replicas[start]
+        with self._lock:
+            replica.reads += 1
+        return replica
+
+    def stale_seconds(self, replica):
+        # how much longer a read from replica may miss the latest write, 0 for the primary or once the window has passed
+        if replica is None or self.last_write is None:
+            return 0
+        return max(0, self.sticky_seconds - (self.clock() - self.last_write))
+
+    def stats(self):
+        return {
+            "policy": self.policy,
+            "sticky_seconds": self.sticky_seconds,
+            "primary_reads": self.primary_reads,
+            "pinned_reads": self.pinned_reads,
+            "replicas": { replica.name: {"reads": replica.reads, "checked_out": replica.connections()} for replica in self.replicas },
+        }
+
+def copy_sqlite(source_path: str, target_path: str):
+    # consistent snapshot through the sqlite backup api, safe while the source is in use
+    import sqlite3
+    source = sqlite3.connect(source_path)
+    target = sqlite3.connect(target_path)
+    try:
+        with target:
+            source.backup(target)
+    finally:
+        target.close()
+        source.close()
+
+# Local stand in for replication with DB_CONNECTION_OPTION=SQLITE: copies the primary file over each of
+# the DB_REPLICAS files, run it again whenever the replicas should catch up.
+# Usage (from fast_project): DB_REPLICAS=./replica1.db,./replica2.db python -m app.replicas copy
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Copy the SQLite primary over the DB_REPLICAS files.")
+    parser.add_argument("command", choices=["copy"])
+    parser.add_argument("--primary", default="./sql_app.db")
+    args = parser.parse_args(argv)
+
+    for path in replica_names():
+        copy_sqlite(args.primary, path)
+        print("copied %s to %s" % (args.primary, path))
+
+if __name__ == "__main__":
+    main()
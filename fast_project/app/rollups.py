@@ -0,0 +1,334 @@
+import sys
+from collections import Counter, defaultdict
+
+from sqlalchemy import Integer, String, bindparam, case, cast, delete, func, insert, literal, select, tuple_, union_all, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session, join, outerjoin
+
+from . import models
+
+# Summary rollups for /netflix/stats.
+#
+# netflix_title_rollups holds, per (dimension, key), the title count and count/sum/min/max of
+# duration and seasons.  The write paths pass the before/after state of the titles they touch
+# to apply_title_changes, which adds the difference with atomic UPDATEs in the same transaction,
+# so reading the summary is a single small select instead of GROUP BYs over the junction tables.
+# Filtered summaries can't come from the rollups and are aggregated live (get_live_stats).
+
+ALL = "all"
+DIMENSIONS = ["release_year", "rating", "title_type", "country", "category"]
+METRICS = ["duration", "seasons"]
+COUNTERS = ["title_count"] + ["%s_%s" % (metric, part) for metric in METRICS for part in ("count", "sum")]
+
+rollup_table = models.NetflixTitleRollup.__table__
+
+def title_state(db_netflix_title: models.NetflixTitle):
+    # the fields that feed the rollups, same keys as a parsed ingest row
+    return {
+        "release_year": db_netflix_title.release_year,
+        "rating": db_netflix_title.rating,
+        "title_type": db_netflix_title.title_type,
+        "countries": [ country.name for country in db_netflix_title.countries ],
+        "categories": [ category.name for category in db_netflix_title.categories ],
+        "duration": db_netflix_title.duration,
+        "seasons": db_netflix_title.seasons,
+    }
+
+def group_key(value):
+    return "" if value is None else str(value)
+
+def title_groups(state: dict):
+    groups = [
+        (ALL, ""),
+        ("release_year", group_key(state["release_year"])),
+        ("rating", group_key(state["rating"])),
+        ("title_type", group_key(state["title_type"])),
+    ]
+    groups += [ ("country", country) for country in set(state["countries"]) ]
+    groups += [ ("category", category) for category in set(state["categories"]) ]
+    return groups
+
+def least(column, value):
+    return case((value.is_(None), column), (column.is_(None), value), (value < column, value), else_=column)
+
+def greatest(column, value):
+    return case((value.is_(None), column), (column.is_(None), value), (value > column, value), else_=column)
+
+def insert_ignore(db: Session):
+    # ON CONFLICT DO NOTHING so concurrent writers can both make sure a group row exists
+    dialect_name = db.get_bind().dialect.name
+    if dialect_name == "postgresql":
+        return postgresql.insert(rollup_table).on_conflict_do_nothing()
+    if dialect_name == "sqlite":
+        return sqlite.insert(rollup_table).on_conflict_do_nothing()
+    raise NotImplementedError("rollups not supported for %s" % dialect_name)
+
+def apply_title_changes(db: Session, removed_states: list, added_states: list):
+    # removed_states: titles (or old versions of titles) leaving the catalog, added_states: new versions
+    deltas = defaultdict(Counter)
+    removed_values = defaultdict(lambda: defaultdict(Counter))
+    added_values = defaultdict(lambda: defaultdict(Counter))
+    for sign, states, values in ((-1, removed_states, removed_values), (1, added_states, added_values)):
+        for state in states:
+            for group in title_groups(state):
+                deltas[group]["title_count"] += sign
+                for metric in METRICS:
+                    value = state[metric]
+                    if value is not None:
+                        deltas[group][metric + "_count"] += sign
+                        deltas[group][metric + "_sum"] += sign * value
+                        values[group][metric][value] += 1
+
+    # an update that leaves a group's values alone cancels out
+    changes = []
+    for group, delta in deltas.items():
+        extremes_removed = {}
+        new_values = {}
+        for metric in METRICS:
+            removed = removed_values[group][metric] - added_values[group][metric]
+            added = added_values[group][metric] - removed_values[group][metric]
+            if removed:
+                extremes_removed[metric] = (min(removed), max(removed))
+            new_values[metric] = (min(added), max(added)) if added else (None, None)
+        if not any(delta.values()) and not extremes_removed and all(pair == (None, None) for pair in new_values.values()):
+            continue
+        changes.append((group, delta, new_values, extremes_removed))
+    if not changes:
+        return
+
+    db.execute(insert_ignore(db), [
+        { "dimension": dimension, "key": key, **{ counter: 0 for counter in COUNTERS } }
+        for (dimension, key), _, _, _ in changes
+    ])
+    values = { counter: rollup_table.c[counter] + bindparam("delta_" + counter, type_=Integer) for counter in COUNTERS }
+    for metric in METRICS:
+        values[metric + "_min"] = least(rollup_table.c[metric + "_min"], bindparam("new_%s_min" % metric, type_=Integer))
+        values[metric + "_max"] = greatest(rollup_table.c[metric + "_max"], bindparam("new_%s_max" % metric, type_=Integer))
+    statement = (
+        update(rollup_table)
+        .where(rollup_table.c.dimension == bindparam("group_dimension"), rollup_table.c.key == bindparam("group_key"))
+        .values(**values)
+    )
+    parameters = []
+    for (dimension, key), delta, new_values, _ in changes:
+        row = { "group_dimension": dimension, "group_key": key }
+        row.update({ "delta_" + counter: delta[counter] for counter in COUNTERS })
+        for metric in METRICS:
+            row["new_%s_min" % metric], row["new_%s_max" % metric] = new_values[metric]
+        parameters.append(row)
+    db.execute(statement, parameters)
+
+    # min/max can't be decremented: when a removed value was a group's min or max, recompute that group
+    groups_with_removals = { group: extremes for group, _, _, extremes in changes if extremes }
+    if groups_with_removals:
+        refresh_extremes(db, groups_with_removals)
+
+def refresh_extremes(db: Session, groups_with_removals: dict):
+    rows = db.execute(
+        select(rollup_table).where(tuple_(rollup_table.c.dimension, rollup_table.c.key).in_(list(groups_with_removals)))
+    ).mappings().all()
+    stale = []
+    for row in rows:
+        for metric, (removed_min, removed_max) in groups_with_removals[(row["dimension"], row["key"])].items():
+            current_min, current_max = row[metric + "_min"], row[metric + "_max"]
+            if current_min is None or removed_min <= current_min or removed_max >= current_max:
+                stale.append((row["dimension"], row["key"]))
+                break
+    if not stale:
+        return
+    # the recompute reads the titles, so pending title changes have to be in the database first
+    db.flush()
+    for dimension, key in stale:
+        query, key_column = grouped_query(dimension)
+        if dimension != ALL:
+            query = query.where(key_clause(dimension, key_column, key))
+        aggregate = db.execute(query).mappings().first()
+        db.execute(
+            update(rollup_table)
+            .where(rollup_table.c.dimension == dimension, rollup_table.c.key == key)
+            .values(**{
+                column: aggregate[column] if aggregate else None
+                for metric in METRICS for column in (metric + "_min", metric + "_max")
+            })
+        )
+
+def key_clause(dimension: str, key_column, key: str):
+    if key == "":
+        return key_column.is_(None)
+    return key_column == (int(key) if dimension == "release_year" else key)
+
+def grouped_from(dimension: str):
+    # (from clause, key column) for grouping the titles by one dimension
+    title = models.NetflixTitle
+    if dimension == ALL:
+        return title, literal("")
+    if dimension == "release_year":
+        return title, title.release_year
+    if dimension == "rating":
+        return outerjoin(title, models.NetflixRating, title.rating_id == models.NetflixRating.id), models.NetflixRating.name
+    if dimension == "title_type":
+        return outerjoin(title, models.NetflixTitleType, title.title_type_id == models.NetflixTitleType.id), models.NetflixTitleType.name
+    if dimension == "country":
+        junction = models.NetflixTitleCountryJunction
+        return join(title, junction, junction.title_id == title.id).join(models.NetflixCountry, junction.country_id == models.NetflixCountry.id), models.NetflixCountry.name
+    if dimension == "category":
+        junction = models.NetflixTitleCategoryJunction
+        return join(title, junction, junction.title_id == title.id).join(models.NetflixCategory, junction.category_id == models.NetflixCategory.id), models.NetflixCategory.name
+    raise ValueError("unknown dimension %s" % dimension)
+
+def grouped_query(dimension: str, title_ids=None):
+    # GROUP BY over the titles for one dimension, optionally limited to a subquery of title ids
+    # returns (query, key column)
+    title = models.NetflixTitle
+    from_clause, key_column = grouped_from(dimension)
+    query = select(key_column.label("key")).select_from(from_clause)
+    query = query.add_columns(
+        func.count(title.id).label("title_count"),
+        func.count(title.duration).label("duration_count"),
+        func.sum(title.duration).label("duration_sum"),
+        func.min(title.duration).label("duration_min"),
+        func.max(title.duration).label("duration_max"),
+        func.count(title.seasons).label("seasons_count"),
+        func.sum(title.seasons).label("seasons_sum"),
+        func.min(title.seasons).label("seasons_min"),
+        func.max(title.seasons).label("seasons_max"),
+    )
+    if title_ids is not None:
+        query = query.where(title.id.in_(title_ids))
+    if dimension != ALL:
+        query = query.group_by(key_column)
+    return query, key_column
+
+def rebuild(db: Session):
+    # full recompute, for backfilling existing data - caller commits
+    db.execute(delete(rollup_table))
+    for dimension in [ALL] + DIMENSIONS:
+        query, _ = grouped_query(dimension)
+        rows = [
+            dict(row, dimension=dimension, key=group_key(row["key"]), duration_sum=row["duration_sum"] or 0, seasons_sum=row["seasons_sum"] or 0)
+            for row in db.execute(query).mappings()
+            if row["title_count"]
+        ]
+        if rows:
+            db.execute(insert(rollup_table), rows)
+
+def ensure_rollups(db: Session):
+    # backfill once for catalogs loaded before the rollups existed
+    has_rollups = db.execute(select(rollup_table.c.dimension).limit(1)).first()
+    has_titles = db.execute(select(models.NetflixTitle.id).limit(1)).first()
+    if has_titles and not has_rollups:
+        rebuild(db)
+        db.commit()
+
+def metric_stats(row, metric: str):
+    count = row[metric + "_count"] or 0
+    return {
+        "count": count,
+        "min": row[metric + "_min"],
+        "max": row[metric + "_max"],
+        "avg": (row[metric + "_sum"] or 0) / count if count else None,
+    }
+
+def group_stats(dimension: str, row):
+    key = row["key"]
+    if key == "":
+        key = None
+    if key is not None and dimension == "release_year":
+        key = int(key)
+    return {
+        "key": key,
+        "count": row["title_count"],
+        "duration": metric_stats(row, "duration"),
+        "seasons": metric_stats(row, "seasons"),
+    }
+
+def empty_stats(source: str):
+    total = { "key": None, "title_count": 0, "duration_count": 0, "duration_sum": 0, "duration_min": None, "duration_max": None,
+              "seasons_count": 0, "seasons_sum": 0, "seasons_min": None, "seasons_max": None }
+    stats = { "source": source, "total": group_stats(ALL, total) }
+    stats.update({ dimension: [] for dimension in DIMENSIONS })
+    return stats
+
+def sort_groups(stats: dict):
+    for dimension in DIMENSIONS:
+        stats[dimension].sort(key=lambda group: (-group["count"], str(group["key"])))
+    return stats
+
+def get_rollup_stats(db: Session):
+    stats = empty_stats("rollup")
+    for row in db.execute(select(rollup_table).where(rollup_table.c.title_count > 0)).mappings():
+        if row["dimension"] == ALL:
+            stats["total"] = group_stats(ALL, row)
+        else:
+            stats[row["dimension"]].append(group_stats(row["dimension"], row))
+    return sort_groups(stats)
+
+def get_live_stats(db: Session, title_ids):
+    stats = empty_stats("live")
+    for dimension in [ALL] + DIMENSIONS:
+        query, _ = grouped_query(dimension, title_ids)
+        for row in db.execute(query).mappings():
+            if not row["title_count"]:
+                continue
+            if dimension == ALL:
+                stats["total"] = group_stats(ALL, row)
+            else:
+                stats[dimension].append(group_stats(dimension, dict(row, key=group_key(row["key"]))))
+    return sort_groups(stats)
+
+# Facets: title counts per key for some of DIMENSIONS, {dimension: [{"key", "count"}]} with the most titles first
+
+def facet_key(dimension: str, key):
+    if key is None or key == "":
+        return None
+    return int(key) if dimension == "release_year" else key
+
+def sort_facets(facets: dict):
+    for counts in facets.values():
+        counts.sort(key=lambda count: (-count["count"], str(count["key"])))
+    return facets
+
+def get_rollup_facets(db: Session, dimensions: list):
+    facets = { dimension: [] for dimension in dimensions }
+    query = select(rollup_table.c.dimension, rollup_table.c.key, rollup_table.c.title_count).where(
+        rollup_table.c.dimension.in_(dimensions), rollup_table.c.title_count > 0
+    )
+    for dimension, key, count in db.execute(query):
+        facets[dimension].append({ "key": facet_key(dimension, key), "count": count })
+    return sort_facets(facets)
+
+def get_live_facets(db: Session, dimensions: list, title_ids):
+    # one statement: a UNION ALL of one GROUP BY per dimension, all over the same title id subquery
+    title = models.NetflixTitle
+    queries = []
+    for dimension in dimensions:
+        from_clause, key_column = grouped_from(dimension)
+        queries.append(
+            select(literal(dimension).label("dimension"), cast(key_column, String).label("key"), func.count(title.id).label("count"))
+            .select_from(from_clause)
+            .where(title.id.in_(title_ids))
+            .group_by(key_column)
+        )
+    facets = { dimension: [] for dimension in dimensions }
+    for dimension, key, count in db.execute(union_all(*queries) if len(queries) > 1 else queries[0]):
+        facets[dimension].append({ "key": facet_key(dimension, key), "count": count })
+    return sort_facets(facets)
+
+# Usage (from fast_project): python -m app.rollups rebuild
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if argv != ["rebuild"]:
+        print("usage: python -m app.rollups rebuild", file=sys.stderr)
+        sys.exit(2)
+    from . import schema
+    from .database import SessionLocal, engine
+    schema.ensure_schema(engine)
+    db = SessionLocal()
+    try:
+        rebuild(db)
+        db.commit()
+    finally:
+        db.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+import os
+import sys
+
+from sqlalchemy import delete, insert, select
+from sqlalchemy.exc import OperationalError, ProgrammingError
+
+from . import fulltext, models
+
+# Schema setup as an explicit step.
+# create_all checks every table (a round trip each) and the search schema adds a few more, which is
+# too much to pay on every process start (Cloud Run cold starts).  The version last set up is kept
+# in the one row schema_version table, so a normal start reads that row and nothing else; the full
+# setup only runs when the row is missing or older than SCHEMA_VERSION.
+# The row also records the search backend the schema was set up for: when an indexed backend is asked for
+# that the schema doesn't have (say it was set up with SEARCH_BACKEND=ilike), only the search index is set
+# up and backfilled (see ensure_schema).
+# Bump SCHEMA_VERSION whenever models.py or the search schema (fulltext.py) change.  create_all only
+# adds what is missing, so a change to an existing table also needs an Alembic migration in
+# app/migrations (see run_migrations).
+
+SCHEMA_VERSION = 4
+
+schema_version_table = models.SchemaVersion.__table__
+
+def read_schema_version(engine):
+    # (version, search_backend), or None before the schema has ever been set up
+    try:
+        with engine.connect() as connection:
+            row = connection.execute(select(schema_version_table.c.version, schema_version_table.c.search_backend)).first()
+    except (OperationalError, ProgrammingError):
+        # no schema_version table yet
+        return None
+    return tuple(row) if row else None
+
+def migration_config(connection):
+    # alembic is only imported when the schema is set up, not on every start
+    from alembic.config import Config
+
+    config = Config()
+    config.set_main_option("script_location", os.path.join(os.path.dirname(__file__), "migrations"))
+    config.attributes["connection"] = connection
+    return config
+
+def run_migrations(engine):
+    # upgrade tables that already existed to models.py
+    from alembic import command
+
+    with engine.begin() as connection:
+        command.upgrade(migration_config(connection), "head")
+
+def write_schema_version(engine, version: int, backend):
+    with engine.begin() as connection:
+        connection.execute(delete(schema_version_table))
+        connection.execute(insert(schema_version_table).values(id=1, version=version, search_backend=backend.name))
+
+def init_schema(engine):
+    models.Base.metadata.create_all(bind=engine)
+    run_migrations(engine)
+    write_schema_version(engine, SCHEMA_VERSION, fulltext.ensure_search_schema(engine))
+
+def search_schema_missing(search_backend: str, engine):
+    # the schema was set up without the index the search backend now asked for has (e.g. under
+    # SEARCH_BACKEND=ilike), switching to ilike needs nothing: the index triggers keep running
+    wanted = fulltext.search_backend_class(engine).name
+    return wanted not in (search_backend, fulltext.IlikeSearchBackend.name)
+
+def ensure_schema(engine):
+    # returns True when the schema (or just the search index) had to be set up
+    current = read_schema_version(engine)
+    if current is not None and current[0] >= SCHEMA_VERSION:
+        version, search_backend = current
+        if not search_schema_missing(search_backend, engine):
+            fulltext.use_search_backend(engine, search_backend)
+            return False
+        # SQLite without fts5 falls back to ilike again, one failed statement per start
+        write_schema_version(engine, version, fulltext.ensure_search_schema(engine))
+        return True
+    init_schema(engine)
+    return True
+
+# Usage (from fast_project with DB_CONNECTION_OPTION etc. set): python -m app.schema init
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if argv != ["init"]:
+        print("usage: python -m app.schema init", file=sys.stderr)
+        sys.exit(2)
+    from .database import engine
+    init_schema(engine)
+    print("schema version %d (search: %s)" % (SCHEMA_VERSION, fulltext.get_search_backend(engine).name))
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,7 @@
 from datetime import date, datetime
-from typing import List, Union, Optional
+from typing import Dict, List, Union, Optional
 from click import Option
-from pydantic import BaseModel
+from pydantic import BaseModel, create_model
 
 # class ItemBase(BaseModel):
 #     title: str
@@ -135,14 +135,107 @@ class NetflixTitleResponse(NetflixTitleBase):
     id: int
     show_id: str
     #title_type_id: int
-    title_type: str
+    title_type: Union[str, None]
     directors: List[NetflixNameResponse]
     #directors: List[str]
     cast: List[NetflixNameResponse]
     countries: List[NetflixCountryResponse]
     categories: List[NetflixCategoryResponse]
-    date_added: date
+    date_added: Union[date, None]
     created_at: datetime
     updated_at: datetime
     #rating_id: int
-    rating: str
+    rating: Union[str, None]
+
+class NetflixTitleCompactResponse(BaseModel):
+    # /netflix/titles/?format=compact, the lists as plain names like NetflixTitleCreate takes them
+    id: int
+    show_id: str
+    title_type: Union[str, None]
+    title: Union[str, None]
+    date_added: Union[date, None]
+    release_year: Union[int, None]
+    rating: Union[str, None]
+    duration: Union[int, None]
+    seasons: Union[int, None]
+    description: Union[str, None]
+    created_at: datetime
+    updated_at: datetime
+    directors: List[str]
+    cast: List[str]
+    countries: List[str]
+    categories: List[str]
+
+def sparse_model(name: str, model, doc: str):
+    # model with every field optional, for responses that carry only the fields asked for
+    sparse = create_model(name, **{ field_name: (Optional[field.outer_type_], None) for field_name, field in model.__fields__.items() })
+    sparse.__doc__ = doc
+    return sparse
+
+# /netflix/titles/ and /netflix/titles/{show_id} with fields=..., only the requested fields are in the body
+NetflixTitleFieldsResponse = sparse_model("NetflixTitleFieldsResponse", NetflixTitleResponse,
+                                          "A NetflixTitleResponse with only the fields asked for with fields=..., the others are left out.")
+NetflixTitleCompactFieldsResponse = sparse_model("NetflixTitleCompactFieldsResponse", NetflixTitleCompactResponse,
+                                                 "A NetflixTitleCompactResponse with only the fields asked for with fields=..., the others are left out.")
+
+class NetflixIngestResult(BaseModel):
+    rows: int
+    inserted: int
+    skipped: int
+    chunks: int
+    seconds: float
+    rows_per_second: float
+
+class NetflixBulkItemResult(BaseModel):
+    show_id: str
+    status: str # created, updated, unchanged or error
+    detail: Union[str, None]
+
+class NetflixBulkResult(BaseModel):
+    created: int
+    updated: int
+    unchanged: int
+    errors: int
+    items: List[NetflixBulkItemResult]
+
+class NetflixMetricStats(BaseModel):
+    count: int
+    min: Union[int, None]
+    max: Union[int, None]
+    avg: Union[float, None]
+
+class NetflixGroupStats(BaseModel):
+    key: Union[int, str, None]
+    count: int
+    duration: NetflixMetricStats
+    seasons: NetflixMetricStats
+
+class NetflixStatsResponse(BaseModel):
+    source: str # rollup (pre-aggregated) or live (filtered)
+    total: NetflixGroupStats
+    release_year: List[NetflixGroupStats]
+    rating: List[NetflixGroupStats]
+    title_type: List[NetflixGroupStats]
+    country: List[NetflixGroupStats]
+    category: List[NetflixGroupStats]
+
+class NetflixFacetCount(BaseModel):
+    key: Union[int, str, None]
+    count: int
+
+class NetflixTitlePage(BaseModel):
+    # /netflix/titles/ with facets=..., the page plus title counts per facet key over every matching title
+    items: List[NetflixTitleResponse]
+    facets: Dict[str, List[NetflixFacetCount]]
+
+class NetflixTitleCompactPage(BaseModel):
+    items: List[NetflixTitleCompactResponse]
+    facets: Dict[str, List[NetflixFacetCount]]
+
+class NetflixTitleFieldsPage(BaseModel):
+    items: List[NetflixTitleFieldsResponse]
+    facets: Dict[str, List[NetflixFacetCount]]
+
+class NetflixTitleCompactFieldsPage(BaseModel):
+    items: List[NetflixTitleCompactFieldsResponse]
+    facets: Dict[str, List[NetflixFacetCount]]
@@ -0,0 +1,151 @@
+import hashlib
+import logging
+import os
+import re
+import threading
+
+from . import metrics
+
+# Slow query log.
+# Every statement that takes at least SLOW_QUERY_MS (default 500, 0 turns the log off) is logged with its
+# bound parameters, the route of the request that ran it and the filter/search it was built from (the crud
+# functions put those on the request with metrics.annotate).  The first time a query shape is slow its plan is
+# captured on the same connection and logged with it:
+#   SQLite: EXPLAIN QUERY PLAN (plain EXPLAIN is the vm bytecode, not the index choice)
+#   Postgres: EXPLAIN ANALYZE for a SELECT, EXPLAIN otherwise so a write isn't run twice,
+#   inside a savepoint so a failing EXPLAIN doesn't abort the request's transaction
+# Shapes are told apart by fingerprint(): the SQL with literals and placeholders replaced by ? and IN lists
+# collapsed, so rating__in=PG and rating__in=PG,R are the same shape but adding a country filter isn't.
+# GET /db/slow-queries lists the shapes seen so far, most total time first.
+
+SLOW_QUERY_MS = float(os.environ.get('SLOW_QUERY_MS', 500))
+SLOW_QUERY_EXPLAIN = os.environ.get('SLOW_QUERY_EXPLAIN', 'true').lower() in ('1', 'true', 'yes')
+
+# shapes remembered, once full new shapes are still logged but not explained
+MAX_FINGERPRINTS = 1000
+# longest parameter value logged as is
+MAX_PARAMETER_LENGTH = 200
+
+logger = logging.getLogger("uvicorn.error.slow_queries")
+
+NORMALIZE = [
+    (re.compile(r"'(?:[^']|'')*'"), "?"),
+    (re.compile(r"%\(\w+\)s|%s|\$\d+|(?<![:\w]):\w+"), "?"),
+    (re.compile(r"\b\d+(?:\.\d+)?\b"), "?"),
+    (re.compile(r"\(\s*\?(?:\s*,\s*\?)*\s*\)"), "(?+)"),
+    (re.compile(r"\s+"), " "),
+]
+
+EXPLAINABLE = ("SELECT", "WITH", "INSERT", "UPDATE", "DELETE")
+
+class SlowQuery:
+
+    def __init__(self, fingerprint: str, statement: str):
+        self.fingerprint = fingerprint
+        self.statement = statement
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.route = None
+        self.annotations = {}
+        self.plan = None
+
+    def stats(self):
+        return {
+            "fingerprint": self.fingerprint,
+            "statement": self.statement,
+            "count": self.count,
+            "total_ms": round(self.total_ms, 1),
+            "max_ms": round(self.max_ms, 1),
+            "route": self.route,
+            "annotations": self.annotations,
+            "plan": self.plan,
+        }
+
+slow_queries = {}
+_lock = threading.Lock()
+
+def normalize(statement: str):
+    for pattern, replacement in NORMALIZE:
+        statement = pattern.sub(replacement, statement)
+    return statement.strip()
+
+def fingerprint(statement: str):
+    return hashlib.sha1(normalize(statement).encode("utf-8")).hexdigest()[:16]
+
+def short_value(value):
+    if isinstance(value, (str, bytes)) and len(value) > MAX_PARAMETER_LENGTH:
+        return value[:MAX_PARAMETER_LENGTH] + ("...(%d more)" % (len(value) - MAX_PARAMETER_LENGTH))
+    return value
+
+def format_parameters(parameters, executemany: bool):
+    if executemany:
+        parameters = list(parameters)
+        if not parameters:
+            return "[]"
+        return "%s (and %d more sets)" % (format_parameters(parameters[0], False), len(parameters) - 1)
+    if isinstance(parameters, dict):
+        return repr({ name: short_value(value) for name, value in parameters.items() })
+    return repr(tuple(short_value(value) for value in parameters or ()))
+
+def explain(conn, statement: str, parameters):
+    # the plan as text lines, run on the connection that ran the statement so it sees the same transaction
+    dialect = conn.dialect.name
+    cursor = conn.connection.cursor()
+    try:
+        if dialect == "sqlite":
+            cursor.execute("EXPLAIN QUERY PLAN " + statement, parameters)
+            # (id, parent, notused, detail), indented by depth
+            depth = {0: -1}
+            lines = []
+            for row in cursor.fetchall():
+                depth[row[0]] = depth.get(row[1], -1) + 1
+                lines.append("  " * depth[row[0]] + row[3])
+            return lines
+        analyze = statement.lstrip().upper().startswith(("SELECT", "WITH"))
+        cursor.execute("SAVEPOINT slow_query_explain")
+        try:
+            cursor.execute(("EXPLAIN ANALYZE " if analyze else "EXPLAIN ") + statement, parameters)
+            return [ row[0] for row in cursor.fetchall() ]
+        finally:
+            cursor.execute("ROLLBACK TO SAVEPOINT slow_query_explain")
+            cursor.execute("RELEASE SAVEPOINT slow_query_explain")
+    finally:
+        cursor.close()
+
+def record(conn, statement: str, parameters, executemany: bool, seconds: float):
+    # called by the engine events in database.py for every statement that took at least SLOW_QUERY_MS
+    elapsed_ms = seconds * 1000
+    key = fingerprint(statement)
+    route = metrics.current_route()
+    annotations = metrics.current_annotations()
+    with _lock:
+        slow_query = slow_queries.get(key)
+        first = slow_query is None and len(slow_queries) < MAX_FINGERPRINTS
+        if first:
+            slow_query = slow_queries[key] = SlowQuery(key, normalize(statement))
+        if slow_query is not None:
+            slow_query.count += 1
+            slow_query.total_ms += elapsed_ms
+            slow_query.max_ms = max(slow_query.max_ms, elapsed_ms)
+            slow_query.route = route
+            slow_query.annotations = annotations
+
+    plan = None
+    if first and SLOW_QUERY_EXPLAIN and not executemany and statement.lstrip().upper().startswith(EXPLAINABLE):
+        try:
+            plan = explain(conn, statement, parameters)
+        except Exception as e:
+            plan = ["EXPLAIN failed: %s" % e]
+        slow_query.plan = plan
+
+    message = "slow query %.1fms fingerprint=%s route=%s %s\n%s\nparameters: %s" % (
+        elapsed_ms, key, route, " ".join("%s=%r" % item for item in annotations.items()),
+        statement.strip(), format_parameters(parameters, executemany))
+    if plan:
+        message += "\nplan:\n" + "\n".join("  " + line for line in plan)
+    logger.warning(message)
+
+def stats():
+    with _lock:
+        return [ slow_query.stats() for slow_query in sorted(slow_queries.values(), key=lambda slow_query: -slow_query.total_ms) ]
@@ -0,0 +1,29 @@
+# Small latency bookkeeping shared by the stats endpoints (/auth/stats, /db/stats)
+
+import threading
+from collections import deque
+
+class StageTimer:
+    # latency summary over the most recent samples of one stage
+
+    def __init__(self, samples: int = 1000):
+        self._samples = deque(maxlen=samples)
+        self._lock = threading.Lock()
+        self.count = 0
+
+    def add(self, seconds: float):
+        with self._lock:
+            self._samples.append(seconds)
+            self.count += 1
+
+    def stats(self):
+        with self._lock:
+            samples = sorted(self._samples)
+        if not samples:
+            return {"count": self.count, "p50_ms": None, "p95_ms": None, "max_ms": None}
+        return {
+            "count": self.count,
+            "p50_ms": samples[len(samples) // 2] * 1000,
+            "p95_ms": samples[min(len(samples) - 1, int(len(samples) * 0.95))] * 1000,
+            "max_ms": samples[-1] * 1000,
+        }
@@ -0,0 +1,360 @@
+import argparse
+import datetime
+import io
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+os.environ.setdefault("DB_CONNECTION_OPTION", "SQLITE")
+os.environ.setdefault("JWT_SECRET_KEY", "endpoint-benchmark")
+os.environ.setdefault("JWT_ALGORITHM", "HS256")
+os.environ.setdefault("JWT_ACCESS_TOKEN_EXPIRE_MINUTES", "30")
+# routes are timed against the database, not the response cache
+os.environ.setdefault("RESPONSE_CACHE_MAX_BYTES", "0")
+
+from benchmarks.generate import VOCABULARY, catalog_rows, load_catalog, person_name, write_kaggle_csv
+
+# Benchmark of every crud function and route on generated Kaggle shaped catalogs (benchmarks/generate.py).
+# Results are JSON (per size and case: median/p95/min ms) so runs can be kept and compared.
+#
+# Usage (from fast_project):
+#   python -m benchmarks.endpoint_benchmark run --sizes 10000 100000 1000000 --out sqlite.json
+#   DB_CONNECTION_OPTION=PRIVATE_IP POSTGRES_HOST=localhost POSTGRES_PORT=5432 POSTGRES_USER=... POSTGRES_PASS=... POSTGRES_DB=bench \
+#     python -m benchmarks.endpoint_benchmark run --sizes 10000 100000 --out postgres.json
+#   python -m benchmarks.endpoint_benchmark compare baseline.json sqlite.json --threshold 1.25
+# run uses the database the app is configured for and wipes it before every size: SQLite gets a file
+# in a temp directory, point Postgres at a scratch database (the public schema is dropped).
+# compare prints every case side by side and exits 1 when a median is over threshold times the
+# baseline and slower by more than --min-ms.
+
+SEED = 42
+PASSWORD = "benchmark"
+BULK_ITEMS = 100
+UPLOAD_ROWS = 100
+
+def list_cases(size: int):
+    # (label, query params) shared by GET /netflix/titles/ and crud.get_netflix_titles
+    return [
+        ("first page", {}),
+        ("deep skip", {"skip": size // 2}),
+        ("rating", {"rating": "TV-MA"}),
+        ("release_year range", {"release_year__gte": 2015, "release_year__lte": 2018}),
+        ("country", {"country": "India"}),
+        ("category__in", {"category__in": ["Dramas", "Comedies"]}),
+        ("cast", {"cast": person_name(0)}),
+        ("order_by -date_added", {"order_by": ["-date_added"]}),
+        ("search common", {"search": VOCABULARY[0]}),
+        ("search rare", {"search": VOCABULARY[2000]}),
+        ("search and filter", {"search": VOCABULARY[1], "title_type": "TV Show"}),
+    ]
+
+def query_params(params: dict):
+    # list values go comma separated, the way the filters read them
+    return { name: ",".join(str(item) for item in value) if isinstance(value, list) else value for name, value in params.items() }
+
+def title_payload(row: dict, show_id: bool = True):
+    from app import export
+    payload = {
+        "title_type": row["title_type"],
+        "title": row["title"],
+        "directors": row["directors"],
+        "cast": row["cast"],
+        "countries": row["countries"],
+        "date_added": export.format_date_added(row["date_added"]) or None,
+        "release_year": row["release_year"],
+        "rating": row["rating"],
+        "duration": row["duration"],
+        "seasons": row["seasons"],
+        "categories": row["categories"],
+        "description": row["description"],
+    }
+    if show_id:
+        payload["show_id"] = row["show_id"]
+    return payload
+
+def new_rows(size: int, offset: int, count: int):
+    # titles that aren't in the catalog yet, offset keeps the cases' show_ids apart
+    return list(catalog_rows(count, seed=SEED + offset, start=size + offset * 1000000 + 1))
+
+def summarize(timings: list):
+    timings = sorted(timings)
+    return {
+        "median_ms": round(statistics.median(timings), 3),
+        "p95_ms": round(timings[min(len(timings) - 1, int(len(timings) * 0.95))], 3),
+        "min_ms": round(timings[0], 3),
+        "runs": len(timings),
+    }
+
+def measure(run, repeat: int, warmup: int = 1):
+    # run(i) for i in range(repeat) timed, after warmup untimed calls (with i from repeat on)
+    for i in range(repeat, repeat + warmup):
+        run(i)
+    timings = []
+    for i in range(repeat):
+        start = time.perf_counter()
+        run(i)
+        timings.append((time.perf_counter() - start) * 1000)
+    return summarize(timings)
+
+def crud_cases(size: int, repeat: int):
+    # name -> (run(db, i), repeat)
+    from app import crud, main, models, schemas
+
+    rng = random.Random(SEED)
+    show_ids = [ "s%d" % rng.randint(1, size) for _ in range(repeat + 1) ]
+    cases = {}
+
+    def list_case(params):
+        params = dict(params)
+        skip = params.pop("skip", 0)
+        search = params.pop("search", None)
+        netflix_title_filter = main.NetflixTitleFilter(**params)
+        return lambda db, i: crud.get_netflix_titles(db, skip=skip, limit=100, search=search, netflix_title_filter=netflix_title_filter)
+
+    cases["get_user"] = (lambda db, i: crud.get_user(db, 1), repeat)
+    cases["get_user_by_email"] = (lambda db, i: crud.get_user_by_email(db, "bench@example.com"), repeat)
+    cases["get_user_by_username"] = (lambda db, i: crud.get_user_by_username(db, "bench"), repeat)
+    cases["get_users"] = (lambda db, i: crud.get_users(db), repeat)
+    cases["get_netflix_title_by_show_id"] = (lambda db, i: crud.get_netflix_title_by_show_id(db, show_ids[i]), repeat)
+    for label, params in list_cases(size):
+        cases["get_netflix_titles[%s]" % label] = (list_case(params), repeat)
+    cases["get_netflix_stats"] = (lambda db, i: crud.get_netflix_stats(db), repeat)
+    release_years = main.NetflixTitleFilter(release_year__gte=2015)
+    cases["get_netflix_stats[release_year range]"] = (lambda db, i: crud.get_netflix_stats(db, netflix_title_filter=release_years), repeat)
+    cases["get_netflix_facets[release_year range]"] = (
+        lambda db, i: crud.get_netflix_facets(db, ["rating", "title_type", "country", "category", "release_year"], netflix_title_filter=release_years), repeat
+    )
+
+    def resolve_names(db, i):
+        # the database path, not the dimension cache
+        from app import cache
+        cache.dimension_cache.clear()
+        crud.resolve_netflix_dimension_ids(db, models.NetflixName, [ person_name(j) for j in range(i * 50, i * 50 + 50) ])
+        db.commit()
+
+    cases["resolve_netflix_dimension_ids[50 names]"] = (resolve_names, repeat)
+    cases["find_or_create_netflix_name"] = (lambda db, i: (crud.find_or_create_netflix_name(db, "Bench Person %d" % i), db.commit()), repeat)
+    cases["warm_netflix_dimension_cache"] = (lambda db, i: crud.warm_netflix_dimension_cache(db), repeat)
+
+    created = new_rows(size, 1, repeat + 1)
+    cases["create_netflix_title"] = (lambda db, i: crud.create_netflix_title(db, schemas.NetflixTitleCreate(**title_payload(created[i]))), repeat)
+    replacements = new_rows(size, 2, repeat + 1)
+
+    def update(db, i):
+        db_netflix_title = crud.get_netflix_title_by_show_id(db, show_ids[i])
+        crud.update_netflix_title(db, db_netflix_title, schemas.NetflixTitleCreate(**dict(title_payload(replacements[i]), show_id=show_ids[i])))
+
+    def partial_update(db, i):
+        db_netflix_title = crud.get_netflix_title_by_show_id(db, show_ids[i])
+        crud.partial_update_netflix_title(db, db_netflix_title, schemas.NetflixTitlePatch(title="Patched %d" % i, cast=[person_name(i)]))
+
+    cases["update_netflix_title"] = (update, repeat)
+    cases["partial_update_netflix_title"] = (partial_update, repeat)
+    # bcrypt, a handful of runs is enough
+    cases["create_user"] = (lambda db, i: crud.create_user(db, schemas.UserCreate(username="crud%d" % i, email="crud%d@example.com" % i, password=PASSWORD)), min(repeat, 5))
+    return cases
+
+def run_crud_cases(size: int, repeat: int):
+    from app.database import SessionLocal
+
+    results = {}
+    for name, (run, case_repeat) in crud_cases(size, repeat).items():
+        with SessionLocal() as db:
+            def timed(i):
+                run(db, i)
+                db.expunge_all()
+            results["crud.%s" % name] = measure(timed, case_repeat)
+    return results
+
+def route_cases(client, headers: dict, size: int, repeat: int):
+    # name -> (run(i), repeat)
+    rng = random.Random(SEED + 100)
+    show_ids = [ "s%d" % rng.randint(1, size) for _ in range(repeat + 1) ]
+    cases = {}
+
+    def request(method: str, url: str, expected: int = 200, **kwargs):
+        response = client.request(method, url, headers=headers, **kwargs)
+        if response.status_code != expected:
+            raise RuntimeError("%s %s: %d %s" % (method, url, response.status_code, response.text[:200]))
+        return response
+
+    cases["POST /token"] = (lambda i: request("POST", "/token", data={"username": "bench", "password": PASSWORD}), min(repeat, 5))
+    cases["GET /users/me/"] = (lambda i: request("GET", "/users/me/"), repeat)
+    for label, params in list_cases(size):
+        cases["GET /netflix/titles/ [%s]" % label] = (lambda i, params=query_params(params): request("GET", "/netflix/titles/", params=params), repeat)
+    cases["GET /netflix/titles/ [facets]"] = (
+        lambda i: request("GET", "/netflix/titles/", params={"facets": "rating,title_type,country,category,release_year", "release_year__gte": 2015}), repeat
+    )
+    cases["GET /netflix/titles/{show_id}"] = (lambda i: request("GET", "/netflix/titles/%s" % show_ids[i]), repeat)
+    cases["GET /netflix/stats"] = (lambda i: request("GET", "/netflix/stats"), repeat)
+    cases["GET /netflix/stats [release_year range]"] = (lambda i: request("GET", "/netflix/stats", params={"release_year__gte": 2015}), repeat)
+    # the whole catalog, once
+    cases["GET /netflix/titles/export"] = (lambda i: request("GET", "/netflix/titles/export"), 1)
+    for url in ["/cache/stats", "/auth/stats", "/startup/stats", "/db/stats"]:
+        cases["GET %s" % url] = (lambda i, url=url: request("GET", url), repeat)
+
+    created = new_rows(size, 3, repeat + 1)
+    cases["POST /netflix/titles/"] = (lambda i: request("POST", "/netflix/titles/", json=title_payload(created[i])), repeat)
+    replacements = new_rows(size, 4, repeat + 1)
+    cases["PUT /netflix/titles/{show_id}"] = (lambda i: request("PUT", "/netflix/titles/%s" % show_ids[i], json=title_payload(replacements[i], show_id=False)), repeat)
+    cases["PATCH /netflix/titles/{show_id}"] = (
+        lambda i: request("PATCH", "/netflix/titles/%s" % show_ids[i], json={"title": "Patched %d" % i, "cast": [person_name(i)]}), repeat
+    )
+    # half new titles, half updates of existing ones
+    bulk_repeat = max(1, repeat // 4)
+    bulk = [
+        [ title_payload(row) for row in new_rows(size, 5 + i, BULK_ITEMS // 2) ]
+        + [ dict(title_payload(row), show_id="s%d" % rng.randint(1, size)) for row in new_rows(size, 50 + i, BULK_ITEMS // 2) ]
+        for i in range(bulk_repeat + 1)
+    ]
+    cases["POST /netflix/titles/bulk [%d items]" % BULK_ITEMS] = (lambda i: request("POST", "/netflix/titles/bulk", json=bulk[i]), bulk_repeat)
+
+    def upload(i):
+        csv_file = io.StringIO()
+        write_kaggle_csv(csv_file, UPLOAD_ROWS, seed=SEED + 200 + i, start=size + (200 + i) * 1000000 + 1)
+        request("POST", "/netflix/titles/upload", files={"file": ("netflix_titles.csv", csv_file.getvalue().encode("utf-8"), "text/csv")})
+
+    cases["POST /netflix/titles/upload [%d rows]" % UPLOAD_ROWS] = (upload, bulk_repeat)
+    cases["POST /users/"] = (lambda i: request("POST", "/users/", json={"username": "route%d" % i, "email": "route%d@example.com" % i, "password": PASSWORD}), min(repeat, 5))
+    return cases
+
+def run_route_cases(size: int, repeat: int):
+    from fastapi.testclient import TestClient
+
+    from app import main
+
+    results = {}
+    with TestClient(main.app) as client:
+        token = client.post("/token", data={"username": "bench", "password": PASSWORD}).json()["access_token"]
+        headers = {"Authorization": "Bearer " + token}
+        for name, (run, case_repeat) in route_cases(client, headers, size, repeat).items():
+            results[name] = measure(run, case_repeat)
+    return results
+
+def reset_database(engine):
+    from sqlalchemy import text
+
+    from app import cache
+
+    if engine.dialect.name == "postgresql":
+        with engine.begin() as connection:
+            connection.execute(text("DROP SCHEMA public CASCADE"))
+            connection.execute(text("CREATE SCHEMA public"))
+    else:
+        engine.dispose()
+        if os.path.exists(engine.url.database):
+            os.remove(engine.url.database)
+    # ids from the previous catalog
+    cache.dimension_cache.clear()
+    cache.response_cache.clear()
+    cache.token_cache.clear()
+    cache.user_cache.clear()
+
+def run_size(size: int, repeat: int):
+    from app import crud, schema, schemas
+    from app.database import SessionLocal, engine
+
+    reset_database(engine)
+    schema.init_schema(engine)
+    start = time.perf_counter()
+    load_catalog(engine, size, seed=SEED)
+    load_seconds = time.perf_counter() - start
+    with SessionLocal() as db:
+        crud.create_user(db, schemas.UserCreate(username="bench", email="bench@example.com", password=PASSWORD))
+
+    cases = run_crud_cases(size, repeat)
+    cases.update(run_route_cases(size, repeat))
+    return {"load_seconds": round(load_seconds, 3), "cases": cases}
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run(sizes: list, repeat: int):
+    import sqlalchemy
+
+    from app.database import engine
+
+    results = {
+        "meta": {
+            "started_at": datetime.datetime.utcnow().isoformat(timespec="seconds") + "Z",
+            "commit": git_commit(),
+            "dialect": engine.dialect.name,
+            "python": platform.python_version(),
+            "sqlalchemy": sqlalchemy.__version__,
+            "machine": platform.machine(),
+            "cpus": os.cpu_count(),
+            "seed": SEED,
+            "repeat": repeat,
+        },
+        "sizes": {},
+    }
+    for size in sizes:
+        results["sizes"][str(size)] = run_size(size, repeat)
+        print("%d titles done" % size, file=sys.stderr)
+    return results
+
+def compare(baseline: dict, current: dict, threshold: float, min_ms: float):
+    # [(size, case, baseline median ms, current median ms, ratio, regressed)] for the cases in both runs
+    rows = []
+    for size, results in current["sizes"].items():
+        baseline_cases = baseline["sizes"].get(size, {}).get("cases", {})
+        for case, result in results["cases"].items():
+            if case not in baseline_cases:
+                continue
+            before, after = baseline_cases[case]["median_ms"], result["median_ms"]
+            ratio = after / before if before else float("inf")
+            rows.append((size, case, before, after, ratio, after > before * threshold and after - before > min_ms))
+    return rows
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="crud and route benchmark on generated Netflix catalogs.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    run_parser = subparsers.add_parser("run")
+    run_parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000, 1000000])
+    run_parser.add_argument("--repeat", type=int, default=20)
+    run_parser.add_argument("--out", help="file for the JSON results (default: stdout)")
+    compare_parser = subparsers.add_parser("compare")
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("current")
+    compare_parser.add_argument("--threshold", type=float, default=1.25)
+    compare_parser.add_argument("--min-ms", type=float, default=1.0)
+    args = parser.parse_args(argv)
+
+    if args.command == "compare":
+        with io.open(args.baseline) as baseline_file, io.open(args.current) as current_file:
+            baseline, current = json.load(baseline_file), json.load(current_file)
+        if baseline["meta"]["dialect"] != current["meta"]["dialect"]:
+            print("warning: comparing %s with %s" % (baseline["meta"]["dialect"], current["meta"]["dialect"]), file=sys.stderr)
+        rows = compare(baseline, current, args.threshold, args.min_ms)
+        for size, case, before, after, ratio, regressed in rows:
+            print("%8s  %-55s %10.2fms %10.2fms %6.2fx%s" % (size, case, before, after, ratio, "  REGRESSION" if regressed else ""))
+        regressions = sum(1 for row in rows if row[-1])
+        print("%d cases compared, %d regressions" % (len(rows), regressions))
+        sys.exit(1 if regressions else 0)
+
+    out_path = os.path.abspath(args.out) if args.out else None
+    with tempfile.TemporaryDirectory() as directory:
+        # the SQLite option opens ./sql_app.db, keep it in the temp directory
+        if os.environ["DB_CONNECTION_OPTION"] == "SQLITE":
+            os.chdir(directory)
+        results = run(args.sizes, args.repeat)
+        os.chdir(os.path.dirname(directory))
+    body = json.dumps(results, indent=2)
+    if out_path:
+        with io.open(out_path, "w") as out:
+            out.write(body + "\n")
+    else:
+        print(body)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+import argparse
+import os
+import sys
+import tempfile
+
+os.environ.setdefault("DB_CONNECTION_OPTION", "SQLITE")
+
+from sqlalchemy import create_engine, insert, select, text, update
+
+from app import filters, models, schema
+from benchmarks.generate import insert_titles
+from benchmarks.junction_benchmark import insert_junctions
+
+# Query plan check for the title filters (app/filters.py), meant for CI: exits 1 when a filter's
+# SQLite plan doesn't use the index it is supposed to or scans netflix_titles.
+#
+# Usage (from fast_project):
+#   python -m benchmarks.filter_plans --titles 20000
+# Runs against a fresh SQLite file in a temp directory (ANALYZEd, so the planner sees real statistics).
+# tests/test_filter_plans.py asserts the same CASES.
+
+# (filters, index names the plan has to use)
+CASES = [
+    ([("rating", "TV-MA")], ["ix_netflix_titles_rating_id", "ix_netflix_ratings_name"]),
+    ([("title_type__in", ["Movie"]), ("release_year", 2001)], ["ix_netflix_titles_release_year"]),
+    ([("release_year__gte", 2019), ("release_year__lte", 2020)], ["ix_netflix_titles_release_year"]),
+    ([("date_added__gte", "2021-01-01")], ["ix_netflix_titles_date_added"]),
+    ([("country", "Country 7")], ["ix_netflix_title_country_junction_country_id_title_id", "ix_netflix_countries_name"]),
+    ([("category__in", ["Category 1", "Category 2"])], ["ix_netflix_title_category_junction_category_id_title_id"]),
+    ([("cast", "Name 42")], ["ix_netflix_title_cast_junction_cast_id_title_id", "ix_netflix_names_name"]),
+    ([("director", "Name 42"), ("release_year__gte", 2000)], ["ix_netflix_title_director_junction_director_id_title_id"]),
+]
+
+def load_catalog(engine, size: int):
+    insert_titles(engine, size)
+    insert_junctions(engine, size)
+    with engine.begin() as connection:
+        connection.execute(insert(models.NetflixTitleType), [ {"name": name} for name in ["Movie", "TV Show"] ])
+        connection.execute(insert(models.NetflixRating), [ {"name": name} for name in ["G", "PG", "PG-13", "R", "TV-14", "TV-MA", "TV-PG", "TV-Y", "TV-Y7", "NR"] ])
+        title = models.NetflixTitle.__table__
+        connection.execute(update(title).values(
+            title_type_id=title.c.id % 2 + 1,
+            rating_id=title.c.id % 10 + 1,
+            date_added=text("date('2008-01-01', '+' || (id % 5000) || ' days')"),
+        ))
+        connection.execute(text("ANALYZE"))
+
+def query_plan(engine, query):
+    compiled = query.compile(engine, compile_kwargs={"literal_binds": True})
+    with engine.connect() as connection:
+        return [ row[-1] for row in connection.execute(text("EXPLAIN QUERY PLAN %s" % compiled)) ]
+
+def check_plan(engine, fields: list, indexes: list):
+    # (plan, indexes the plan doesn't use, full scans of netflix_titles) for one case
+    query = filters.apply_netflix_title_filters(select(models.NetflixTitle.id), fields)
+    plan = query_plan(engine, query)
+    missing = [ index for index in indexes if not any(index in step for step in plan) ]
+    scans = [ step for step in plan if step.startswith("SCAN netflix_titles") ]
+    return plan, missing, scans
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Check that the title filters compile to index backed plans.")
+    parser.add_argument("--titles", type=int, default=20000)
+    args = parser.parse_args(argv)
+
+    failures = 0
+    with tempfile.TemporaryDirectory() as directory:
+        engine = create_engine("sqlite:///%s" % os.path.join(directory, "filter_plans.db"))
+        schema.init_schema(engine)
+        load_catalog(engine, args.titles)
+        for fields, indexes in CASES:
+            plan, missing, scans = check_plan(engine, fields, indexes)
+            ok = not missing and not scans
+            failures += not ok
+            print("%s %s" % ("ok  " if ok else "FAIL", ", ".join("%s=%s" % field for field in fields)))
+            for step in plan:
+                print("       " + step)
+            if missing:
+                print("       missing: " + ", ".join(missing))
+        engine.dispose()
+    if failures:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,216 @@
+import argparse
+import csv
+import datetime
+import io
+import random
+import sys
+
+from sqlalchemy import insert
+
+# Deterministic synthetic netflix catalog for benchmarks - same seed, same catalog.
+# title_rows/insert_titles fill netflix_titles only; catalog_rows/load_catalog build the whole
+# Kaggle shaped catalog (types, ratings, people, countries, categories) and load it with the app's
+# own loader, see endpoint_benchmark.py.
+
+WORDS = [
+    "love", "family", "war", "city", "secret", "night", "dog", "house", "island", "murder",
+    "detective", "school", "summer", "kingdom", "journey", "ghost", "music", "football", "chef", "robot",
+    "mystery", "brother", "sister", "dream", "road", "river", "space", "time", "queen", "village",
+    "comedy", "heist", "teacher", "doctor", "prison", "ocean", "mountain", "wedding", "revenge", "friend",
+]
+
+SYLLABLES = ["ka", "lo", "mi", "ra", "ten", "vo", "shi", "dan", "el", "qu", "ber", "zo", "nia", "pet", "ux", "gar"]
+
+def vocabulary(size: int = 5000):
+    # the real words plus made up ones; word i is drawn with weight 1/(i+1) (zipf-like) so a few
+    # words are everywhere and most are rare, roughly like the kaggle descriptions
+    rng = random.Random(0)
+    words = list(WORDS)
+    seen = set(words)
+    while len(words) < size:
+        word = "".join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4)))
+        if word not in seen:
+            seen.add(word)
+            words.append(word)
+    rng.shuffle(words)
+    cumulative_weights = []
+    total = 0.0
+    for i in range(len(words)):
+        total += 1.0 / (i + 1)
+        cumulative_weights.append(total)
+    return words, cumulative_weights
+
+VOCABULARY, CUMULATIVE_WEIGHTS = vocabulary()
+
+def sentence(rng: random.Random, length: int):
+    return " ".join(rng.choices(VOCABULARY, cum_weights=CUMULATIVE_WEIGHTS, k=length))
+
+def title_rows(count: int, seed: int = 42, start: int = 1):
+    # netflix_titles rows only (no dimensions or junctions), generated lazily
+    rng = random.Random(seed)
+    for i in range(start, start + count):
+        yield {
+            "show_id": "s%d" % i,
+            "title": sentence(rng, rng.randint(1, 4)).title(),
+            "release_year": rng.randint(1940, 2021),
+            "duration": rng.randint(60, 180),
+            "description": sentence(rng, 20),
+        }
+
+def insert_titles(engine, count: int, seed: int = 42, batch_size: int = 10000):
+    from app import models
+    batch = []
+    with engine.begin() as connection:
+        for row in title_rows(count, seed=seed):
+            batch.append(row)
+            if len(batch) >= batch_size:
+                connection.execute(insert(models.NetflixTitle), batch)
+                batch = []
+        if batch:
+            connection.execute(insert(models.NetflixTitle), batch)
+
+
+# Kaggle shaped catalog: roughly the kaggle mix of types and ratings, and skewed lists - a few
+# people, countries and categories are on a large share of the titles, most are on a handful.
+
+TITLE_TYPES = ["Movie", "TV Show"]
+TITLE_TYPE_WEIGHTS = [70, 30]
+
+RATINGS = ["TV-MA", "TV-14", "TV-PG", "R", "PG-13", "TV-Y7", "TV-Y", "PG", "TV-G", "NR", "G"]
+RATING_WEIGHTS = [36, 25, 10, 9, 6, 4, 3, 3, 2, 1, 1]
+
+COUNTRIES = [
+    "United States", "India", "United Kingdom", "Canada", "France", "Japan", "Spain", "South Korea",
+    "Germany", "Mexico", "China", "Australia", "Egypt", "Turkey", "Hong Kong", "Nigeria", "Italy",
+    "Brazil", "Argentina", "Belgium", "Indonesia", "Taiwan", "Philippines", "Thailand", "South Africa",
+] + [ "Country %d" % i for i in range(95) ]
+
+CATEGORIES = [
+    "International Movies", "Dramas", "Comedies", "International TV Shows", "Documentaries",
+    "Action & Adventure", "TV Dramas", "Independent Movies", "Children & Family Movies", "Romantic Movies",
+    "Thrillers", "TV Comedies", "Crime TV Shows", "Kids' TV", "Docuseries", "Music & Musicals",
+    "Romantic TV Shows", "Horror Movies", "Stand-Up Comedy", "Reality TV", "British TV Shows",
+    "Sci-Fi & Fantasy", "Sports Movies", "Anime Series", "Spanish-Language TV Shows", "TV Action & Adventure",
+    "Korean TV Shows", "Classic Movies", "LGBTQ Movies", "TV Mysteries", "Science & Nature TV",
+    "TV Sci-Fi & Fantasy", "TV Horror", "Cult Movies", "Anime Features", "Teen TV Shows", "Faith & Spirituality",
+    "TV Thrillers", "Stand-Up Comedy & Talk Shows", "Classic & Cult TV", "Movies", "TV Shows",
+]
+
+FIRST_NAMES = [
+    "Anna", "Ben", "Carlos", "Dana", "Emeka", "Fatima", "Gao", "Hana", "Ivan", "Jun", "Kemal", "Lucia",
+    "Maya", "Nikhil", "Olga", "Pedro", "Rin", "Sofia", "Tariq", "Uma", "Vera", "Wei", "Yara", "Zoe",
+]
+
+# people per title in the catalog (kaggle has about 4 names per title)
+NAMES_PER_TITLE = 2
+# higher is more skewed: the first of n items gets about 1 / n ** (1 / skew) of the draws
+PEOPLE_SKEW = 1.5
+LIST_SKEW = 2.5
+
+def person_name(i: int):
+    # unique for every i: a first name plus a surname spelled from i's base 16 digits
+    i, first = divmod(i, len(FIRST_NAMES))
+    surname = SYLLABLES[i % 16]
+    i //= 16
+    while i:
+        i, digit = divmod(i, 16)
+        surname += SYLLABLES[digit]
+    return "%s %s" % (FIRST_NAMES[first], surname.title())
+
+def skewed_indexes(rng: random.Random, size: int, count: int, skew: float):
+    # count distinct indexes below size, low ones far more likely
+    chosen = {}
+    while len(chosen) < min(count, size):
+        chosen.setdefault(int(size * rng.random() ** skew), None)
+    return list(chosen)
+
+def skewed_sample(rng: random.Random, items: list, count: int):
+    return [ items[index] for index in skewed_indexes(rng, len(items), count, LIST_SKEW) ]
+
+def skewed_names(rng: random.Random, people: int, count: int):
+    return [ person_name(index) for index in skewed_indexes(rng, people, count, PEOPLE_SKEW) ]
+
+def catalog_rows(count: int, seed: int = 42, start: int = 1):
+    # parsed rows (same keys as ingest.parse_kaggle_row), generated lazily
+    rng = random.Random(seed)
+    people = max(1000, count * NAMES_PER_TITLE)
+    first_day = datetime.date(2008, 1, 1).toordinal()
+    for i in range(start, start + count):
+        title_type = rng.choices(TITLE_TYPES, weights=TITLE_TYPE_WEIGHTS)[0]
+        movie = title_type == "Movie"
+        yield {
+            "show_id": "s%d" % i,
+            "title_type": title_type,
+            "title": sentence(rng, rng.randint(1, 4)).title(),
+            "directors": skewed_names(rng, people, 1 if movie and rng.random() < 0.9 else 0),
+            "cast": skewed_names(rng, people, rng.choice([0, 2, 4, 6, 8, 10])),
+            "countries": skewed_sample(rng, COUNTRIES, rng.choices([0, 1, 2, 3], weights=[10, 70, 15, 5])[0]),
+            "date_added": datetime.date.fromordinal(first_day + rng.randint(0, 5000)) if rng.random() < 0.99 else None,
+            "release_year": 2021 - int(80 * rng.random() ** 2),
+            "rating": rng.choices(RATINGS, weights=RATING_WEIGHTS)[0],
+            "duration": rng.randint(60, 180) if movie else None,
+            "seasons": None if movie else 1 + int(8 * rng.random() ** 3),
+            "categories": skewed_sample(rng, CATEGORIES, rng.randint(1, 3)),
+            "description": sentence(rng, 20),
+        }
+
+def load_catalog(engine, count: int, seed: int = 42, chunk_size: int = 1000):
+    # through ingest.ingest_chunk, so the junctions, dimensions and stats rollups are what the app writes
+    from sqlalchemy.orm import Session
+
+    from app import ingest
+    chunk = []
+    with Session(engine) as db:
+        for row in catalog_rows(count, seed=seed):
+            chunk.append(row)
+            if len(chunk) >= chunk_size:
+                ingest.ingest_chunk(db, chunk)
+                db.commit()
+                chunk = []
+        if chunk:
+            ingest.ingest_chunk(db, chunk)
+            db.commit()
+
+def kaggle_row(row: dict):
+    # a parsed row back in the kaggle csv columns
+    from app import export
+    return {
+        "show_id": row["show_id"],
+        "type": row["title_type"],
+        "title": row["title"],
+        "director": ", ".join(row["directors"]),
+        "cast": ", ".join(row["cast"]),
+        "country": ", ".join(row["countries"]),
+        "date_added": export.format_date_added(row["date_added"]),
+        "release_year": str(row["release_year"]),
+        "rating": row["rating"],
+        "duration": export.format_duration(row["duration"], row["seasons"]),
+        "listed_in": ", ".join(row["categories"]),
+        "description": row["description"],
+    }
+
+def write_kaggle_csv(out, count: int, seed: int = 42, start: int = 1):
+    from app import ingest
+    writer = csv.DictWriter(out, fieldnames=ingest.KAGGLE_COLUMNS)
+    writer.writeheader()
+    for row in catalog_rows(count, seed=seed, start=start):
+        writer.writerow(kaggle_row(row))
+
+# The catalog as a kaggle csv, e.g. for python -m app.ingest or POST /netflix/titles/upload
+# Usage (from fast_project): python -m benchmarks.generate netflix_titles.csv --titles 100000
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Write a synthetic Kaggle shaped Netflix catalog csv.")
+    parser.add_argument("out_path", help="file to write, - for stdout")
+    parser.add_argument("--titles", type=int, default=10000)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args(argv)
+
+    out = sys.stdout if args.out_path == "-" else io.open(args.out_path, "w", encoding="utf-8", newline="")
+    try:
+        write_kaggle_csv(out, args.titles, seed=args.seed)
+    finally:
+        if out is not sys.stdout:
+            out.close()
+
+if __name__ == "__main__":
+    main()
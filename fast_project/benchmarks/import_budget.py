@@ -0,0 +1,84 @@
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+# Import time check for app.main, meant for CI: exits 1 when the import is over budget, builds the
+# database engines or pulls in a database driver - those belong to the app's startup (database.get_engines),
+# whatever DB_CONNECTION_OPTION is.
+#
+# Usage (from fast_project):
+#   python -m benchmarks.import_budget --budget-ms 1500 --option CLOUD_SQL_CONNECTOR
+# tests/test_import_budget.py runs the same check with the default budget for each option.
+# Each run is a fresh interpreter with -X importtime; the median of --runs is compared to the budget.
+
+# Postgres drivers and the Cloud SQL connector (which brings aiohttp), imported when the engines are built
+FORBIDDEN_MODULES = ["pg8000", "asyncpg", "google.cloud.sql.connector", "aiohttp"]
+
+BUDGET_MS = float(os.environ.get("IMPORT_BUDGET_MS", 1500))
+
+OPTIONS = ["SQLITE", "CLOUD_SQL_CONNECTOR", "PRIVATE_IP"]
+
+IMPORT_APP_MAIN = (
+    "import json, sys, app.main\n"
+    "from app import database\n"
+    "print(json.dumps({'modules': list(sys.modules), 'engines_created': database.engines_created()}))"
+)
+
+def import_app_main(option: str = None):
+    # (cumulative import time of app.main in ms, loaded modules, whether the engines were built)
+    env = dict(os.environ)
+    if option is not None:
+        env["DB_CONNECTION_OPTION"] = option
+    env.setdefault("DB_CONNECTION_OPTION", "SQLITE")
+    env.setdefault("JWT_SECRET_KEY", "import-budget")
+    env.setdefault("JWT_ALGORITHM", "HS256")
+    env.setdefault("JWT_ACCESS_TOKEN_EXPIRE_MINUTES", "30")
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", IMPORT_APP_MAIN],
+        env=env, capture_output=True, text=True, check=True,
+    )
+    for line in result.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        parts = line.split("|")
+        if len(parts) == 3 and parts[2].strip() == "app.main":
+            loaded = json.loads(result.stdout)
+            return int(parts[1]) / 1000, set(loaded["modules"]), loaded["engines_created"]
+    raise RuntimeError("no import time reported for app.main")
+
+def check(budget_ms: float, runs: int = 3, option: str = None):
+    # (ok, report): the median of runs fresh imports against budget_ms, the forbidden modules loaded and
+    # whether the engines were built
+    timings = []
+    modules = set()
+    engines_created = False
+    for _ in range(runs):
+        import_ms, modules, engines_created = import_app_main(option)
+        timings.append(import_ms)
+    median_ms = statistics.median(timings)
+    forbidden = [ module for module in FORBIDDEN_MODULES if module in modules ]
+    report = {
+        "median_ms": round(median_ms, 1),
+        "runs_ms": [ round(timing, 1) for timing in timings ],
+        "budget_ms": budget_ms,
+        "forbidden_modules": forbidden,
+        "engines_created": engines_created,
+    }
+    return median_ms <= budget_ms and not forbidden and not engines_created, report
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Fail when importing app.main is over budget.")
+    parser.add_argument("--budget-ms", type=float, default=BUDGET_MS)
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--option", choices=OPTIONS, help="DB_CONNECTION_OPTION to import with (default: the environment's, else SQLITE)")
+    args = parser.parse_args(argv)
+
+    ok, report = check(args.budget_ms, args.runs, args.option)
+    print(json.dumps(report, indent=2))
+    if not ok:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+import argparse
+import io
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+from benchmarks.endpoint_benchmark import PASSWORD, SEED, git_commit, reset_database
+from benchmarks.generate import load_catalog
+
+# CPU per /netflix/titles/ page for the full shape (ORM instances, NetflixTitleResponse.from_orm, jsonable_encoder),
+# format=compact (row tuples, plain dicts, orjson) and a narrow fields=show_id,title,release_year listing.
+# Each page is timed in process CPU (time.process_time, so waiting on the database doesn't count) and wall
+# time, split into the crud call and building the body, on a fresh session like a request gets; then the
+# whole route through TestClient with the response cache off.
+#
+# Usage (from fast_project):
+#   python -m benchmarks.serialize_benchmark --titles 10000 --limit 100 --pages 50 --out serialize.json
+
+SHAPES = ["full", "compact", "narrow"]
+
+NARROW_FIELDS = ["show_id", "title", "release_year"]
+
+def page_full(db, skip: int, limit: int):
+    from app import crud, main, schemas
+
+    started = time.process_time()
+    netflix_titles = crud.get_netflix_titles(db, skip=skip, limit=limit, netflix_title_filter=main.NetflixTitleFilter())
+    queried = time.process_time()
+    body = main.json_body([ schemas.NetflixTitleResponse.from_orm(netflix_title) for netflix_title in netflix_titles ])
+    return queried - started, time.process_time() - queried, body
+
+def page_rows(db, skip: int, limit: int, fields: list):
+    from app import crud, main
+
+    started = time.process_time()
+    rows, names = crud.get_netflix_title_rows(db, fields=fields, skip=skip, limit=limit, netflix_title_filter=main.NetflixTitleFilter())
+    queried = time.process_time()
+    body = main.fast_json_body([ crud.netflix_title_fields_dict(row, fields, names) for row in rows ])
+    return queried - started, time.process_time() - queried, body
+
+def page_compact(db, skip: int, limit: int):
+    from app import crud
+
+    return page_rows(db, skip, limit, crud.NETFLIX_TITLE_FIELDS)
+
+def page_narrow(db, skip: int, limit: int):
+    return page_rows(db, skip, limit, NARROW_FIELDS)
+
+PAGES = {"full": page_full, "compact": page_compact, "narrow": page_narrow}
+
+ROUTE_PARAMS = {"full": {}, "compact": {"format": "compact"}, "narrow": {"format": "compact", "fields": ",".join(NARROW_FIELDS)}}
+
+def median_ms(values: list):
+    return round(statistics.median(values) * 1000, 3)
+
+def run_crud(shape: str, skips: list, limit: int):
+    from app.database import SessionLocal
+
+    query_cpu, serialize_cpu, wall = [], [], []
+    body = b""
+    # one warmup page
+    for i, skip in enumerate([skips[-1]] + skips):
+        with SessionLocal() as db:
+            started = time.perf_counter()
+            query_seconds, serialize_seconds, body = PAGES[shape](db, skip, limit)
+            elapsed = time.perf_counter() - started
+        if i:
+            query_cpu.append(query_seconds)
+            serialize_cpu.append(serialize_seconds)
+            wall.append(elapsed)
+    return {
+        "query_cpu_ms": median_ms(query_cpu),
+        "serialize_cpu_ms": median_ms(serialize_cpu),
+        "cpu_ms": median_ms([ query + serialize for query, serialize in zip(query_cpu, serialize_cpu) ]),
+        "wall_ms": median_ms(wall),
+        "bytes": len(body),
+    }
+
+def run_route(client, headers: dict, shape: str, skips: list, limit: int):
+    cpu, wall = [], []
+    for i, skip in enumerate([skips[-1]] + skips):
+        started, cpu_started = time.perf_counter(), time.process_time()
+        response = client.get("/netflix/titles/", params=dict(ROUTE_PARAMS[shape], skip=skip, limit=limit), headers=headers)
+        if response.status_code != 200:
+            raise RuntimeError("%s: %d %s" % (shape, response.status_code, response.text[:200]))
+        if i:
+            cpu.append(time.process_time() - cpu_started)
+            wall.append(time.perf_counter() - started)
+    return {"cpu_ms": median_ms(cpu), "wall_ms": median_ms(wall)}
+
+def run(titles: int, limit: int, pages: int):
+    from fastapi.testclient import TestClient
+
+    from app import crud, main, schema, schemas
+    from app.database import SessionLocal, engine
+
+    reset_database(engine)
+    schema.init_schema(engine)
+    load_catalog(engine, titles, seed=SEED)
+    with SessionLocal() as db:
+        crud.create_user(db, schemas.UserCreate(username="bench", email="bench@example.com", password=PASSWORD))
+
+    # pages spread over the catalog
+    skips = [ (i * (titles - limit)) // max(1, pages - 1) for i in range(pages) ]
+    results = {
+        "meta": {"commit": git_commit(), "dialect": engine.dialect.name, "titles": titles, "limit": limit, "pages": pages},
+        "crud": { shape: run_crud(shape, skips, limit) for shape in SHAPES },
+    }
+    with TestClient(main.app) as client:
+        token = client.post("/token", data={"username": "bench", "password": PASSWORD}).json()["access_token"]
+        headers = {"Authorization": "Bearer " + token}
+        results["route"] = { shape: run_route(client, headers, shape, skips, limit) for shape in SHAPES }
+    return results
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="CPU per /netflix/titles/ page, full vs format=compact vs narrow fields.")
+    parser.add_argument("--titles", type=int, default=10000)
+    parser.add_argument("--limit", type=int, default=100)
+    parser.add_argument("--pages", type=int, default=50)
+    parser.add_argument("--out", help="file for the JSON results (default: stdout)")
+    args = parser.parse_args(argv)
+
+    out_path = os.path.abspath(args.out) if args.out else None
+    with tempfile.TemporaryDirectory() as directory:
+        # the SQLite option opens ./sql_app.db, keep it in the temp directory
+        if os.environ["DB_CONNECTION_OPTION"] == "SQLITE":
+            os.chdir(directory)
+        results = run(args.titles, args.limit, args.pages)
+        os.chdir(os.path.dirname(directory))
+    for section in ["crud", "route"]:
+        for shape in SHAPES:
+            print("%-6s %-8s %s" % (section, shape, "  ".join("%s=%s" % item for item in results[section][shape].items())), file=sys.stderr)
+    body = json.dumps(results, indent=2)
+    if out_path:
+        with io.open(out_path, "w") as out:
+            out.write(body + "\n")
+    else:
+        print(body)
+
+if __name__ == "__main__":
+    main()
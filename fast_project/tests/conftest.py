@@ -0,0 +1,85 @@
+import os
+import shutil
+import tempfile
+
+import pytest
+
+# The app reads its settings at import.  Tests run on SQLite, which opens ./sql_app.db, so the
+# working directory is moved to a scratch directory before the tests import the app (SQLAlchemy makes the path
+# absolute when the engine is created).
+os.environ.setdefault("DB_CONNECTION_OPTION", "SQLITE")
+os.environ.setdefault("JWT_SECRET_KEY", "tests")
+os.environ.setdefault("JWT_ALGORITHM", "HS256")
+os.environ.setdefault("JWT_ACCESS_TOKEN_EXPIRE_MINUTES", "30")
+
+PROJECT_DIRECTORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCRATCH_DIRECTORY = tempfile.mkdtemp(prefix="movie-data-tests-")
+
+def pytest_sessionstart(session):
+    os.chdir(SCRATCH_DIRECTORY)
+
+def pytest_sessionfinish(session):
+    os.chdir(PROJECT_DIRECTORY)
+    shutil.rmtree(SCRATCH_DIRECTORY, ignore_errors=True)
+
+def reset_caches():
+    from app import cache
+
+    # ids and responses from the previous test's database
+    cache.dimension_cache.clear()
+    cache.response_cache.clear()
+    cache.token_cache.clear()
+    cache.user_cache.clear()
+
+@pytest.fixture
+def engine():
+    # the app's sync engine on a new, empty schema
+    from app import database, schema
+
+    database.engine.dispose()
+    if os.path.exists("sql_app.db"):
+        os.remove("sql_app.db")
+    reset_caches()
+    schema.init_schema(database.engine)
+    yield database.engine
+    database.engine.dispose()
+    reset_caches()
+
+@pytest.fixture
+def db(engine):
+    from app.database import SessionLocal
+
+    with SessionLocal() as session:
+        yield session
+
+class StatementLog:
+    # SQL statements and commits on an engine, see the statements fixture
+
+    def __init__(self):
+        self.statements = []
+        self.commits = 0
+
+    def clear(self):
+        self.statements = []
+        self.commits = 0
+
+    def __len__(self):
+        return len(self.statements)
+
+@pytest.fixture
+def statements(engine):
+    from sqlalchemy import event
+
+    log = StatementLog()
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        log.statements.append(statement)
+
+    def commit(conn):
+        log.commits += 1
+
+    event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    event.listen(engine, "commit", commit)
+    yield log
+    event.remove(engine, "before_cursor_execute", before_cursor_execute)
+    event.remove(engine, "commit", commit)
@@ -0,0 +1,33 @@
+import asyncio
+import os
+
+from sqlalchemy import text
+
+from app import database
+
+# Engines built straight from the factories (not through create_engines/instrument_pool) still count
+# checkout waits into the pool's own timings.
+
+def test_factory_engine_connects(tmp_path):
+    engine = database.get_sqlite_engine(os.path.join(tmp_path, "factory.db"))
+    with engine.connect() as connection:
+        assert connection.execute(text("select 1")).scalar() == 1
+    assert engine.pool.timings.wait.stats()["count"] == 1
+    engine.dispose()
+    # dispose() swaps in a new pool that keeps the timings
+    with engine.connect() as connection:
+        connection.execute(text("select 1"))
+    assert engine.pool.timings.wait.stats()["count"] == 2
+    engine.dispose()
+
+def test_factory_async_engine_connects(tmp_path):
+    async_engine = database.get_sqlite_async_engine(os.path.join(tmp_path, "factory.db"))
+
+    async def select_one():
+        async with async_engine.connect() as connection:
+            result = (await connection.execute(text("select 1"))).scalar()
+        await async_engine.dispose()
+        return result
+
+    assert asyncio.run(select_one()) == 1
+    assert async_engine.sync_engine.pool.timings.wait.stats()["count"] == 1
@@ -0,0 +1,26 @@
+import os
+
+import pytest
+from sqlalchemy import create_engine
+
+from app import schema
+from benchmarks import filter_plans
+
+# Each title filter has to compile to a SQLite plan that uses its index and never scans netflix_titles
+# (the cases are benchmarks.filter_plans.CASES, run against an ANALYZEd generated catalog).
+
+TITLES = 5000
+
+@pytest.fixture(scope="module")
+def plan_engine(tmp_path_factory):
+    engine = create_engine("sqlite:///%s" % os.path.join(tmp_path_factory.mktemp("filter_plans"), "filter_plans.db"))
+    schema.init_schema(engine)
+    filter_plans.load_catalog(engine, TITLES)
+    yield engine
+    engine.dispose()
+
+@pytest.mark.parametrize("fields, indexes", filter_plans.CASES, ids=[ ",".join(name for name, _ in fields) for fields, _ in filter_plans.CASES ])
+def test_filter_plan(plan_engine, fields, indexes):
+    plan, missing, scans = filter_plans.check_plan(plan_engine, fields, indexes)
+    assert missing == [], plan
+    assert scans == [], plan
@@ -0,0 +1,14 @@
+import os
+
+import pytest
+
+from benchmarks import import_budget
+
+@pytest.mark.parametrize("option", import_budget.OPTIONS)
+def test_import_budget(monkeypatch, option):
+    # fresh interpreters in the scratch directory, importing the app from the project
+    monkeypatch.setenv("PYTHONPATH", os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    ok, report = import_budget.check(import_budget.BUDGET_MS, option=option)
+    assert report["forbidden_modules"] == []
+    assert not report["engines_created"]
+    assert ok, report
@@ -0,0 +1,90 @@
+import asyncio
+
+import pytest
+
+from app import cache, database, main, replicas
+
+# Staleness after a write is tracked per client: the writer reads its own writes (primary, no cache) while
+# everyone else's replica reads keep being cached, for no longer than the replication lag window.
+
+class Clock:
+
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+class Session:
+    # what cached_json_response reads from the session, see database.AsyncReadSession
+
+    def __init__(self, client, replica):
+        self.info = {"client": client, "replica": replica}
+
+@pytest.fixture
+def clock():
+    return Clock()
+
+@pytest.fixture
+def replica_set(clock):
+    return replicas.ReplicaSet([replicas.Replica("replica1", None, None)], sticky_seconds=5, clock=clock)
+
+def test_pin_is_per_client(replica_set, clock):
+    replica = replica_set.replicas[0]
+    replica_set.pin("writer")
+    assert replica_set.choose("writer") is None
+    assert replica_set.choose("reader") is replica
+    assert replica_set.is_pinned("writer") and not replica_set.is_pinned("reader")
+    clock.now += 2
+    assert replica_set.stale_seconds(replica) == 3
+    assert replica_set.stale_seconds(None) == 0
+    clock.now += 3
+    assert not replica_set.is_pinned("writer")
+    assert replica_set.choose("writer") is replica
+    assert replica_set.stale_seconds(replica) == 0
+
+def test_response_cache_per_client(engine, replica_set, clock, monkeypatch):
+    monkeypatch.setattr(database, "replica_set", replica_set)
+    monkeypatch.setattr(cache, "response_cache", cache.ResponseCache(max_bytes=1024 * 1024, ttl_seconds=60, clock=clock))
+    bodies = iter([b"1", b"2", b"3", b"4"])
+
+    async def build():
+        return next(bodies), {}
+
+    def read(client):
+        session = Session(client, replica_set.choose(client))
+        response = asyncio.run(main.cached_json_response("key", build, db=session))
+        return response.headers["X-Cache"], response.body
+
+    replica_set.pin("writer")
+    # another client's replica read is cached, for the rest of the window
+    assert read("reader") == ("MISS", b"1")
+    assert read("other") == ("HIT", b"1")
+    # the writer doesn't get it, its read from the primary is cached as usual
+    assert read("writer") == ("MISS", b"2")
+    assert read("reader") == ("HIT", b"2")
+    clock.now += 5
+    assert read("writer") == ("HIT", b"2")
+    clock.now += 60
+    assert read("reader") == ("MISS", b"3")
+
+def test_replica_entry_expires_with_the_window(engine, replica_set, clock, monkeypatch):
+    monkeypatch.setattr(database, "replica_set", replica_set)
+    monkeypatch.setattr(cache, "response_cache", cache.ResponseCache(max_bytes=1024 * 1024, ttl_seconds=60, clock=clock))
+    bodies = iter([b"stale", b"fresh"])
+
+    async def build():
+        return next(bodies), {}
+
+    def read(client):
+        session = Session(client, replica_set.choose(client))
+        return asyncio.run(main.cached_json_response("key", build, db=session)).body
+
+    replica_set.pin("writer")
+    clock.now += 1
+    assert read("reader") == b"stale"
+    clock.now += 3
+    assert read("reader") == b"stale"
+    # the replica has caught up, the page is rebuilt
+    clock.now += 1
+    assert read("reader") == b"fresh"
@@ -0,0 +1,44 @@
+import os
+
+from sqlalchemy import create_engine, select, text
+from sqlalchemy.orm import Session
+
+from app import crud, fulltext, main, models, schema
+from benchmarks.generate import load_catalog
+
+# A database set up without the search index (SEARCH_BACKEND=ilike) gets it, backfilled, once the indexed
+# backend is asked for, although the schema version is current.
+
+def fts_table_exists(engine):
+    with engine.connect() as connection:
+        return connection.execute(text("SELECT 1 FROM sqlite_master WHERE name = 'netflix_titles_fts'")).first() is not None
+
+def test_search_index_added_after_ilike(tmp_path, monkeypatch):
+    engine = create_engine("sqlite:///%s" % os.path.join(tmp_path, "schema.db"))
+    monkeypatch.setattr(fulltext, "_backends", {})
+    monkeypatch.setenv("SEARCH_BACKEND", "ilike")
+    schema.init_schema(engine)
+    load_catalog(engine, 50, seed=42)
+    assert schema.read_schema_version(engine) == (schema.SCHEMA_VERSION, "ilike")
+    assert not fts_table_exists(engine)
+
+    monkeypatch.setenv("SEARCH_BACKEND", "auto")
+    fulltext._backends.clear()
+    assert schema.ensure_schema(engine)
+    assert schema.read_schema_version(engine) == (schema.SCHEMA_VERSION, "sqlite_fts5")
+    assert fulltext.get_search_backend(engine).name == "sqlite_fts5"
+    # the titles loaded before the index are found
+    with engine.connect() as connection:
+        title = connection.execute(select(models.NetflixTitle.title).where(models.NetflixTitle.show_id == "s7")).scalar()
+    with Session(engine) as db:
+        found = crud.get_netflix_titles(db, search=title, netflix_title_filter=main.NetflixTitleFilter())
+        assert "s7" in [ netflix_title.show_id for netflix_title in found ]
+    # later starts only read the version row
+    assert not schema.ensure_schema(engine)
+
+    # back to ilike needs nothing
+    monkeypatch.setenv("SEARCH_BACKEND", "ilike")
+    fulltext._backends.clear()
+    assert not schema.ensure_schema(engine)
+    assert fulltext.get_search_backend(engine).name == "ilike"
+    engine.dispose()
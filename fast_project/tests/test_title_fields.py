@@ -0,0 +1,41 @@
+import pytest
+from fastapi.testclient import TestClient
+
+from app import crud, main, schemas
+from benchmarks.generate import load_catalog
+
+# fields=... trims the body and the documented response model: the sparse models have no required fields.
+
+PASSWORD = "password"
+
+@pytest.fixture
+def client(engine, db):
+    load_catalog(engine, 20, seed=42)
+    crud.create_user(db, schemas.UserCreate(username="tests", email="tests@example.com", password=PASSWORD))
+    with TestClient(main.app) as client:
+        token = client.post("/token", data={"username": "tests", "password": PASSWORD}).json()["access_token"]
+        client.headers["Authorization"] = "Bearer " + token
+        yield client
+
+def response_refs(schema: dict):
+    content = schema["responses"]["200"]["content"]["application/json"]["schema"]
+    return { item.get("$ref", item.get("items", {}).get("$ref")) for item in content.get("anyOf", [content]) }
+
+def test_openapi_documents_sparse_responses():
+    openapi = main.app.openapi()
+    models = openapi["components"]["schemas"]
+    for name in ["NetflixTitleFieldsResponse", "NetflixTitleCompactFieldsResponse"]:
+        assert "required" not in models[name]
+    assert "#/components/schemas/NetflixTitleFieldsResponse" in response_refs(openapi["paths"]["/netflix/titles/{show_id}"]["get"])
+    assert {"#/components/schemas/NetflixTitleFieldsResponse", "#/components/schemas/NetflixTitleCompactFieldsResponse",
+            "#/components/schemas/NetflixTitleFieldsPage", "#/components/schemas/NetflixTitleCompactFieldsPage"} <= response_refs(openapi["paths"]["/netflix/titles/"]["get"])
+
+def test_fields_response_matches_sparse_model(client):
+    items = client.get("/netflix/titles/", params={"fields": "show_id,title,cast", "limit": 5}).json()
+    assert len(items) == 5
+    for item in items:
+        assert set(item) == {"show_id", "title", "cast"}
+        schemas.NetflixTitleFieldsResponse(**item)
+    item = client.get("/netflix/titles/s3", params={"fields": "title,rating"}).json()
+    assert set(item) == {"title", "rating"}
+    schemas.NetflixTitleFieldsResponse(**item)
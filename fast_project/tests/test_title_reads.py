@@ -0,0 +1,41 @@
+import pytest
+
+from app import crud, main, schemas
+from benchmarks.generate import load_catalog
+
+# Reads load everything the response serializes up front (see crud.netflix_title_load_options), so a page
+# is the same handful of statements whatever the limit: the titles joined to title type and rating, then
+# one IN query per collection (directors, cast, countries, categories).
+
+PAGE_STATEMENTS = 5
+
+@pytest.fixture
+def catalog(engine):
+    load_catalog(engine, 150, seed=42)
+    return engine
+
+def read_page(db, limit: int):
+    netflix_titles = crud.get_netflix_titles(db, skip=0, limit=limit, netflix_title_filter=main.NetflixTitleFilter())
+    # everything the response touches, nothing may lazy load
+    for netflix_title in netflix_titles:
+        schemas.NetflixTitleResponse.from_orm(netflix_title)
+    return netflix_titles
+
+@pytest.mark.parametrize("limit", [5, 100])
+def test_list_statements(catalog, db, statements, limit):
+    netflix_titles = read_page(db, limit)
+    assert len(netflix_titles) == limit
+    assert len(statements) == PAGE_STATEMENTS
+
+def test_detail_statements(catalog, db, statements):
+    netflix_title = crud.get_netflix_title_by_show_id(db, "s42")
+    schemas.NetflixTitleResponse.from_orm(netflix_title)
+    assert netflix_title.show_id == "s42"
+    assert len(statements) == PAGE_STATEMENTS
+
+@pytest.mark.parametrize("limit", [5, 100])
+def test_row_list_statements(catalog, db, statements, limit):
+    # format=compact: one query for the columns plus one per list
+    rows, names = crud.get_netflix_title_rows(db, limit=limit, netflix_title_filter=main.NetflixTitleFilter())
+    assert len(rows) == limit
+    assert len(statements) == 1 + len(crud.NETFLIX_TITLE_LIST_FIELDS)